@@ -0,0 +1,306 @@
+"""Compact analytics event storage.
+
+Event names and player ids are interned into dictionary tables (`analytics_event_names`,
+`analytics_players`) so each `analytics_events` row and both of its indexes carry small
+integer keys instead of repeated text. `kv` is stored as a BLOB: a varint item count,
+then a varint byte length + UTF-8 bytes per item.
+
+Ingest keeps a process-local value -> id cache per DB file; ids are only cached once
+the row that uses them has committed, and a file's cache is dropped whenever its schema
+is set up again (new or replaced file). Event ids stay AUTOINCREMENT, as in the legacy
+table: ids are never reused after old events are deleted, and the online migration
+below relies on new ids starting above every legacy id.
+
+Opening a legacy DB (text `event_name` / JSON `kv_json` columns) only moves the old
+table aside (`begin_migration`); its rows are copied in committed batches by a lifespan
+background task, or ahead of a deploy with (reports bytes per event before and after):
+    python -m server.analytics --db kbbq.db
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from server import memstats, queries
+from server.envutil import env_int
+
+# db path -> {"name": {event name: id}, "player": {player id: key}}
+KEY_CACHES: dict[str, dict[str, dict[str, int]]] = {}
+_cache_lock = threading.Lock()
+memstats.register("analytics_key_caches", lambda: KEY_CACHES)
+
+
+def _varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(blob: bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        if pos >= len(blob):
+            raise ValueError("truncated kv blob")
+        byte = blob[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_kv(items: list[str]) -> bytes:
+    out = bytearray()
+    _varint(len(items), out)
+    for item in items:
+        raw = str(item).encode("utf-8")
+        _varint(len(raw), out)
+        out += raw
+    return bytes(out)
+
+
+def decode_kv(blob: bytes) -> list[str]:
+    count, pos = _read_varint(blob, 0)
+    items = []
+    for _ in range(count):
+        size, pos = _read_varint(blob, pos)
+        if pos + size > len(blob):
+            raise ValueError("truncated kv blob")
+        items.append(blob[pos:pos + size].decode("utf-8"))
+        pos += size
+    return items
+
+
+def _cache_max() -> int:
+    return env_int("KBBQ_ANALYTICS_KEY_CACHE_MAX", 50000, minimum=0)
+
+
+def forget_keys(db_file: str) -> None:
+    # The ids belong to one DB: drop them when its schema is (re)created or the file replaced.
+    with _cache_lock:
+        KEY_CACHES.pop(db_file, None)
+
+
+def _cache_for(db_file: str, kind: str) -> dict[str, int]:
+    with _cache_lock:
+        return KEY_CACHES.setdefault(db_file, {"name": {}, "player": {}})[kind]
+
+
+def _remember(cache: dict[str, int], value: str, key: int) -> None:
+    cache_max = _cache_max()
+    if cache_max <= 0:
+        return
+    with _cache_lock:
+        # Insertion-ordered dict: evict the oldest entry once full.
+        while len(cache) >= cache_max:
+            cache.pop(next(iter(cache)), None)
+        cache[value] = key
+
+
+def _intern(conn: sqlite3.Connection, insert_sql: str, select_sql: str, value: str) -> int:
+    conn.execute(insert_sql, (value,))
+    return int(conn.execute(select_sql, (value,)).fetchone()[0])
+
+
+def record_event(conn: sqlite3.Connection, db_file: str, player_id: str, event_name: str, kv: list[str], ts: int) -> None:
+    """Insert one event and commit. `db_file` keys the id caches."""
+    names = _cache_for(db_file, "name")
+    players = _cache_for(db_file, "player")
+    name_id = names.get(event_name)
+    if name_id is None:
+        name_id = _intern(conn, queries.EVENT_NAME_INSERT, queries.EVENT_NAME_ID, event_name)
+    player_key = players.get(player_id)
+    if player_key is None:
+        player_key = _intern(conn, queries.ANALYTICS_PLAYER_INSERT, queries.ANALYTICS_PLAYER_KEY, player_id)
+    conn.execute(queries.ANALYTICS_INSERT, (player_key, name_id, encode_kv(kv), ts))
+    conn.commit()
+    # Only after commit: a rolled-back intern must not leave a dangling id in the cache.
+    _remember(names, event_name, name_id)
+    _remember(players, player_id, player_key)
+
+
+def create_tables(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS analytics_event_names (
+          id INTEGER PRIMARY KEY,
+          name TEXT UNIQUE NOT NULL
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS analytics_players (
+          id INTEGER PRIMARY KEY,
+          player_id TEXT UNIQUE NOT NULL
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS analytics_events (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          player_key INTEGER NOT NULL,
+          name_id INTEGER NOT NULL,
+          kv BLOB NOT NULL,
+          ts INTEGER NOT NULL
+        );
+        """
+    )
+
+
+def create_indexes(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analytics_events_player_ts ON analytics_events(player_key, ts);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analytics_events_name_ts ON analytics_events(name_id, ts);")
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {str(r[1]) for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def needs_migration(conn: sqlite3.Connection) -> bool:
+    # Legacy layout still in place, or its copy not finished yet.
+    return "event_name" in _columns(conn, "analytics_events") or bool(_columns(conn, "analytics_events_legacy"))
+
+
+def begin_migration(conn: sqlite3.Connection) -> bool:
+    """Move a legacy `analytics_events` aside and create the interned layout.
+
+    One short transaction (no row is copied), so it can run while the schema is set up;
+    new events go to the new table right away. `copy_legacy_events()` moves the rows.
+    """
+    if "event_name" not in _columns(conn, "analytics_events"):
+        return False
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    # The new table's indexes reuse these names.
+    conn.execute("DROP INDEX IF EXISTS idx_analytics_events_player_ts")
+    conn.execute("DROP INDEX IF EXISTS idx_analytics_events_name_ts")
+    conn.execute("ALTER TABLE analytics_events RENAME TO analytics_events_legacy")
+    create_tables(conn)
+    create_indexes(conn)
+    # New events get ids above every legacy id, so copied rows keep their original ids.
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'analytics_events'")
+    conn.execute(
+        "INSERT INTO sqlite_sequence(name, seq) SELECT 'analytics_events', COALESCE(MAX(id), 0) FROM analytics_events_legacy"
+    )
+    conn.commit()
+    return True
+
+
+def copy_legacy_events(
+    conn: sqlite3.Connection, *, batch_size: int = 5_000, stop: Optional[threading.Event] = None
+) -> int:
+    """Copy rows from `analytics_events_legacy` in committed batches, then drop it.
+
+    Resumable: progress is the highest legacy id already in `analytics_events`. Returns
+    rows moved by this call; stops early (table kept) once `stop` is set.
+    """
+    if not _columns(conn, "analytics_events_legacy"):
+        return 0
+    high = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM analytics_events_legacy").fetchone()[0])
+    last = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM analytics_events WHERE id <= ?", (high,)).fetchone()[0])
+    moved = 0
+    while last < high:
+        if stop is not None and stop.is_set():
+            return moved
+        upper = int(
+            conn.execute(
+                "SELECT MAX(id) FROM (SELECT id FROM analytics_events_legacy WHERE id > ? ORDER BY id LIMIT ?)",
+                (last, batch_size),
+            ).fetchone()[0]
+        )
+        span = (last, upper)
+        conn.execute(
+            "INSERT OR IGNORE INTO analytics_event_names(name) "
+            "SELECT DISTINCT event_name FROM analytics_events_legacy WHERE id > ? AND id <= ?",
+            span,
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO analytics_players(player_id) "
+            "SELECT DISTINCT player_id FROM analytics_events_legacy WHERE id > ? AND id <= ?",
+            span,
+        )
+        rows = conn.execute(
+            "SELECT e.id, k.id, n.id, e.kv_json, e.ts FROM analytics_events_legacy e "
+            "JOIN analytics_players k ON k.player_id = e.player_id "
+            "JOIN analytics_event_names n ON n.name = e.event_name WHERE e.id > ? AND e.id <= ? ORDER BY e.id",
+            span,
+        ).fetchall()
+        batch = []
+        for event_id, player_key, name_id, kv_json, ts in rows:
+            try:
+                kv = [str(v) for v in json.loads(kv_json or "[]")]
+            except (TypeError, ValueError):
+                kv = []
+            batch.append((event_id, player_key, name_id, encode_kv(kv), ts))
+        conn.executemany("INSERT INTO analytics_events(id, player_key, name_id, kv, ts) VALUES(?,?,?,?,?)", batch)
+        conn.commit()
+        moved += len(batch)
+        last = upper
+
+    conn.execute("DROP TABLE analytics_events_legacy")
+    conn.commit()
+    return moved
+
+
+def migrate_legacy_events(conn: sqlite3.Connection, *, batch_size: int = 50_000) -> int:
+    """Rewrite a text/JSON `analytics_events` table into the interned layout. Returns rows moved."""
+    begin_migration(conn)
+    return copy_legacy_events(conn, batch_size=max(1, batch_size))
+
+
+_STORAGE_OBJECTS = (
+    "analytics_events",
+    "analytics_event_names",
+    "analytics_players",
+    "idx_analytics_events_player_ts",
+    "idx_analytics_events_name_ts",
+)
+
+
+def storage_bytes_per_event(conn: sqlite3.Connection) -> Optional[float]:
+    """On-disk bytes (table, dictionaries, indexes) per event; None without the dbstat table."""
+    count = int(conn.execute("SELECT COUNT(*) FROM analytics_events").fetchone()[0])
+    placeholders = ",".join("?" for _ in _STORAGE_OBJECTS)
+    try:
+        row = conn.execute(
+            f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN ({placeholders})",
+            _STORAGE_OBJECTS,
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return round(int(row[0]) / count, 1) if count else None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migrate analytics events to the compact layout.")
+    parser.add_argument("--db", default=None, help="SQLite path (defaults to KBBQ_DB_PATH).")
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    args = parser.parse_args(argv)
+
+    from server.db import db_path
+
+    path = args.db or db_path()
+    # Plain connection: get_db() would swap the legacy table out before we can measure.
+    conn = sqlite3.connect(path)
+    try:
+        before = storage_bytes_per_event(conn)
+        started = time.perf_counter()
+        moved = migrate_legacy_events(conn, batch_size=max(1, args.batch_size))
+        seconds = round(time.perf_counter() - started, 3)
+        conn.execute("VACUUM")
+        after = storage_bytes_per_event(conn)
+    finally:
+        conn.close()
+    print(json.dumps({"migrated": moved, "seconds": seconds, "bytes_per_event_before": before, "bytes_per_event_after": after}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,45 +1,199 @@
+import asyncio
+import base64
+import binascii
 import json
+import logging
 import os
+import sqlite3
+import threading
 import time
 import uuid
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, closing, contextmanager
 
-import httpx
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from server.db import get_db
+from server.audit import EconomyCaps, is_plausible
+from server.codec import parse_body, render, representation
+from server.db import db_path, get_db, get_leaderboard_db, init_db, leaderboard_db_paths, shard_path
+from server.envutil import env_bool, env_int
+from server.etags import (
+    bump_version,
+    etag_matches,
+    friends_scope,
+    leaderboard_scope,
+    make_etag,
+    not_modified,
+    read_version,
+)
+from server.snapshots import close_season, validate_season
+from server.writebehind import (
+    SCORE_BUFFER,
+    flush_interval_seconds,
+    flush_scores,
+    max_pending,
+    write_behind_enabled,
+    write_score,
+)
 from server.models import (
     AnalyticsEventRequest,
     AuthResponse,
     CommunityFeedbackRequest,
     FriendInviteRequest,
+    FriendLeaderboardResponse,
     FriendListResponse,
     LeaderboardEntry,
     LeaderboardResponse,
+    PercentileResponse,
+    ScoreBucket,
     ScoreSubmitRequest,
+    SeasonInfo,
+    SeasonLeaderboardResponse,
+    SeasonListResponse,
 )
+from server import analytics, histogram, maintenance, memstats, queries, querylog
+from server.looplag import LOOP_LAG, BlockingWatchdog, block_threshold_seconds, lag_interval_seconds, monitor_loop_lag
+from server.profiling import CaptureInProgress, render_collapsed, render_top, sample_stacks
 from server.security import (
     ensure_friend_code,
     hmac_b64,
+    issue_session_token,
     new_token,
+    remember_session_epoch,
+    require_bearer_identity,
     require_bearer_player_id,
+    session_tokens_enabled,
     token_sha256,
     verify_signed_headers,
 )
 
 
-def _is_truthy(value: str) -> bool:
-    return (value or "").strip().lower() in ("1", "true", "yes", "on")
-
-
-EXPOSE_DOCS = _is_truthy(os.getenv("KBBQ_EXPOSE_DOCS", "0"))
+logger = logging.getLogger("kbbq.server")
+EXPOSE_DOCS = env_bool("KBBQ_EXPOSE_DOCS")
 APP_STARTED_AT = int(time.time())
 RATE_BUCKETS: dict[str, list[float]] = {}
+# player_id -> friend player ids. Invalidated by /friends/invite (process-local).
+FRIEND_SETS: dict[str, tuple[str, ...]] = {}
+memstats.register("rate_buckets", lambda: RATE_BUCKETS)
+memstats.register("friend_sets", lambda: FRIEND_SETS)
+
+# Filled by the lifespan handler; /readiness stays false until startup finished. Without a
+# lifespan (app embedded or driven by a plain TestClient) /readiness runs startup itself.
+STARTUP_STATE: dict = {"ready": False, "startup_seconds": None, "warmup": {}, "lifespan": "never"}
+_startup_lock = threading.Lock()
+
+
+def _warmup_regions() -> list[str]:
+    raw = os.getenv("KBBQ_WARMUP_REGIONS", "KR")
+    return [r.strip().upper() for r in raw.split(",") if r.strip()]
+
+
+def _startup() -> dict:
+    started = time.perf_counter()
+    init_db()
+    warmup = {}
+    # Pull the hot index/table pages into the OS page cache before traffic arrives.
+    for region in _warmup_regions():
+        with _leaderboard_session(region) as lb:
+            rows = lb.execute(queries.LEADERBOARD_TOP, (region, 100)).fetchall()
+            warmup[region] = len(rows)
+    with _db_session() as db:
+        db.execute("SELECT COUNT(*) FROM players").fetchone()
+    return {"startup_seconds": round(time.perf_counter() - started, 4), "warmup": warmup}
+
+
+async def _flush_scores_periodically() -> None:
+    while True:
+        await asyncio.sleep(flush_interval_seconds())
+        try:
+            await asyncio.to_thread(flush_scores)
+        except Exception as exc:  # noqa: BLE001
+            # Rows stay buffered and are retried on the next tick.
+            logger.warning("write-behind flush failed: %r", exc)
+
+
+async def _rebuild_histograms_periodically(interval: float) -> None:
+    # First pass right away: DBs created before the histogram table start with no counts.
+    while True:
+        try:
+            await asyncio.to_thread(histogram.rebuild_all)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("score histogram rebuild failed: %r", exc)
+        await asyncio.sleep(interval)
+
+
+async def _run_maintenance_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        if not maintenance.should_run():
+            continue
+        try:
+            await asyncio.to_thread(maintenance.run_maintenance)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("sqlite maintenance failed: %r", exc)
+
+
+def _copy_legacy_analytics(stop: threading.Event) -> int:
+    with _db_session() as db:
+        if not analytics.needs_migration(db):
+            return 0
+        return analytics.copy_legacy_events(db, stop=stop)
+
+
+async def _migrate_analytics_in_background(stop: threading.Event) -> None:
+    # Startup only swapped the legacy table out; its rows move here in committed batches.
+    try:
+        moved = await asyncio.to_thread(_copy_legacy_analytics, stop)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("analytics migration failed (rerun python -m server.analytics): %r", exc)
+        return
+    if moved:
+        logger.info("migrated %d legacy analytics events", moved)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    STARTUP_STATE["lifespan"] = "starting"
+    STARTUP_STATE.update(await asyncio.to_thread(_startup))
+    memstats.start_tracemalloc()
+    migration_stop = threading.Event()
+    migrator = asyncio.create_task(_migrate_analytics_in_background(migration_stop))
+    flusher = asyncio.create_task(_flush_scores_periodically()) if write_behind_enabled() else None
+    rebuild_interval = histogram.rebuild_interval_seconds()
+    rebuilder = asyncio.create_task(_rebuild_histograms_periodically(rebuild_interval)) if rebuild_interval > 0 else None
+    maintenance_interval = maintenance.interval_seconds()
+    maintainer = (
+        asyncio.create_task(_run_maintenance_periodically(maintenance_interval)) if maintenance_interval > 0 else None
+    )
+    lag_interval = lag_interval_seconds()
+    lag_monitor = asyncio.create_task(monitor_loop_lag(lag_interval)) if lag_interval > 0 else None
+    block_threshold = block_threshold_seconds()
+    watchdog = None
+    if lag_monitor is not None and block_threshold is not None:
+        watchdog = BlockingWatchdog(lag_interval, block_threshold)
+        watchdog.start()
+    STARTUP_STATE["ready"] = True
+    STARTUP_STATE["lifespan"] = "running"
+    try:
+        yield
+    finally:
+        STARTUP_STATE["ready"] = False
+        STARTUP_STATE["lifespan"] = "stopped"
+        if watchdog is not None:
+            watchdog.stop()
+        # The copy is resumable: stop after the current batch, the next start continues.
+        migration_stop.set()
+        for task in (migrator, flusher, rebuilder, maintainer, lag_monitor):
+            if task is not None:
+                task.cancel()
+        # Always drain: the flag may have been turned off while rows were pending.
+        await asyncio.to_thread(flush_scores)
+
 
 app = FastAPI(
     title="KBBQ Idle Backend",
     version="0.1",
+    lifespan=lifespan,
     # Reviewers don't need a public Swagger UI by default.
     docs_url="/docs" if EXPOSE_DOCS else None,
     redoc_url=None,
@@ -96,6 +250,54 @@ def _rate_scope(request: Request, player_id: str, action: str) -> str:
     return f"{action}:{player_id}:{client_ip}"
 
 
+def _friend_set_cache_max() -> int:
+    return env_int("KBBQ_FRIEND_CACHE_MAX", 10000, minimum=0)
+
+
+def _cached_friend_ids(db, player_id: str) -> tuple[str, ...]:
+    cached = FRIEND_SETS.get(player_id)
+    if cached is not None:
+        return cached
+
+    rows = db.execute(
+        queries.FRIEND_IDS,
+        (player_id,),
+    ).fetchall()
+    friend_ids = tuple(str(r["friend_player_id"]) for r in rows)
+
+    cache_max = _friend_set_cache_max()
+    if cache_max > 0:
+        # Insertion-ordered dict: evict the oldest entry once full.
+        while len(FRIEND_SETS) >= cache_max:
+            FRIEND_SETS.pop(next(iter(FRIEND_SETS)), None)
+        FRIEND_SETS[player_id] = friend_ids
+    return friend_ids
+
+
+def _invalidate_friend_sets(*player_ids: str) -> None:
+    for player_id in player_ids:
+        FRIEND_SETS.pop(player_id, None)
+
+
+def _encode_rank_cursor(score: float, player_id: str) -> str:
+    # Position only: ranks are recomputed server-side, so a tampered cursor can't fake them.
+    raw = f"{score!r}|{player_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_rank_cursor(cursor: str) -> tuple[float, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = base64.urlsafe_b64decode(padded).decode("utf-8").split("|")
+        if len(parts) == 3:
+            # Older cursors led with a client-visible rank; it is ignored.
+            parts = parts[1:]
+        score_raw, player_id = parts
+        return float(score_raw), player_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
 def _require_ops_token(request: Request) -> None:
     expected = _ops_token()
     if not expected:
@@ -107,6 +309,7 @@ def _require_ops_token(request: Request) -> None:
 
 @contextmanager
 def _db_session():
+    maintenance.note_activity()
     db = get_db()
     try:
         yield db
@@ -114,6 +317,31 @@ def _db_session():
         db.close()
 
 
+@contextmanager
+def _leaderboard_session(region: str, db=None):
+    # Leaderboard-scoped tables may live in a region shard; reuse `db` when they don't.
+    if db is not None and shard_path(region) is None:
+        yield db
+        return
+    lb = get_leaderboard_db(region)
+    try:
+        yield lb
+    finally:
+        lb.close()
+
+
+def _startup_on_demand() -> None:
+    # Same work as the lifespan, once; background tasks (flusher, maintenance) stay off.
+    with _startup_lock:
+        if STARTUP_STATE["ready"] or STARTUP_STATE["lifespan"] != "never":
+            return
+        try:
+            STARTUP_STATE.update(_startup())
+            STARTUP_STATE["ready"] = True
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("on-demand startup failed: %r", exc)
+
+
 @app.get("/readiness")
 def readiness():
     checks = []
@@ -127,6 +355,17 @@ def readiness():
     except Exception as exc:  # noqa: BLE001
         checks.append({"name": "db", "ok": False, "error": str(exc)})
 
+    if STARTUP_STATE["lifespan"] == "never":
+        _startup_on_demand()
+    checks.append(
+        {
+            "name": "startup",
+            "ok": bool(STARTUP_STATE["ready"]),
+            "startup_seconds": STARTUP_STATE["startup_seconds"],
+            "lifespan": STARTUP_STATE["lifespan"],
+        }
+    )
+
     if not _ops_token():
         warnings.append("KBBQ_OPS_TOKEN is not configured")
 
@@ -146,14 +385,36 @@ def readiness():
     }
 
 
+def _leaderboard_entry_count() -> int:
+    # Core DB plus every region shard file. Each region is counted only in the file that
+    # owns it: a split without --delete-source leaves a stale copy in the core DB.
+    total = 0
+    for path in leaderboard_db_paths():
+        if not os.path.exists(path):
+            continue
+        with closing(sqlite3.connect(path)) as conn:
+            try:
+                rows = conn.execute("SELECT region, COUNT(*) FROM leaderboard GROUP BY region").fetchall()
+            except sqlite3.OperationalError:
+                continue
+        total += sum(int(count) for region, count in rows if (shard_path(region) or db_path()) == path)
+    return total
+
+
 @app.get("/metrics")
 def metrics():
     with _db_session() as db:
         players = int(db.execute("SELECT COUNT(*) AS c FROM players").fetchone()["c"])
-        leaderboard_entries = int(db.execute("SELECT COUNT(*) AS c FROM leaderboard").fetchone()["c"])
         friends_edges = int(db.execute("SELECT COUNT(*) AS c FROM friends").fetchone()["c"])
         events = int(db.execute("SELECT COUNT(*) AS c FROM analytics_events").fetchone()["c"])
         nonce_rows = int(db.execute("SELECT COUNT(*) AS c FROM nonces").fetchone()["c"])
+    leaderboard_entries = _leaderboard_entry_count()
+    sql_counters = querylog.snapshot()["counters"]
+    write_behind = SCORE_BUFFER.snapshot()
+    histogram_stats = histogram.snapshot()
+    rss = memstats.rss_bytes()
+    # len() only: deep sizes walk every object and stay behind the ops token (/ops/memory).
+    entries = memstats.structure_entries()
     uptime = max(0, int(time.time()) - APP_STARTED_AT)
 
     body = "\n".join(
@@ -173,6 +434,59 @@ def metrics():
             "# HELP kbbq_nonce_rows_total Nonce rows retained for replay protection.",
             "# TYPE kbbq_nonce_rows_total gauge",
             f"kbbq_nonce_rows_total {nonce_rows}",
+            "# HELP kbbq_sql_statements_total SQL statements timed by the slow-query tracer.",
+            "# TYPE kbbq_sql_statements_total counter",
+            f"kbbq_sql_statements_total {sql_counters['statements']}",
+            "# HELP kbbq_sql_slow_statements_total SQL statements over KBBQ_SLOW_QUERY_MS.",
+            "# TYPE kbbq_sql_slow_statements_total counter",
+            f"kbbq_sql_slow_statements_total {sql_counters['slow_statements']}",
+            "# HELP kbbq_sql_statement_seconds_total Time spent in traced SQL statements.",
+            "# TYPE kbbq_sql_statement_seconds_total counter",
+            f"kbbq_sql_statement_seconds_total {sql_counters['statement_seconds']:.6f}",
+            "# HELP kbbq_write_behind_submits_total Score submits accepted into the write-behind buffer.",
+            "# TYPE kbbq_write_behind_submits_total counter",
+            f"kbbq_write_behind_submits_total {write_behind['submits']}",
+            "# HELP kbbq_write_behind_rows_flushed_total Coalesced leaderboard rows written by flushes.",
+            "# TYPE kbbq_write_behind_rows_flushed_total counter",
+            f"kbbq_write_behind_rows_flushed_total {write_behind['rows_flushed']}",
+            "# HELP kbbq_write_behind_flushes_total Write-behind flushes.",
+            "# TYPE kbbq_write_behind_flushes_total counter",
+            f"kbbq_write_behind_flushes_total {write_behind['flushes']}",
+            "# HELP kbbq_write_behind_dropped_stale_total Buffered scores dropped because their season was reset.",
+            "# TYPE kbbq_write_behind_dropped_stale_total counter",
+            f"kbbq_write_behind_dropped_stale_total {write_behind['dropped_stale']}",
+            "# HELP kbbq_write_behind_pending Buffered (region, player) scores not yet committed.",
+            "# TYPE kbbq_write_behind_pending gauge",
+            f"kbbq_write_behind_pending {write_behind['pending']}",
+            "# HELP kbbq_write_behind_coalescing_ratio Submits per written row (1.0 = no coalescing).",
+            "# TYPE kbbq_write_behind_coalescing_ratio gauge",
+            f"kbbq_write_behind_coalescing_ratio {write_behind['coalescing_ratio']}",
+            "# HELP kbbq_score_histogram_rebuilds_total Per-region score histogram rebuilds.",
+            "# TYPE kbbq_score_histogram_rebuilds_total counter",
+            f"kbbq_score_histogram_rebuilds_total {histogram_stats['rebuilds']}",
+            "# HELP kbbq_score_histogram_rebuild_seconds_total Time spent rebuilding score histograms.",
+            "# TYPE kbbq_score_histogram_rebuild_seconds_total counter",
+            f"kbbq_score_histogram_rebuild_seconds_total {histogram_stats['rebuild_seconds']:.6f}",
+            "# HELP kbbq_score_histogram_corrected_total Bucket counts changed by rebuilds (incremental drift).",
+            "# TYPE kbbq_score_histogram_corrected_total counter",
+            f"kbbq_score_histogram_corrected_total {histogram_stats['corrected']}",
+            *maintenance.prometheus_lines(),
+            *LOOP_LAG.prometheus_lines(
+                "kbbq_event_loop_lag_seconds", "Delay between scheduled and actual wake-up of the loop monitor."
+            ),
+            "# HELP kbbq_event_loop_blocked_total Loop stalls over KBBQ_LOOP_BLOCK_MS reported by the watchdog.",
+            "# TYPE kbbq_event_loop_blocked_total counter",
+            f"kbbq_event_loop_blocked_total {LOOP_LAG.snapshot()['blocked_reports']}",
+            "# HELP kbbq_process_resident_memory_bytes Resident set size (VmRSS).",
+            "# TYPE kbbq_process_resident_memory_bytes gauge",
+            f"kbbq_process_resident_memory_bytes {rss if rss is not None else 'NaN'}",
+            "# HELP kbbq_inprocess_entries Entries in registered in-process structures.",
+            "# TYPE kbbq_inprocess_entries gauge",
+            *(
+                f'kbbq_inprocess_entries{{structure="{name}"}} {count}'
+                for name, count in entries.items()
+                if count is not None
+            ),
             "# HELP kbbq_uptime_seconds Process uptime in seconds.",
             "# TYPE kbbq_uptime_seconds gauge",
             f"kbbq_uptime_seconds {uptime}",
@@ -220,6 +534,65 @@ def ops_alerts(request: Request):
     return {"alerts": alerts, "ts": int(time.time())}
 
 
+@app.get("/ops/slow-queries")
+def ops_slow_queries(request: Request, reset: bool = False):
+    _require_ops_token(request)
+    report = querylog.snapshot()
+    if reset:
+        querylog.reset()
+    return {"enabled": report["threshold_ms"] is not None, **report, "ts": int(time.time())}
+
+
+@app.get("/ops/memory")
+def ops_memory(request: Request, top: int = 20):
+    _require_ops_token(request)
+    # Deep sizes walk every registered structure: an ops call, not a hot path.
+    return {**memstats.report(max(1, min(200, int(top)))), "ts": int(time.time())}
+
+
+@app.get("/ops/profile")
+async def ops_profile(request: Request, seconds: float = 10.0, interval_ms: float = 5.0, format: str = "collapsed"):
+    _require_ops_token(request)
+    seconds = max(0.1, min(60.0, float(seconds)))
+    interval = max(0.001, min(0.1, float(interval_ms) / 1000.0))
+    if format not in ("collapsed", "top"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or top")
+
+    # Sample from a worker thread so the event loop keeps serving (and shows up in the profile).
+    try:
+        stacks, ticks = await asyncio.to_thread(sample_stacks, seconds, interval)
+    except CaptureInProgress as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+
+    body = render_collapsed(stacks) if format == "collapsed" else render_top(stacks, ticks)
+    return Response(
+        content=body,
+        media_type="text/plain",
+        headers={"X-Profile-Ticks": str(ticks), "X-Profile-Seconds": str(seconds)},
+    )
+
+
+def _issue_token(player_id: str, region: str, epoch: int) -> tuple[str, int]:
+    if session_tokens_enabled():
+        return issue_session_token(player_id, region, epoch)
+    return new_token(), 0
+
+
+@app.post("/ops/leaderboard/snapshot")
+def ops_leaderboard_snapshot(request: Request, season: str, region: str = "KR", reset: bool = False):
+    _require_ops_token(request)
+    region = (region or "KR").strip().upper()
+    # The snapshot must include scores still sitting in the write-behind buffer.
+    flush_scores(region)
+    with _leaderboard_session(region) as lb:
+        try:
+            report = close_season(lb, region, season, reset=reset)
+        except ValueError as exc:
+            status = 409 if "exists" in str(exc) else 400
+            raise HTTPException(status_code=status, detail=str(exc))
+    return {"ok": True, **report}
+
+
 @app.post("/auth/guest", response_model=AuthResponse)
 async def auth_guest(request: Request):
     body = await request.json()
@@ -230,27 +603,30 @@ async def auth_guest(request: Request):
 
     with _db_session() as db:
         existing = db.execute(
-            "SELECT player_id, token_sha256 FROM players WHERE device_id = ?",
+            queries.PLAYER_BY_DEVICE,
             (device_id,),
         ).fetchone()
 
         salt = os.getenv("KBBQ_TOKEN_SALT", "dev-only-salt")
         if existing:
             player_id = str(existing["player_id"])
-            token = new_token()
+            # Re-auth revokes earlier tokens: the hash swap covers opaque ones, the epoch bump stateless ones.
+            epoch = int(existing["token_epoch"]) + 1
+            token, expires_at = _issue_token(player_id, str(existing["region"]), epoch)
             token_hash = token_sha256(token, salt)
             db.execute(
-                "UPDATE players SET token_sha256 = ? WHERE player_id = ?",
-                (token_hash, player_id),
+                "UPDATE players SET token_sha256 = ?, token_epoch = ? WHERE player_id = ?",
+                (token_hash, epoch, player_id),
             )
             db.commit()
+            remember_session_epoch(player_id, epoch)
             ensure_friend_code(db, player_id)
-            return AuthResponse(playerId=player_id, token=token)
+            return AuthResponse(playerId=player_id, token=token, expiresAt=expires_at)
 
         player_id = "p_" + uuid.uuid4().hex
-        token = new_token()
-        token_hash = token_sha256(token, salt)
         region = "KR"
+        token, expires_at = _issue_token(player_id, region, 0)
+        token_hash = token_sha256(token, salt)
         display_name = "Guest-" + player_id[-4:].upper()
 
         db.execute(
@@ -259,19 +635,17 @@ async def auth_guest(request: Request):
         )
         db.commit()
         ensure_friend_code(db, player_id)
-        return AuthResponse(playerId=player_id, token=token)
+        return AuthResponse(playerId=player_id, token=token, expiresAt=expires_at)
 
 
 @app.post("/leaderboard/submit")
 async def leaderboard_submit(request: Request):
-    raw = (await request.body()).decode("utf-8")
-    try:
-        payload = ScoreSubmitRequest.model_validate_json(raw)
-    except Exception:
-        raise HTTPException(status_code=400, detail="invalid json body")
+    raw = await request.body()
+    payload = parse_body(request, raw, ScoreSubmitRequest)
 
     with _db_session() as db:
-        player_id = require_bearer_player_id(request, db)
+        identity = require_bearer_identity(request, db)
+        player_id = identity.player_id
         if payload.playerId != player_id:
             raise HTTPException(status_code=401, detail="player mismatch")
 
@@ -285,85 +659,298 @@ async def leaderboard_submit(request: Request):
         if expected_body_sig != payload.signature:
             raise HTTPException(status_code=401, detail="bad body signature")
 
-        # Upsert score (keep best score).
-        region_row = db.execute(
-            "SELECT region FROM players WHERE player_id = ?",
-            (player_id,),
-        ).fetchone()
-        region = str(region_row["region"]) if region_row else "KR"
-
-        existing = db.execute(
-            "SELECT score FROM leaderboard WHERE region = ? AND player_id = ?",
-            (region, player_id),
-        ).fetchone()
         score = float(payload.score)
-        if existing is None:
-            db.execute(
-                "INSERT INTO leaderboard(region, player_id, score, updated_at) VALUES(?,?,?,?)",
-                (region, player_id, score, int(time.time())),
-            )
-        else:
-            best = max(float(existing["score"]), score)
-            db.execute(
-                "UPDATE leaderboard SET score = ?, updated_at = ? WHERE region = ? AND player_id = ?",
-                (best, int(time.time()), region, player_id),
-            )
-        db.commit()
-        return {"ok": True}
+        region = identity.region
+        if env_bool("KBBQ_AUDIT_INLINE"):
+            player_row = db.execute(
+                queries.PLAYER_REGION,
+                (player_id,),
+            ).fetchone()
+            if player_row:
+                region = region or str(player_row["region"])
+                age = int(time.time()) - int(player_row["created_at"])
+                if not is_plausible(score, age, EconomyCaps.from_env()):
+                    raise HTTPException(status_code=400, detail="implausible score")
+
+        # Upsert score (keep best score).
+        if region is None:
+            region_row = db.execute(
+                queries.PLAYER_REGION,
+                (player_id,),
+            ).fetchone()
+            region = str(region_row["region"]) if region_row else "KR"
+
+    if write_behind_enabled():
+        if SCORE_BUFFER.add(region, player_id, score) >= max_pending():
+            # Backpressure without blocking the event loop; concurrent flushes queue on the buffer's flush lock.
+            await asyncio.to_thread(flush_scores)
+        return render(request, {"ok": True})
+
+    with _leaderboard_session(region) as lb:
+        write_score(lb, region, player_id, score)
+        return render(request, {"ok": True})
+
+
+def _merge_pending_scores(db, rows: list[tuple], pending: list[tuple[str, float]], limit: int) -> list[tuple]:
+    # The merged top `limit` is contained in (stored top `limit`) + (pending top `limit`).
+    names = {pid: name for pid, name, _ in rows}
+    best = {pid: score for pid, _, score in rows}
+    for pid, score in pending:
+        if score > best.get(pid, float("-inf")):
+            best[pid] = score
+    merged = []
+    for pid, score in sorted(best.items(), key=lambda item: (-item[1], item[0]))[:limit]:
+        if pid not in names:
+            row = db.execute(queries.PLAYER_DISPLAY_NAME, (pid,)).fetchone()
+            names[pid] = str(row["display_name"]) if row else pid
+        merged.append((pid, names[pid], score))
+    return merged
 
 
 @app.get("/leaderboard/top", response_model=LeaderboardResponse)
-async def leaderboard_top(request: Request, region: str = "KR", limit: int = 10):
-    with _db_session() as db:
+async def leaderboard_top(request: Request, response: Response, region: str = "KR", limit: int = 10):
+    region = (region or "KR").strip().upper()
+    with _db_session() as db, _leaderboard_session(region, db) as lb:
         player_id = require_bearer_player_id(request, db)
         verify_signed_headers(request, db=db, player_id=player_id, raw_body="")
 
         limit = max(1, min(100, int(limit)))
-        region = (region or "KR").strip().upper()
 
-        rows = db.execute(
-            "SELECT l.player_id, p.display_name, l.score FROM leaderboard l JOIN players p ON p.player_id = l.player_id "
-            "WHERE l.region = ? ORDER BY l.score DESC LIMIT ?",
-            (region, limit),
-        ).fetchall()
+        buffered = write_behind_enabled()
+        etag_parts = ["top", region, limit, representation(request), read_version(lb, leaderboard_scope(region))]
+        if buffered:
+            etag_parts.append(SCORE_BUFFER.generation(region))
+        etag = make_etag(*etag_parts)
+        if etag_matches(request, etag):
+            return not_modified(etag, vary="Accept")
+        response.headers["ETag"] = etag
+        response.headers["Vary"] = "Accept"
+
+        rows = [
+            (str(r["player_id"]), str(r["display_name"]), float(r["score"]))
+            for r in lb.execute(
+                queries.LEADERBOARD_TOP,
+                (region, limit),
+            ).fetchall()
+        ]
+        if buffered:
+            rows = _merge_pending_scores(db, rows, SCORE_BUFFER.pending_top(region, limit), limit)
 
         entries = []
-        for idx, row in enumerate(rows, start=1):
+        for idx, (entry_player_id, display_name, score) in enumerate(rows, start=1):
             entries.append(
                 LeaderboardEntry(
-                    playerId=str(row["player_id"]),
-                    displayName=str(row["display_name"]),
-                    score=float(row["score"]),
+                    playerId=entry_player_id,
+                    displayName=display_name,
+                    score=score,
                     rank=idx,
                 )
             )
 
-        return LeaderboardResponse(entries=entries)
+        return render(request, LeaderboardResponse(entries=entries), response)
+
+
+@app.get("/leaderboard/percentile", response_model=PercentileResponse)
+async def leaderboard_percentile(request: Request, response: Response, region: str = "KR"):
+    region = (region or "KR").strip().upper()
+    with _db_session() as db, _leaderboard_session(region, db) as lb:
+        player_id = require_bearer_player_id(request, db)
+        verify_signed_headers(request, db=db, player_id=player_id, raw_body="")
+
+        # Best-score changes and drift-correcting histogram rebuilds both bump the leaderboard
+        # version, so it covers the distribution too.
+        buffered = write_behind_enabled()
+        etag_parts = ["percentile", player_id, region, representation(request), read_version(lb, leaderboard_scope(region))]
+        if buffered:
+            etag_parts.append(SCORE_BUFFER.generation(region))
+        etag = make_etag(*etag_parts)
+        if etag_matches(request, etag):
+            return not_modified(etag, vary="Accept")
+        response.headers["ETag"] = etag
+        response.headers["Vary"] = "Accept"
+
+        # O(buckets): the caller's own row plus the region's histogram rows.
+        row = lb.execute(queries.LEADERBOARD_BEST, (region, player_id)).fetchone()
+        counted = score = float(row["score"]) if row else None
+        if buffered:
+            pending = SCORE_BUFFER.pending_score(region, player_id)
+            if pending is not None and (score is None or pending > score):
+                score = pending
+        buckets = histogram.read_buckets(lb, region)
+        result = histogram.estimate(buckets, score, counted)
+
+        return render(
+            request,
+            PercentileResponse(
+                region=region,
+                totalPlayers=result["total"],
+                score=score,
+                rankEstimate=result["rank"],
+                topPercent=result["top_percent"],
+                buckets=[
+                    ScoreBucket(lower=histogram.bucket_lower(b), upper=histogram.bucket_upper(b), count=c)
+                    for b, c in buckets
+                ],
+            ),
+            response,
+        )
+
+
+@app.get("/leaderboard/seasons", response_model=SeasonListResponse)
+async def leaderboard_seasons(request: Request, region: str = "KR"):
+    region = (region or "KR").strip().upper()
+    with _db_session() as db, _leaderboard_session(region, db) as lb:
+        player_id = require_bearer_player_id(request, db)
+        verify_signed_headers(request, db=db, player_id=player_id, raw_body="")
+
+        rows = lb.execute(queries.SEASON_LIST, (region,)).fetchall()
+        seasons = [
+            SeasonInfo(season=str(r["season"]), region=region, entries=int(r["entries"]), createdAt=int(r["created_at"]))
+            for r in rows
+        ]
+        return SeasonListResponse(seasons=seasons)
+
+
+@app.get("/leaderboard/season", response_model=SeasonLeaderboardResponse)
+async def leaderboard_season(request: Request, season: str, region: str = "KR", afterRank: int = 0, limit: int = 10):
+    region = (region or "KR").strip().upper()
+    with _db_session() as db, _leaderboard_session(region, db) as lb:
+        player_id = require_bearer_player_id(request, db)
+        verify_signed_headers(request, db=db, player_id=player_id, raw_body="")
+
+        try:
+            season = validate_season(season)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        limit = max(1, min(100, int(limit)))
+
+        info = lb.execute(queries.SEASON_INFO, (season, region)).fetchone()
+        if not info:
+            raise HTTPException(status_code=404, detail="season not found")
+
+        # Pre-ranked: a primary-key range read, no sort.
+        rows = lb.execute(
+            queries.SEASON_PAGE,
+            (season, region, max(0, int(afterRank)), limit),
+        ).fetchall()
+        me_row = lb.execute(
+            queries.SEASON_ME,
+            (season, region, player_id),
+        ).fetchone()
+
+        def _entry(row) -> LeaderboardEntry:
+            return LeaderboardEntry(
+                playerId=str(row["player_id"]),
+                displayName=str(row["display_name"]),
+                score=float(row["score"]),
+                rank=int(row["rank"]),
+            )
+
+        return SeasonLeaderboardResponse(
+            season=season,
+            region=region,
+            totalEntries=int(info["entries"]),
+            entries=[_entry(r) for r in rows],
+            me=_entry(me_row) if me_row else None,
+        )
 
 
 @app.get("/friends/list", response_model=FriendListResponse)
-async def friends_list(request: Request):
+async def friends_list(request: Request, response: Response):
     with _db_session() as db:
         player_id = require_bearer_player_id(request, db)
         verify_signed_headers(request, db=db, player_id=player_id, raw_body="")
 
+        etag = make_etag("friends", player_id, representation(request), read_version(db, friends_scope(player_id)))
+        if etag_matches(request, etag):
+            return not_modified(etag, vary="Accept")
+        response.headers["ETag"] = etag
+        response.headers["Vary"] = "Accept"
+
         rows = db.execute(
-            "SELECT f.friend_player_id, p.display_name FROM friends f JOIN players p ON p.player_id = f.friend_player_id "
-            "WHERE f.player_id = ? ORDER BY p.display_name ASC LIMIT 50",
+            queries.FRIENDS_LIST,
             (player_id,),
         ).fetchall()
 
         friends = [{"playerId": str(r["friend_player_id"]), "displayName": str(r["display_name"])} for r in rows]
-        return {"friends": friends}
+        return render(request, {"friends": friends}, response)
+
+
+@app.get("/friends/leaderboard", response_model=FriendLeaderboardResponse)
+async def friends_leaderboard(
+    request: Request,
+    response: Response,
+    region: str = "KR",
+    limit: int = 50,
+    cursor: str = "",
+):
+    region = (region or "KR").strip().upper()
+    with _db_session() as db, _leaderboard_session(region, db) as lb:
+        player_id = require_bearer_player_id(request, db)
+        verify_signed_headers(request, db=db, player_id=player_id, raw_body="")
+
+        limit = max(1, min(100, int(limit)))
+
+        etag = make_etag(
+            "friends-top",
+            player_id,
+            region,
+            limit,
+            cursor,
+            read_version(db, friends_scope(player_id)),
+            read_version(lb, leaderboard_scope(region)),
+        )
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
+
+        friend_ids = _cached_friend_ids(db, player_id)
+        if not friend_ids:
+            return FriendLeaderboardResponse(entries=[], friendCount=0)
+
+        # Keyset pagination on (score DESC, player_id ASC) over the cached friend set,
+        # bound as one JSON array parameter: point lookups into the leaderboard PK.
+        friend_ids_json = json.dumps(friend_ids)
+        sql = queries.FRIENDS_LEADERBOARD
+        params: list = [friend_ids_json, region]
+        rank_offset = 0
+        if cursor:
+            after_score, after_player_id = _decode_rank_cursor(cursor)
+            rank_offset = int(
+                lb.execute(
+                    queries.FRIENDS_LEADERBOARD_RANK,
+                    (friend_ids_json, region, after_score, after_score, after_player_id),
+                ).fetchone()["c"]
+            )
+            sql += queries.FRIENDS_LEADERBOARD_AFTER
+            params.extend([after_score, after_score, after_player_id])
+        sql += queries.FRIENDS_LEADERBOARD_ORDER
+        params.append(limit + 1)
+        rows = lb.execute(sql, params).fetchall()
+
+        entries = []
+        for idx, row in enumerate(rows[:limit], start=rank_offset + 1):
+            entries.append(
+                LeaderboardEntry(
+                    playerId=str(row["player_id"]),
+                    displayName=str(row["display_name"]),
+                    score=float(row["score"]),
+                    rank=idx,
+                )
+            )
+
+        next_cursor = ""
+        if len(rows) > limit and entries:
+            last = entries[-1]
+            next_cursor = _encode_rank_cursor(last.score, last.playerId)
+
+        return FriendLeaderboardResponse(entries=entries, friendCount=len(friend_ids), nextCursor=next_cursor)
 
 
 @app.post("/analytics/event")
 async def analytics_event(request: Request):
-    raw = (await request.body()).decode("utf-8")
-    try:
-        payload = AnalyticsEventRequest.model_validate_json(raw)
-    except Exception:
-        raise HTTPException(status_code=400, detail="invalid json body")
+    raw = await request.body()
+    payload = parse_body(request, raw, AnalyticsEventRequest)
 
     with _db_session() as db:
         player_id = require_bearer_player_id(request, db)
@@ -382,12 +969,8 @@ async def analytics_event(request: Request):
             kv = kv[:50]
 
         ts = int(payload.timestamp) if payload.timestamp else int(time.time())
-        db.execute(
-            "INSERT INTO analytics_events(player_id, event_name, kv_json, ts) VALUES(?,?,?,?)",
-            (player_id, event_name, json.dumps(kv), ts),
-        )
-        db.commit()
-        return {"ok": True}
+        analytics.record_event(db, db_path(), player_id, event_name, kv, ts)
+        return render(request, {"ok": True})
 
 
 @app.post("/community/feedback")
@@ -429,6 +1012,9 @@ async def community_feedback(request: Request):
         "channel": str(payload.channel or "in-game").strip() or "in-game",
         "source": "kbbq-idle-backend",
     }
+    # Only this endpoint needs an HTTP client; keep it out of the import path at startup.
+    import httpx
+
     try:
         resp = httpx.post(
             endpoint,
@@ -483,7 +1069,7 @@ async def friends_invite(request: Request):
             raise HTTPException(status_code=400, detail="invalid code")
 
         target = db.execute(
-            "SELECT player_id FROM friend_codes WHERE code = ?",
+            queries.FRIEND_CODE_LOOKUP,
             (code,),
         ).fetchone()
         if not target:
@@ -495,14 +1081,19 @@ async def friends_invite(request: Request):
 
         now = int(time.time())
         # Create bidirectional friendship (idempotent).
-        db.execute(
-            "INSERT OR IGNORE INTO friends(player_id, friend_player_id, created_at) VALUES(?,?,?)",
+        forward = db.execute(
+            queries.FRIEND_INSERT,
             (player_id, friend_id, now),
         )
-        db.execute(
-            "INSERT OR IGNORE INTO friends(player_id, friend_player_id, created_at) VALUES(?,?,?)",
+        if forward.rowcount > 0:
+            bump_version(db, friends_scope(player_id))
+        backward = db.execute(
+            queries.FRIEND_INSERT,
             (friend_id, player_id, now),
         )
+        if backward.rowcount > 0:
+            bump_version(db, friends_scope(friend_id))
         db.commit()
+        _invalidate_friend_sets(player_id, friend_id)
 
         return {"ok": True}
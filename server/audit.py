@@ -0,0 +1,163 @@
+"""Leaderboard score plausibility auditor.
+
+Mirrors the sim economy (sim/KbbqIdle.Sim): income per second is the product of
+per-level base income and the gameplay multipliers (EconomyMath), levels follow
+the geometric requirement curve (ProgressionMath), and offline earnings pay at
+most `offlineRate` (< 1) of the online rate (OfflineEarningsMath). A player who
+is always online with every multiplier at its cap therefore bounds any real
+score; rows above that envelope (times a tolerance) are flagged.
+
+Run as a batch job:
+    python -m server.audit --db kbbq.db
+"""
+
+import argparse
+import bisect
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+
+from server.envutil import env_float
+
+
+@dataclass(frozen=True)
+class EconomyCaps:
+    # Defaults match Assets/Data/Config/EconomyTuning.asset.
+    max_level: int = 100
+    base_requirement: float = 50.0
+    requirement_growth: float = 1.28
+    base_income_per_sec: float = 1.0
+    income_growth: float = 1.22
+    # Upper bound for upgrade * staff * service * store * boost * tip * combo * prestige.
+    max_multiplier: float = 250.0
+    # Flag only when score > tolerance * envelope + grace_score.
+    tolerance: float = 1.5
+    grace_score: float = 1_000.0
+
+    @classmethod
+    def from_env(cls) -> "EconomyCaps":
+        defaults = cls()
+        return cls(
+            max_multiplier=env_float("KBBQ_AUDIT_MAX_MULTIPLIER", defaults.max_multiplier),
+            tolerance=env_float("KBBQ_AUDIT_TOLERANCE", defaults.tolerance),
+            grace_score=env_float("KBBQ_AUDIT_GRACE_SCORE", defaults.grace_score),
+        )
+
+
+@lru_cache(maxsize=8)
+def income_envelope(caps: EconomyCaps) -> tuple[tuple[float, ...], tuple[float, ...], tuple[float, ...]]:
+    """Per level: (seconds to reach it, total income at that point, max income/sec while in it)."""
+    start_times = [0.0]
+    thresholds = [0.0]
+    rates = [caps.base_income_per_sec * caps.max_multiplier]
+    requirement = caps.base_requirement
+    for level in range(2, max(1, caps.max_level) + 1):
+        elapsed = (requirement - thresholds[-1]) / rates[-1]
+        start_times.append(start_times[-1] + elapsed)
+        thresholds.append(requirement)
+        rates.append(caps.base_income_per_sec * (caps.income_growth ** (level - 1)) * caps.max_multiplier)
+        requirement *= caps.requirement_growth
+    return tuple(start_times), tuple(thresholds), tuple(rates)
+
+
+def max_plausible_score(age_seconds: float, caps: EconomyCaps) -> float:
+    start_times, thresholds, rates = income_envelope(caps)
+    age = max(0.0, float(age_seconds))
+    idx = bisect.bisect_right(start_times, age) - 1
+    return thresholds[idx] + (age - start_times[idx]) * rates[idx]
+
+
+def is_plausible(score: float, age_seconds: float, caps: EconomyCaps) -> bool:
+    return float(score) <= caps.tolerance * max_plausible_score(age_seconds, caps) + caps.grace_score
+
+
+def max_plausible_scores(ages, caps: EconomyCaps):
+    """Vectorized `max_plausible_score` over a NumPy array of ages (seconds)."""
+    import numpy as np
+
+    start_times, thresholds, rates = (np.asarray(v, dtype=np.float64) for v in income_envelope(caps))
+    ages = np.maximum(np.asarray(ages, dtype=np.float64), 0.0)
+    idx = np.searchsorted(start_times, ages, side="right") - 1
+    return thresholds[idx] + (ages - start_times[idx]) * rates[idx]
+
+
+def audit_leaderboard(conn: sqlite3.Connection, caps: EconomyCaps, *, chunk_size: int = 250_000) -> dict:
+    """Scan every leaderboard row in chunks and replace `leaderboard_flags` with the outliers."""
+    import numpy as np
+
+    started = time.perf_counter()
+    audited_at = int(time.time())
+    cur = conn.cursor()
+    # Plain tuples are much cheaper than sqlite3.Row for bulk scans.
+    cur.row_factory = None
+    cur.execute(
+        "SELECT l.region, l.player_id, l.score, l.updated_at - p.created_at FROM leaderboard l "
+        "JOIN players p ON p.player_id = l.player_id"
+    )
+
+    rows_scanned = 0
+    flags = []
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        rows_scanned += len(rows)
+        regions, player_ids, scores, ages = zip(*rows)
+        scores_arr = np.fromiter(scores, dtype=np.float64, count=len(rows))
+        ages_arr = np.fromiter(ages, dtype=np.float64, count=len(rows))
+        limits = max_plausible_scores(ages_arr, caps) * caps.tolerance + caps.grace_score
+        for i in np.flatnonzero(scores_arr > limits):
+            flags.append(
+                (
+                    regions[i],
+                    player_ids[i],
+                    float(scores_arr[i]),
+                    float(limits[i]),
+                    float(scores_arr[i] / limits[i]),
+                    audited_at,
+                )
+            )
+
+    conn.execute("DELETE FROM leaderboard_flags")
+    conn.executemany(
+        "INSERT INTO leaderboard_flags(region, player_id, score, max_plausible, ratio, audited_at) VALUES(?,?,?,?,?,?)",
+        flags,
+    )
+    conn.commit()
+    return {
+        "rows_scanned": rows_scanned,
+        "flagged": len(flags),
+        "seconds": round(time.perf_counter() - started, 3),
+        "audited_at": audited_at,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Flag implausible leaderboard scores.")
+    parser.add_argument("--db", default=None, help="SQLite path (defaults to KBBQ_DB_PATH).")
+    parser.add_argument("--chunk-size", type=int, default=250_000)
+    args = parser.parse_args(argv)
+
+    if args.db:
+        os.environ["KBBQ_DB_PATH"] = args.db
+    from server.db import get_db, get_leaderboard_db, shard_map
+
+    caps = EconomyCaps.from_env()
+    reports = {}
+    # Flags live next to the rows they describe: the core DB plus each region shard.
+    targets = [("core", get_db)] + [(region, lambda r=region: get_leaderboard_db(r)) for region in sorted(shard_map())]
+    for label, connect in targets:
+        conn = connect()
+        try:
+            reports[label] = audit_leaderboard(conn, caps, chunk_size=max(1, args.chunk_size))
+        finally:
+            conn.close()
+    print(json.dumps(reports))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
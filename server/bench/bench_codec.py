@@ -0,0 +1,169 @@
+"""JSON vs MessagePack: payload size and server CPU per request.
+
+Runs the app in-process (httpx ASGI transport, no sockets) against a temp DB with a
+full top-100 board, and times /leaderboard/top, /leaderboard/submit and
+/analytics/event in both encodings. CPU is process time per request, client
+encoding included equally on both sides. End-to-end numbers are dominated by SQLite
+commits, so `codec_us` also isolates the server-side decode (request) + encode
+(response) work per format.
+
+    python -m server.bench.bench_codec [--requests 500]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+
+def _signed(secret: str, player_id: str, token: str, nonce: str, raw: bytes) -> dict:
+    from server.security import hmac_b64
+
+    ts = str(int(time.time()))
+    return {
+        "Authorization": f"Bearer {token}",
+        "X-Nonce": nonce,
+        "X-Timestamp": ts,
+        "X-Signature": hmac_b64(secret, f"{player_id}|{nonce}|{ts}|".encode("utf-8") + raw),
+    }
+
+
+async def _run(requests: int) -> list[dict]:
+    import httpx
+    import msgpack
+
+    from server.app import app
+    from server.db import get_db, init_db
+    from server.security import hmac_b64
+
+    init_db()
+    secret = os.environ["KBBQ_HMAC_SECRET"]
+    conn = get_db()
+    now = int(time.time())
+    conn.executemany(
+        "INSERT INTO players(player_id, device_id, display_name, token_sha256, region, created_at) VALUES(?,?,?,?,?,?)",
+        [(f"p_bench_{i:04d}", f"bench-device-{i}", f"Guest-{i:04d}", f"bench-{i}", "KR", now) for i in range(100)],
+    )
+    conn.executemany(
+        "INSERT INTO leaderboard(region, player_id, score, updated_at) VALUES(?,?,?,?)",
+        [("KR", f"p_bench_{i:04d}", 1_000_000.0 / (i + 1), now) for i in range(100)],
+    )
+    conn.commit()
+    conn.close()
+
+    encoders = {
+        "json": ("application/json", lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8")),
+        "msgpack": ("application/msgpack", msgpack.packb),
+    }
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for fmt, (media_type, encode) in encoders.items():
+            # Spread requests over enough players to stay under the analytics rate limit (120/min).
+            auths = [
+                (await client.post("/auth/guest", json={"deviceId": f"bench-codec-{fmt}-{n}"})).json()
+                for n in range(requests // 100 + 1)
+            ]
+            for endpoint in ("top", "submit", "event"):
+                request_bytes = response_bytes = 0
+                cpu_started = time.process_time()
+                wall_started = time.perf_counter()
+                for i in range(requests):
+                    nonce = f"bench-{fmt}-{endpoint}-{i}"
+                    player_id, token = auths[i % len(auths)]["playerId"], auths[i % len(auths)]["token"]
+                    ts = int(time.time())
+                    if endpoint == "top":
+                        method, url, raw = "GET", "/leaderboard/top?region=KR&limit=100", b""
+                    elif endpoint == "submit":
+                        body = {
+                            "playerId": player_id,
+                            "score": float(i),
+                            "timestamp": ts,
+                            "nonce": nonce,
+                            "signature": hmac_b64(secret, f"{player_id}|{i}|{ts}"),
+                        }
+                        method, url, raw = "POST", "/leaderboard/submit", encode(body)
+                    else:
+                        body = {
+                            "playerId": player_id,
+                            "eventName": "upgrade_purchase",
+                            "kv": ["level=12", "item=grill"],
+                            "timestamp": ts,
+                            "nonce": nonce,
+                        }
+                        method, url, raw = "POST", "/analytics/event", encode(body)
+                    headers = _signed(secret, player_id, token, nonce, raw)
+                    headers["Accept"] = media_type
+                    if raw:
+                        headers["Content-Type"] = media_type
+                    resp = await client.request(method, url, headers=headers, content=raw)
+                    if resp.status_code != 200:
+                        raise RuntimeError(f"{fmt} {endpoint}: HTTP {resp.status_code} {resp.text[:200]}")
+                    request_bytes += len(raw)
+                    response_bytes += len(resp.content)
+                results.append(
+                    {
+                        "format": fmt,
+                        "endpoint": endpoint,
+                        "request_bytes": round(request_bytes / requests, 1),
+                        "response_bytes": round(response_bytes / requests, 1),
+                        "cpu_us_per_request": round((time.process_time() - cpu_started) * 1e6 / requests, 1),
+                        "wall_us_per_request": round((time.perf_counter() - wall_started) * 1e6 / requests, 1),
+                    }
+                )
+    return results
+
+
+def _codec_cost(rounds: int = 2000) -> list[dict]:
+    import msgpack
+
+    from server.models import LeaderboardEntry, LeaderboardResponse, ScoreSubmitRequest
+
+    top = LeaderboardResponse(
+        entries=[
+            LeaderboardEntry(playerId=f"p_{i:032x}", displayName=f"Guest-{i:04X}", score=1e6 / (i + 1), rank=i + 1)
+            for i in range(100)
+        ]
+    )
+    submit = {
+        "playerId": "p_" + "0" * 32,
+        "score": 1234.0,
+        "timestamp": 1_700_000_000,
+        "nonce": "n" * 16,
+        "signature": "s" * 44,
+    }
+    submit_json = json.dumps(submit).encode("utf-8")
+    submit_mp = msgpack.packb(submit)
+    cases = {
+        ("json", "top"): lambda: top.model_dump_json().encode("utf-8"),
+        ("msgpack", "top"): lambda: msgpack.packb(top.model_dump(mode="json"), use_bin_type=True),
+        ("json", "submit"): lambda: ScoreSubmitRequest.model_validate_json(submit_json),
+        ("msgpack", "submit"): lambda: ScoreSubmitRequest.model_validate(msgpack.unpackb(submit_mp, raw=False)),
+    }
+    results = []
+    for (fmt, endpoint), fn in cases.items():
+        started = time.process_time()
+        for _ in range(rounds):
+            fn()
+        elapsed = time.process_time() - started
+        results.append({"format": fmt, "endpoint": endpoint, "codec_us": round(elapsed * 1e6 / rounds, 2)})
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint and format.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="kbbq_bench_codec_") as tmp:
+        os.environ["KBBQ_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ.setdefault("KBBQ_HMAC_SECRET", "bench-secret")
+        results = asyncio.run(_run(max(1, args.requests)))
+    print(json.dumps({"end_to_end": results, "codec": _codec_cost()}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,108 @@
+"""Leaderboard write throughput: one shared SQLite file vs one shard file per region.
+
+One writer thread per region, each running the synchronous /leaderboard/submit write
+(`writebehind.write_score`: BEGIN IMMEDIATE, best-score read, update, histogram move,
+version bump, commit) on a fresh `get_leaderboard_db` connection per write, as the
+endpoint does per request. Also times what every request pays to open its leaderboard
+connection: the core DB alone vs a shard file plus the ATTACH of the core DB.
+
+    python -m server.bench.bench_shards [--regions 1,2,4,8] [--writes 2000] [--connects 2000]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+
+def _writer(region: str, writes: int, errors: list) -> None:
+    from server.db import get_leaderboard_db
+    from server.writebehind import write_score
+
+    try:
+        for i in range(writes):
+            # Rising scores: every write is a new best (histogram move + version bump).
+            with closing(get_leaderboard_db(region)) as lb:
+                write_score(lb, region, f"p_{region}_{i % 500}", float(i))
+    except Exception as exc:  # noqa: BLE001
+        errors.append(repr(exc))
+
+
+def run(tmp: str, regions: int, writes: int, sharded: bool) -> dict:
+    names = [f"R{i}" for i in range(regions)]
+    mode = "sharded" if sharded else "shared"
+    os.environ["KBBQ_DB_PATH"] = os.path.join(tmp, f"{mode}-{regions}", "core.db")
+    os.environ["KBBQ_SHARD_MAP"] = json.dumps({n: f"{n.lower()}.db" for n in names}) if sharded else ""
+
+    from server.db import init_db
+
+    init_db()
+    errors: list = []
+    threads = [threading.Thread(target=_writer, args=(n, writes, errors)) for n in names]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "mode": mode,
+        "regions": regions,
+        "writes": regions * writes,
+        "seconds": round(elapsed, 3),
+        "writes_per_sec": round(regions * writes / elapsed, 1),
+        "errors": errors[:3],
+    }
+
+
+def connect_cost(tmp: str, connects: int) -> dict:
+    """Microseconds per open + close (+ one indexed read) of a leaderboard connection."""
+    os.environ["KBBQ_DB_PATH"] = os.path.join(tmp, "connect", "core.db")
+    os.environ["KBBQ_SHARD_MAP"] = json.dumps({"R1": "r1.db"})
+
+    from server import queries
+    from server.db import get_leaderboard_db, init_db
+
+    init_db()
+    result = {"connects": connects}
+    for label, region in (("core", "R0"), ("shard_attach", "R1")):
+        get_leaderboard_db(region).close()  # schema setup happens once per process
+        started = time.perf_counter()
+        for _ in range(connects):
+            lb = get_leaderboard_db(region)
+            lb.execute(queries.LEADERBOARD_BEST, (region, "p_0")).fetchone()
+            lb.close()
+        result[f"{label}_us"] = round((time.perf_counter() - started) * 1e6 / connects, 1)
+    lb = get_leaderboard_db("R1")
+    started = time.perf_counter()
+    for _ in range(connects):
+        lb.execute(queries.LEADERBOARD_BEST, ("R1", "p_0")).fetchone()
+    result["reused_us"] = round((time.perf_counter() - started) * 1e6 / connects, 1)
+    lb.close()
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--regions", default="1,2,4,8")
+    parser.add_argument("--writes", type=int, default=2000, help="Committed writes per region.")
+    parser.add_argument("--connects", type=int, default=2000, help="Connection opens timed per mode.")
+    parser.add_argument("--dir", default=None, help="Where to put the DB files (defaults to a temp dir).")
+    args = parser.parse_args(argv)
+
+    counts = [int(c) for c in args.regions.split(",") if c.strip()]
+    with tempfile.TemporaryDirectory(prefix="kbbq_bench_shards_", dir=args.dir) as tmp:
+        results = []
+        for count in counts:
+            for sharded in (False, True):
+                results.append(run(tmp, count, args.writes, sharded))
+        connect = connect_cost(tmp, args.connects)
+    print(json.dumps({"writes": results, "connection": connect}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
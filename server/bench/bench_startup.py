@@ -0,0 +1,112 @@
+"""Cold start benchmark: import time of server.app and time to first ready response.
+
+    python -m server.bench.bench_startup [--runs 5] [--port 8765]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_IMPORT_PROBE = (
+    "import time; t = time.perf_counter(); import server.app; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def measure_import_seconds(env: dict) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", _IMPORT_PROBE],
+        cwd=ROOT_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env: dict, top: int = 10) -> list[dict]:
+    # -X importtime writes "import time: self [us] | cumulative | imported package" to stderr.
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server.app"],
+        cwd=ROOT_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        rows.append({"module": parts[2].strip(), "cumulative_ms": int(parts[1]) / 1000.0})
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def measure_first_ready_seconds(env: dict, port: int, timeout: float = 30.0) -> float:
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server.app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR,
+        env=env,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/readiness"
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as resp:
+                    if json.loads(resp.read()).get("ready"):
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError, OSError):
+                pass
+            time.sleep(0.01)
+        raise TimeoutError("server did not become ready")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="kbbq_bench_startup_") as tmp:
+        env = dict(os.environ)
+        env.setdefault("KBBQ_DB_PATH", os.path.join(tmp, "bench.db"))
+        env["PYTHONPATH"] = ROOT_DIR + os.pathsep + env.get("PYTHONPATH", "")
+
+        import_runs = [measure_import_seconds(env) for _ in range(max(1, args.runs))]
+        ready_runs = [measure_first_ready_seconds(env, args.port or _free_port()) for _ in range(max(1, args.runs))]
+        report = {
+            "import_seconds_median": round(statistics.median(import_runs), 4),
+            "import_seconds_min": round(min(import_runs), 4),
+            "first_ready_seconds_median": round(statistics.median(ready_runs), 4),
+            "first_ready_seconds_min": round(min(ready_runs), 4),
+            "slowest_imports": slowest_imports(env),
+        }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,85 @@
+"""JSON / MessagePack content negotiation for the game client endpoints.
+
+Requests with `Content-Type: application/msgpack` (or `application/x-msgpack`) are decoded
+with msgpack; responses are MessagePack when the `Accept` header asks for it. Everything
+else stays JSON. The signed-header HMAC covers the raw body bytes in either format.
+`msgpack` is imported only when a client negotiates it.
+"""
+
+from typing import Optional, Type
+
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_MSGPACK_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+
+def _media_type(value: str) -> str:
+    return value.split(";", 1)[0].strip().lower()
+
+
+def is_msgpack_body(request: Request) -> bool:
+    return _media_type(request.headers.get("content-type", "")) in _MSGPACK_TYPES
+
+
+def _quality(params: str) -> float:
+    for param in params.split(";"):
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def wants_msgpack(request: Request) -> bool:
+    for part in request.headers.get("accept", "").split(","):
+        media, _, params = part.partition(";")
+        if media.strip().lower() in _MSGPACK_TYPES:
+            return _quality(params) > 0
+    return False
+
+
+def parse_body(request: Request, raw: bytes, model: Type[BaseModel]) -> BaseModel:
+    if is_msgpack_body(request):
+        import msgpack
+
+        try:
+            return model.model_validate(msgpack.unpackb(raw, raw=False))
+        except Exception:
+            raise HTTPException(status_code=400, detail="invalid msgpack body")
+    try:
+        return model.model_validate_json(raw)
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid json body")
+
+
+def representation(request: Request) -> str:
+    # Part of ETags: each encoding is a separate representation of the same resource.
+    return "msgpack" if wants_msgpack(request) else "json"
+
+
+def _plain(content):
+    # pydantic-core's dump is much faster than jsonable_encoder for response models.
+    if isinstance(content, BaseModel):
+        return content.model_dump(mode="json")
+    return jsonable_encoder(content)
+
+
+def render(request: Request, content, response: Optional[Response] = None):
+    """Return `content` unchanged for JSON clients, or a MessagePack `Response`."""
+    if not wants_msgpack(request):
+        return content
+    import msgpack
+
+    headers = dict(response.headers) if response is not None else {}
+    headers.pop("content-length", None)
+    headers.pop("content-type", None)
+    return Response(
+        content=msgpack.packb(_plain(content), use_bin_type=True),
+        media_type=MSGPACK_MEDIA_TYPE,
+        headers=headers,
+    )
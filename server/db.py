@@ -1,8 +1,16 @@
+import json
 import os
+import re
 import sqlite3
 import threading
 import time
 from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from server import analytics, queries
+from server.envutil import env_bool, env_float, env_int
+from server.querylog import connection_factory
 
 
 @dataclass(frozen=True)
@@ -14,19 +22,133 @@ _lock = threading.Lock()
 
 
 def _connect(path: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(path, check_same_thread=False)
+    conn = sqlite3.connect(path, check_same_thread=False, factory=connection_factory())
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def get_db() -> sqlite3.Connection:
-    path = os.getenv("KBBQ_DB_PATH", os.path.join(os.getcwd(), "kbbq.db"))
+# Path -> identity of the file whose schema/migrations already ran in this process.
+_schema_ready: dict[str, Optional[tuple[int, int]]] = {}
+_last_nonce_purge = 0.0
+
+
+def db_path() -> str:
+    return os.getenv("KBBQ_DB_PATH", os.path.join(os.getcwd(), "kbbq.db"))
+
+
+_REGION_RE = re.compile(r"^[A-Z0-9]{1,8}$")
+
+
+@lru_cache(maxsize=8)
+def _parse_shard_map(raw: str, base_dir: str) -> dict[str, str]:
+    try:
+        parsed = json.loads(raw) if raw.strip() else {}
+    except ValueError:
+        parsed = {}
+    if not isinstance(parsed, dict):
+        return {}
+    shards = {}
+    for region, path in parsed.items():
+        region = str(region).strip().upper()
+        if _REGION_RE.match(region) and str(path).strip():
+            shards[region] = os.path.join(base_dir, str(path).strip())
+    return shards
+
+
+def shard_map() -> dict[str, str]:
+    # KBBQ_SHARD_MAP='{"KR": "shards/kr.db", "US": "shards/us.db"}'; relative paths sit next to the core DB.
+    base_dir = os.path.dirname(os.path.abspath(db_path()))
+    return _parse_shard_map(os.getenv("KBBQ_SHARD_MAP", ""), base_dir)
+
+
+def shard_path(region: str) -> Optional[str]:
+    # Unmapped regions stay in the core DB.
+    return shard_map().get((region or "").strip().upper())
+
+
+def init_db() -> None:
+    # Called once from the app lifespan; get_db() falls back to it lazily.
+    get_db().close()
+
+
+def _file_identity(path: str) -> Optional[tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+def _open(path: str, ensure_schema) -> sqlite3.Connection:
     os.makedirs(os.path.dirname(path), exist_ok=True) if os.path.dirname(path) else None
     conn = _connect(path)
-    _ensure_schema(conn)
+    identity = _file_identity(path)
+    # Also re-run when the file was deleted or replaced under this process.
+    if identity is None or _schema_ready.get(path, ()) != identity:
+        if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+            # Only settable before the first table exists; lets maintenance reclaim free pages in steps.
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        if env_bool("KBBQ_SQLITE_WAL"):
+            # Persistent in the file: readers stop blocking the writer; maintenance checkpoints the log.
+            conn.execute("PRAGMA journal_mode = WAL")
+        ensure_schema(conn)
+        analytics.forget_keys(path)
+        _schema_ready[path] = _file_identity(path)
+    return conn
+
+
+def get_db() -> sqlite3.Connection:
+    conn = _open(db_path(), _ensure_schema)
+    _maybe_purge_nonces(conn)
     return conn
 
 
+def get_leaderboard_db(region: str) -> sqlite3.Connection:
+    """Connection for a region's leaderboard tables.
+
+    Without a shard for `region` this is the core DB. Otherwise it is the shard file with
+    the core DB attached as `core`, so joins against `players`/`friends` keep working.
+    """
+    path = shard_path(region)
+    if path is None:
+        return get_db()
+    core = db_path()
+    if core not in _schema_ready:
+        init_db()
+    conn = _open(path, _ensure_leaderboard_schema)
+    conn.execute("ATTACH DATABASE ? AS core", (core,))
+    return conn
+
+
+def leaderboard_db_paths() -> list[str]:
+    # Core DB first, then every configured shard file.
+    paths = [db_path()]
+    for path in shard_map().values():
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+def _maybe_purge_nonces(conn: sqlite3.Connection) -> None:
+    # Opportunistic cleanup (nonce TTL), throttled instead of running on every connection.
+    global _last_nonce_purge
+    interval = env_float("KBBQ_NONCE_PURGE_INTERVAL_SECONDS", 60.0)
+    now = time.monotonic()
+    if _last_nonce_purge and now - _last_nonce_purge < interval:
+        return
+    _last_nonce_purge = now
+    cutoff = int(time.time()) - env_int("KBBQ_NONCE_TTL_SECONDS", 600, minimum=1)
+    conn.execute(queries.NONCE_PURGE, (cutoff,))
+    conn.commit()
+
+
+def _ensure_column(conn: sqlite3.Connection, table: str, column: str, ddl: str) -> None:
+    # Additive migration for DBs created before the column existed.
+    columns = {str(r["name"]) for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl};")
+
+
 def _ensure_schema(conn: sqlite3.Connection) -> None:
     # Keep this idempotent and small (single-file demo DB).
     with _lock:
@@ -38,7 +160,8 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
               display_name TEXT NOT NULL,
               token_sha256 TEXT NOT NULL,
               region TEXT NOT NULL,
-              created_at INTEGER NOT NULL
+              created_at INTEGER NOT NULL,
+              token_epoch INTEGER NOT NULL DEFAULT 0
             );
             """
         )
@@ -52,17 +175,6 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
             );
             """
         )
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS leaderboard (
-              region TEXT NOT NULL,
-              player_id TEXT NOT NULL,
-              score REAL NOT NULL,
-              updated_at INTEGER NOT NULL,
-              PRIMARY KEY (region, player_id)
-            );
-            """
-        )
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS friend_codes (
@@ -81,27 +193,115 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
             );
             """
         )
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS analytics_events (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              player_id TEXT NOT NULL,
-              event_name TEXT NOT NULL,
-              kv_json TEXT NOT NULL,
-              ts INTEGER NOT NULL
-            );
-            """
-        )
-        conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_analytics_events_player_ts ON analytics_events(player_id, ts);"
-        )
-        conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_analytics_events_name_ts ON analytics_events(event_name, ts);"
-        )
+        # Pre-interning DBs: only the table swap happens here; rows are copied in the
+        # background (server/app.py lifespan) or by `python -m server.analytics`.
+        analytics.begin_migration(conn)
+        analytics.create_tables(conn)
+        analytics.create_indexes(conn)
+        # Bearer token lookup on every request; nonce purge by age.
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_players_token_sha256 ON players(token_sha256);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_nonces_ts ON nonces(ts);")
+        _ensure_column(conn, "players", "token_epoch", "INTEGER NOT NULL DEFAULT 0")
+        _create_leaderboard_tables(conn)
         conn.commit()
 
-        # Opportunistic cleanup (nonce TTL)
-        ttl = int(os.getenv("KBBQ_NONCE_TTL_SECONDS", "600"))
-        cutoff = int(time.time()) - max(1, ttl)
-        conn.execute("DELETE FROM nonces WHERE ts < ?", (cutoff,))
+
+def _ensure_leaderboard_schema(conn: sqlite3.Connection) -> None:
+    # Region shard files hold only the leaderboard-scoped tables; core tables come in via ATTACH.
+    with _lock:
+        _create_leaderboard_tables(conn)
         conn.commit()
+
+
+def _create_leaderboard_tables(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard (
+          region TEXT NOT NULL,
+          player_id TEXT NOT NULL,
+          score REAL NOT NULL,
+          updated_at INTEGER NOT NULL,
+          season_epoch INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY (region, player_id)
+        );
+        """
+    )
+    _ensure_column(conn, "leaderboard", "season_epoch", "INTEGER NOT NULL DEFAULT 0")
+    # Current season per region (server/snapshots.py); rows scored in an older epoch are
+    # last season's and get overwritten by the next submit. No row means epoch 0.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_epochs (
+          region TEXT PRIMARY KEY,
+          epoch INTEGER NOT NULL,
+          started_at INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        """
+    )
+    # /leaderboard/top walks this in order instead of sorting the whole region.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_region_score ON leaderboard(region, score DESC);"
+    )
+    # Score distribution per region (server/histogram.py); a few dozen rows per region.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_histogram (
+          region TEXT NOT NULL,
+          bucket INTEGER NOT NULL,
+          count INTEGER NOT NULL,
+          PRIMARY KEY (region, bucket)
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+          scope TEXT PRIMARY KEY,
+          version INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_seasons (
+          season TEXT NOT NULL,
+          region TEXT NOT NULL,
+          entries INTEGER NOT NULL,
+          created_at INTEGER NOT NULL,
+          PRIMARY KEY (season, region)
+        );
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_seasons_region ON leaderboard_seasons(region, created_at);"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_snapshots (
+          season TEXT NOT NULL,
+          region TEXT NOT NULL,
+          rank INTEGER NOT NULL,
+          player_id TEXT NOT NULL,
+          display_name TEXT NOT NULL,
+          score REAL NOT NULL,
+          PRIMARY KEY (season, region, rank)
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_snapshots_player ON leaderboard_snapshots(season, region, player_id);"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_flags (
+          region TEXT NOT NULL,
+          player_id TEXT NOT NULL,
+          score REAL NOT NULL,
+          max_plausible REAL NOT NULL,
+          ratio REAL NOT NULL,
+          audited_at INTEGER NOT NULL,
+          PRIMARY KEY (region, player_id)
+        );
+        """
+    )
+
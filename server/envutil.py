@@ -0,0 +1,53 @@
+"""Env flag parsing shared by the server modules.
+
+Flags are read at call time (tests and operators flip them on a live process). Unset,
+empty or unparsable values fall back to the default; numbers are then clamped to the
+optional [minimum, maximum] range.
+"""
+
+import os
+from typing import Optional
+
+_TRUTHY = ("1", "true", "yes", "on")
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    raw = str(os.getenv(name, "") or "").strip().lower()
+    if not raw:
+        return default
+    return raw in _TRUTHY
+
+
+def _clamp(value, minimum, maximum):
+    if minimum is not None:
+        value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
+
+
+def env_int(name: str, default: int, *, minimum: Optional[int] = None, maximum: Optional[int] = None) -> int:
+    raw = str(os.getenv(name, "") or "").strip()
+    try:
+        value = int(raw) if raw else default
+    except ValueError:
+        value = default
+    return _clamp(value, minimum, maximum)
+
+
+def env_float(
+    name: str,
+    default: Optional[float],
+    *,
+    minimum: Optional[float] = None,
+    maximum: Optional[float] = None,
+) -> Optional[float]:
+    """Like env_int; a None default means "off" and is returned unclamped."""
+    raw = str(os.getenv(name, "") or "").strip()
+    try:
+        value = float(raw) if raw else default
+    except ValueError:
+        value = default
+    if value is None:
+        return None
+    return _clamp(value, minimum, maximum)
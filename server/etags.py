@@ -0,0 +1,62 @@
+import hashlib
+import sqlite3
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Version scopes bumped in the same transaction as the write they describe.
+
+
+def leaderboard_scope(region: str) -> str:
+    return f"leaderboard:{region}"
+
+
+def friends_scope(player_id: str) -> str:
+    return f"friends:{player_id}"
+
+
+def bump_version(db: sqlite3.Connection, scope: str) -> None:
+    db.execute(
+        "INSERT INTO data_versions(scope, version) VALUES(?, 1) "
+        "ON CONFLICT(scope) DO UPDATE SET version = version + 1",
+        (scope,),
+    )
+
+
+def read_version(db: sqlite3.Connection, scope: str) -> int:
+    row = db.execute(
+        "SELECT version FROM data_versions WHERE scope = ?",
+        (scope,),
+    ).fetchone()
+    return int(row["version"]) if row else 0
+
+
+def make_etag(*parts) -> str:
+    # Hashed so user-supplied parts (region, cursor) can't break the header.
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    if not header:
+        return False
+    # Weak comparison (RFC 9110 13.1.2): ignore W/ prefixes.
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+def not_modified(etag: str, vary: Optional[str] = None) -> Response:
+    # A 304 repeats the Vary the 200 would carry (RFC 9110 15.4.5), so caches key it the same way.
+    headers = {"ETag": etag}
+    if vary:
+        headers["Vary"] = vary
+    return Response(status_code=304, headers=headers)
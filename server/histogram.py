@@ -0,0 +1,201 @@
+"""Per-region score histogram for percentile lookups.
+
+Scores fall into log-scaled buckets: bucket 0 holds scores below 1, bucket b >= 1 holds
+[10^((b-1)/N), 10^(b/N)) with N = BUCKETS_PER_DECADE (~26% wide). Only non-empty
+buckets are stored in `leaderboard_histogram`, so a region is a few dozen rows whatever
+its player count. Score writes move the player between buckets in the same transaction
+(`record_moves`); `rebuild_region()` recounts from `leaderboard` to correct any drift
+(periodically from the lifespan, after season resets, and from the CLI):
+
+    python -m server.histogram [--region KR]
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Iterable, Optional
+
+from server import queries
+from server.db import get_leaderboard_db, leaderboard_db_paths
+from server.envutil import env_float
+from server.etags import bump_version, leaderboard_scope
+
+BUCKETS_PER_DECADE = 10
+# Scores up to ~1e308 (the float range); non-finite scores land in the last bucket.
+MAX_BUCKET = 308 * BUCKETS_PER_DECADE + 1
+
+_REBUILD_DELETE = "DELETE FROM leaderboard_histogram WHERE region = ?"
+# Range counts on idx_leaderboard_region_score: no per-row Python callback.
+_MIN_SCORE = "SELECT MIN(score) FROM leaderboard WHERE region = ?"
+_MAX_SCORE = "SELECT MAX(score) FROM leaderboard WHERE region = ?"
+_RANGE_COUNT = "SELECT COUNT(*) FROM leaderboard WHERE region = ? AND score >= ? AND score < ?"
+_REBUILD_INSERT = "INSERT INTO leaderboard_histogram(region, bucket, count) VALUES(?,?,?)"
+_REGIONS = "SELECT DISTINCT region FROM leaderboard UNION SELECT DISTINCT region FROM leaderboard_histogram"
+
+_lock = threading.Lock()
+STATS = {"rebuilds": 0, "rebuild_seconds": 0.0, "corrected": 0}
+
+
+def rebuild_interval_seconds() -> float:
+    # 0 disables the periodic rebuild.
+    return env_float("KBBQ_HISTOGRAM_REBUILD_SECONDS", 3600.0, minimum=0.0)
+
+
+def bucket_lower(bucket: int) -> float:
+    return 0.0 if bucket <= 0 else 10.0 ** ((bucket - 1) / BUCKETS_PER_DECADE)
+
+
+def bucket_upper(bucket: int) -> float:
+    return 1.0 if bucket <= 0 else 10.0 ** (bucket / BUCKETS_PER_DECADE)
+
+
+def score_bucket(score) -> int:
+    score = float(score)
+    if not score >= 1.0:
+        return 0
+    if not math.isfinite(score):
+        return MAX_BUCKET
+    bucket = min(MAX_BUCKET, int(math.floor(math.log10(score) * BUCKETS_PER_DECADE)) + 1)
+    # log10 rounding can land one bucket off right at a boundary.
+    if bucket > 1 and score < bucket_lower(bucket):
+        bucket -= 1
+    elif bucket < MAX_BUCKET and score >= bucket_upper(bucket):
+        bucket += 1
+    return bucket
+
+
+def record_moves(conn: sqlite3.Connection, region: str, moves: Iterable[tuple[Optional[float], float]]) -> None:
+    """Apply (old best or None, new best) score changes; the caller commits."""
+    deltas: dict[int, int] = {}
+    for old, new in moves:
+        new_bucket = score_bucket(new)
+        if old is not None:
+            old_bucket = score_bucket(old)
+            if old_bucket == new_bucket:
+                continue
+            deltas[old_bucket] = deltas.get(old_bucket, 0) - 1
+        deltas[new_bucket] = deltas.get(new_bucket, 0) + 1
+    rows = [(region, bucket, delta) for bucket, delta in sorted(deltas.items()) if delta]
+    if rows:
+        conn.executemany(queries.HISTOGRAM_ADD, rows)
+
+
+def read_buckets(conn: sqlite3.Connection, region: str) -> list[tuple[int, int]]:
+    # Counts can dip below zero for buckets written before the first rebuild.
+    return [
+        (int(r["bucket"]), int(r["count"]))
+        for r in conn.execute(queries.HISTOGRAM_ROWS, (region,)).fetchall()
+        if int(r["count"]) > 0
+    ]
+
+
+def estimate(buckets: list[tuple[int, int]], score: Optional[float], counted: Optional[float] = None) -> dict:
+    """Rank and top-percent of `score` within `buckets`, in O(buckets).
+
+    `counted` is the caller's score as the histogram already counts it (their stored
+    best), or None when they are not in it yet (no row, or a score still buffered).
+    Players are assumed spread evenly (in log space) inside the caller's bucket.
+    """
+    total = sum(count for _, count in buckets)
+    if score is None:
+        return {"total": total, "rank": None, "top_percent": None}
+    mine = score_bucket(score)
+    above = float(sum(count for bucket, count in buckets if bucket > mine))
+    same = sum(count for bucket, count in buckets if bucket == mine)
+    if counted is None:
+        total += 1
+    elif score_bucket(counted) == mine:
+        # Interpolate over the others in the caller's bucket, not the caller.
+        same = max(0, same - 1)
+    if same:
+        lower, upper = bucket_lower(mine), bucket_upper(mine)
+        if mine == 0:
+            fraction = (upper - max(0.0, score)) / upper
+        elif mine == MAX_BUCKET or not math.isfinite(score):
+            fraction = 0.0
+        else:
+            fraction = (math.log10(upper) - math.log10(score)) / (math.log10(upper) - math.log10(lower))
+        above += same * min(1.0, max(0.0, fraction))
+    rank = int(above) + 1
+    # A stored row can predate the first rebuild and be missing from the counts.
+    total = max(total, rank)
+    return {"total": total, "rank": rank, "top_percent": round(100.0 * rank / total, 2)}
+
+
+def rebuild_region(conn: sqlite3.Connection, region: str) -> int:
+    """Recount `region` from the leaderboard in one transaction; returns the bucket count.
+
+    Bumps the region's leaderboard version in the same transaction when any count changed.
+    """
+    started = time.perf_counter()
+    before = {int(r["bucket"]): int(r["count"]) for r in conn.execute(queries.HISTOGRAM_ROWS, (region,)).fetchall()}
+    # DELETE opens the write transaction first, so the counts below see no concurrent submit.
+    conn.execute(_REBUILD_DELETE, (region,))
+    low = conn.execute(_MIN_SCORE, (region,)).fetchone()[0]
+    high = conn.execute(_MAX_SCORE, (region,)).fetchone()[0]
+    after: dict[int, int] = {}
+    if low is not None:
+        for bucket in range(score_bucket(low), score_bucket(high) + 1):
+            lower = float("-inf") if bucket == 0 else bucket_lower(bucket)
+            upper = float("inf") if bucket == MAX_BUCKET else bucket_upper(bucket)
+            count = int(conn.execute(_RANGE_COUNT, (region, lower, upper)).fetchone()[0])
+            if count:
+                after[bucket] = count
+        conn.executemany(_REBUILD_INSERT, [(region, bucket, count) for bucket, count in after.items()])
+    corrected = sum(abs(after.get(b, 0) - before.get(b, 0)) for b in set(before) | set(after))
+    if corrected:
+        # The percentile ETag keys on the leaderboard version: a corrected distribution is new data.
+        bump_version(conn, leaderboard_scope(region))
+    conn.commit()
+    with _lock:
+        STATS["rebuilds"] += 1
+        STATS["rebuild_seconds"] += time.perf_counter() - started
+        STATS["corrected"] += corrected
+    return len(after)
+
+
+def known_regions() -> list[str]:
+    regions: set[str] = set()
+    for path in leaderboard_db_paths():
+        if not os.path.exists(path):
+            continue
+        with closing(sqlite3.connect(path)) as conn:
+            try:
+                regions.update(str(r[0]) for r in conn.execute(_REGIONS).fetchall())
+            except sqlite3.OperationalError:
+                continue
+    return sorted(regions)
+
+
+def rebuild_all(regions: Optional[Iterable[str]] = None) -> dict[str, int]:
+    rebuilt = {}
+    for region in sorted(regions) if regions is not None else known_regions():
+        with closing(get_leaderboard_db(region)) as lb:
+            rebuilt[region] = rebuild_region(lb, region)
+    return rebuilt
+
+
+def snapshot() -> dict:
+    with _lock:
+        return dict(STATS)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild the per-region score histograms from the leaderboard.")
+    parser.add_argument("--region", action="append", help="Region to rebuild (repeatable); default: all.")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    regions = [r.strip().upper() for r in args.region] if args.region else None
+    rebuilt = rebuild_all(regions)
+    print(json.dumps({"buckets": rebuilt, "seconds": round(time.perf_counter() - started, 3)}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
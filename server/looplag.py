@@ -0,0 +1,152 @@
+"""Event-loop lag monitor and blocking-call watchdog.
+
+`monitor_loop_lag()` sleeps for a fixed interval on the loop and records how late it
+woke up (scheduled vs actual) into a histogram; anything a handler runs synchronously
+on the loop (sqlite3, blocking HTTP) shows up as lag. With KBBQ_LOOP_BLOCK_MS set, a
+watchdog thread also logs the loop thread's current stack whenever the monitor has
+not woken up for longer than that, i.e. while the blocking call is still running.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from server.envutil import env_float
+
+logger = logging.getLogger("kbbq.looplag")
+
+# Upper bounds in seconds; the implicit last bucket is +Inf.
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def lag_interval_seconds() -> float:
+    # 0 disables the monitor.
+    return env_float("KBBQ_LOOP_LAG_INTERVAL_MS", 100.0, minimum=0.0) / 1000.0
+
+
+def block_threshold_seconds() -> Optional[float]:
+    threshold = env_float("KBBQ_LOOP_BLOCK_MS", 0.0)
+    return threshold / 1000.0 if threshold > 0 else None
+
+
+class LagHistogram:
+    def __init__(self, buckets: tuple[float, ...] = LAG_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.max = 0.0
+        self.blocked_reports = 0
+
+    def observe(self, lag: float) -> None:
+        idx = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if lag <= bound:
+                idx = i
+                break
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += lag
+            self.max = max(self.max, lag)
+
+    def note_blocked(self) -> None:
+        with self._lock:
+            self.blocked_reports += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cumulative = []
+            running = 0
+            for count in self.counts:
+                running += count
+                cumulative.append(running)
+            return {
+                "buckets": list(zip(list(self.buckets) + [float("inf")], cumulative)),
+                "count": running,
+                "sum": self.sum,
+                "max": self.max,
+                "blocked_reports": self.blocked_reports,
+            }
+
+    def prometheus_lines(self, name: str, help_text: str) -> list[str]:
+        snap = self.snapshot()
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for bound, count in snap["buckets"]:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{le="{le}"}} {count}')
+        lines.append(f"{name}_sum {snap['sum']:.6f}")
+        lines.append(f"{name}_count {snap['count']}")
+        return lines
+
+
+LOOP_LAG = LagHistogram()
+
+
+class _Heartbeat:
+    def __init__(self):
+        self.beat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+
+
+_heartbeat = _Heartbeat()
+
+
+async def monitor_loop_lag(interval: float, histogram: LagHistogram = LOOP_LAG) -> None:
+    loop = asyncio.get_running_loop()
+    _heartbeat.loop_thread_id = threading.get_ident()
+    try:
+        while True:
+            _heartbeat.beat = time.monotonic()
+            scheduled = loop.time() + interval
+            await asyncio.sleep(interval)
+            histogram.observe(max(0.0, loop.time() - scheduled))
+    finally:
+        # A stopped monitor is not a blocked loop.
+        _heartbeat.loop_thread_id = None
+
+
+def _format_thread_stack(thread_id: int) -> str:
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return "<loop thread not running>"
+    return "".join(traceback.format_stack(frame))
+
+
+class BlockingWatchdog:
+    """Logs the loop thread's stack when the lag monitor stops waking up."""
+
+    def __init__(self, interval: float, threshold: float, histogram: LagHistogram = LOOP_LAG):
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = histogram
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="kbbq-loop-watchdog", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    def _run(self) -> None:
+        reported_beat = None
+        while not self._stop.wait(max(0.005, self.threshold / 4)):
+            beat = _heartbeat.beat
+            stalled = time.monotonic() - beat - self.interval
+            thread_id = _heartbeat.loop_thread_id
+            # One report per stall: the heartbeat only moves once the loop runs again.
+            if stalled < self.threshold or thread_id is None or beat == reported_beat:
+                continue
+            reported_beat = beat
+            self.histogram.note_blocked()
+            logger.warning(
+                "event loop blocked for %.0f ms (threshold %.0f ms); loop thread stack:\n%s",
+                stalled * 1000.0,
+                self.threshold * 1000.0,
+                _format_thread_stack(thread_id),
+            )
@@ -0,0 +1,252 @@
+"""Scheduled SQLite maintenance: statistics, incremental vacuum and WAL checkpoints.
+
+The lifespan calls `run_maintenance()` every KBBQ_MAINTENANCE_INTERVAL_SECONDS from a
+worker thread, but skips ticks while the server is busy (more than
+KBBQ_MAINTENANCE_IDLE_RPS DB sessions per second since the previous tick). After
+KBBQ_MAINTENANCE_MAX_DEFERRALS skipped ticks in a row it runs anyway. Each DB file
+(core + region shards) gets three small steps:
+
+- `analyze`: planner statistics with `PRAGMA analysis_limit` set, so the cost per index
+  stays bounded (`PRAGMA optimize` on SQLite >= 3.46, plain ANALYZE before that);
+- `vacuum`: `PRAGMA incremental_vacuum` in chunks until the freelist is empty or
+  KBBQ_MAINTENANCE_STEP_MS is used up. This only works for auto_vacuum=INCREMENTAL
+  files. New DBs are created that way; `--convert` rewrites older ones with a full VACUUM;
+- `checkpoint`: a PASSIVE `wal_checkpoint`, only for files in WAL mode.
+
+Maintenance connections use a short busy timeout. A step that cannot get the lock is
+counted as an error and retried on the next tick; it does not wait behind traffic.
+
+    python -m server.maintenance [--convert]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Optional
+
+from server.db import leaderboard_db_paths
+from server.envutil import env_float, env_int
+
+STEPS = ("analyze", "vacuum", "checkpoint")
+_AUTO_VACUUM_INCREMENTAL = 2
+
+_lock = threading.Lock()
+# Bumped once per DB session (server/app.py); the scheduler's traffic signal.
+_activity = 0
+_last_tick = {"activity": 0, "at": time.monotonic(), "deferrals": 0}
+STATS: dict = {
+    "runs": 0,
+    "deferred": 0,
+    "reclaimed_pages": 0,
+    "checkpointed_pages": 0,
+    "freelist_pages": 0,
+    "steps": {step: {"runs": 0, "errors": 0, "seconds": 0.0, "last_seconds": 0.0} for step in STEPS},
+}
+
+
+def interval_seconds() -> float:
+    # 0 disables the scheduler.
+    return env_float("KBBQ_MAINTENANCE_INTERVAL_SECONDS", 300.0, minimum=0.0)
+
+
+def idle_requests_per_second() -> float:
+    return env_float("KBBQ_MAINTENANCE_IDLE_RPS", 5.0, minimum=0.0)
+
+
+def max_deferrals() -> int:
+    return env_int("KBBQ_MAINTENANCE_MAX_DEFERRALS", 12, minimum=0)
+
+
+def step_budget_seconds() -> float:
+    return env_float("KBBQ_MAINTENANCE_STEP_MS", 200.0, minimum=1.0) / 1000.0
+
+
+def analysis_limit() -> int:
+    return env_int("KBBQ_MAINTENANCE_ANALYSIS_LIMIT", 400, minimum=0)
+
+
+def vacuum_chunk_pages() -> int:
+    return env_int("KBBQ_MAINTENANCE_VACUUM_PAGES", 256, minimum=1)
+
+
+def note_activity() -> None:
+    # Unlocked on the request path: a lost increment does not matter for a rate estimate.
+    global _activity
+    _activity += 1
+
+
+def should_run(now: Optional[float] = None) -> bool:
+    """True when traffic since the previous call was below KBBQ_MAINTENANCE_IDLE_RPS."""
+    now = time.monotonic() if now is None else now
+    activity = _activity
+    with _lock:
+        elapsed = max(1e-6, now - _last_tick["at"])
+        rate = (activity - _last_tick["activity"]) / elapsed
+        _last_tick["activity"], _last_tick["at"] = activity, now
+        if rate <= idle_requests_per_second() or _last_tick["deferrals"] >= max_deferrals():
+            _last_tick["deferrals"] = 0
+            return True
+        _last_tick["deferrals"] += 1
+        STATS["deferred"] += 1
+        return False
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # Plain connection: no schema setup, not traced by the slow-query log.
+    conn = sqlite3.connect(path, timeout=0.2, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 200")
+    return conn
+
+
+def _pragma_value(conn: sqlite3.Connection, pragma: str):
+    return conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+
+
+def analyze(conn: sqlite3.Connection) -> dict:
+    limit = analysis_limit()
+    conn.execute(f"PRAGMA analysis_limit = {limit}")
+    if sqlite3.sqlite_version_info >= (3, 46, 0):
+        # 0x10000: consider every table, not only the ones this connection has queried.
+        conn.execute("PRAGMA optimize = 0x10002")
+    else:
+        conn.execute("ANALYZE")
+    return {"analysis_limit": limit}
+
+
+def incremental_vacuum(conn: sqlite3.Connection, budget: float) -> dict:
+    if _pragma_value(conn, "auto_vacuum") != _AUTO_VACUUM_INCREMENTAL:
+        return {"skipped": "auto_vacuum is not INCREMENTAL", "freelist_pages": _pragma_value(conn, "freelist_count")}
+    before = _pragma_value(conn, "freelist_count")
+    deadline = time.perf_counter() + budget
+    chunk = vacuum_chunk_pages()
+    remaining = before
+    while remaining > 0 and time.perf_counter() < deadline:
+        # The pragma frees pages while its result rows are stepped: fetch them all.
+        conn.execute(f"PRAGMA incremental_vacuum({chunk})").fetchall()
+        remaining = _pragma_value(conn, "freelist_count")
+    return {"reclaimed_pages": before - remaining, "freelist_pages": remaining}
+
+
+def checkpoint(conn: sqlite3.Connection) -> dict:
+    if str(_pragma_value(conn, "journal_mode")).lower() != "wal":
+        return {"skipped": "not in WAL mode"}
+    busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    return {"busy": bool(busy), "wal_pages": log_pages, "checkpointed_pages": max(0, checkpointed)}
+
+
+def _run_step(step: str, conn: sqlite3.Connection) -> dict:
+    started = time.perf_counter()
+    try:
+        if step == "analyze":
+            result = analyze(conn)
+        elif step == "vacuum":
+            result = incremental_vacuum(conn, step_budget_seconds())
+        else:
+            result = checkpoint(conn)
+    except sqlite3.OperationalError as exc:
+        # Usually "database is locked": traffic wins, the next tick retries.
+        result = {"error": str(exc)}
+    elapsed = time.perf_counter() - started
+    with _lock:
+        stats = STATS["steps"][step]
+        stats["runs"] += 1
+        stats["seconds"] += elapsed
+        stats["last_seconds"] = elapsed
+        if "error" in result:
+            stats["errors"] += 1
+        STATS["reclaimed_pages"] += result.get("reclaimed_pages", 0)
+        STATS["checkpointed_pages"] += result.get("checkpointed_pages", 0)
+    return {**result, "seconds": round(elapsed, 4)}
+
+
+def run_maintenance(paths: Optional[list[str]] = None) -> dict:
+    """One round over every DB file; returns the per-file step results."""
+    report = {}
+    freelist = 0
+    for path in paths if paths is not None else leaderboard_db_paths():
+        if not os.path.exists(path):
+            continue
+        with closing(_connect(path)) as conn:
+            report[path] = {step: _run_step(step, conn) for step in STEPS}
+        freelist += report[path]["vacuum"].get("freelist_pages", 0)
+    with _lock:
+        STATS["runs"] += 1
+        STATS["freelist_pages"] = freelist
+    return report
+
+
+def convert_to_incremental(path: str) -> dict:
+    """Switch an existing file to auto_vacuum=INCREMENTAL (full VACUUM; run with writes paused)."""
+    started = time.perf_counter()
+    with closing(sqlite3.connect(path, isolation_level=None)) as conn:
+        before = _pragma_value(conn, "page_count")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return {
+            "auto_vacuum": _pragma_value(conn, "auto_vacuum"),
+            "pages_before": before,
+            "pages_after": _pragma_value(conn, "page_count"),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {**STATS, "steps": {step: dict(stats) for step, stats in STATS["steps"].items()}}
+
+
+def prometheus_lines() -> list[str]:
+    snap = snapshot()
+    return [
+        "# HELP kbbq_maintenance_runs_total SQLite maintenance rounds (all DB files).",
+        "# TYPE kbbq_maintenance_runs_total counter",
+        f"kbbq_maintenance_runs_total {snap['runs']}",
+        "# HELP kbbq_maintenance_deferred_total Maintenance ticks skipped because of traffic.",
+        "# TYPE kbbq_maintenance_deferred_total counter",
+        f"kbbq_maintenance_deferred_total {snap['deferred']}",
+        "# HELP kbbq_maintenance_step_seconds_total Time spent per maintenance step.",
+        "# TYPE kbbq_maintenance_step_seconds_total counter",
+        *(f'kbbq_maintenance_step_seconds_total{{step="{s}"}} {v["seconds"]:.6f}' for s, v in snap["steps"].items()),
+        "# HELP kbbq_maintenance_step_last_seconds Duration of the latest run of each step.",
+        "# TYPE kbbq_maintenance_step_last_seconds gauge",
+        *(f'kbbq_maintenance_step_last_seconds{{step="{s}"}} {v["last_seconds"]:.6f}' for s, v in snap["steps"].items()),
+        "# HELP kbbq_maintenance_step_errors_total Maintenance steps that failed (mostly lock timeouts).",
+        "# TYPE kbbq_maintenance_step_errors_total counter",
+        *(f'kbbq_maintenance_step_errors_total{{step="{s}"}} {v["errors"]}' for s, v in snap["steps"].items()),
+        "# HELP kbbq_maintenance_reclaimed_pages_total Free pages returned to the OS by incremental vacuum.",
+        "# TYPE kbbq_maintenance_reclaimed_pages_total counter",
+        f"kbbq_maintenance_reclaimed_pages_total {snap['reclaimed_pages']}",
+        "# HELP kbbq_maintenance_checkpointed_pages_total WAL pages written back by checkpoints.",
+        "# TYPE kbbq_maintenance_checkpointed_pages_total counter",
+        f"kbbq_maintenance_checkpointed_pages_total {snap['checkpointed_pages']}",
+        "# HELP kbbq_db_freelist_pages Free pages left in the DB files after the latest round.",
+        "# TYPE kbbq_db_freelist_pages gauge",
+        f"kbbq_db_freelist_pages {snap['freelist_pages']}",
+    ]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run one SQLite maintenance round over the core DB and shards.")
+    parser.add_argument(
+        "--convert", action="store_true", help="Switch files to auto_vacuum=INCREMENTAL first (full VACUUM)."
+    )
+    args = parser.parse_args(argv)
+
+    paths = [path for path in leaderboard_db_paths() if os.path.exists(path)]
+    converted = {}
+    if args.convert:
+        for path in paths:
+            with closing(sqlite3.connect(path)) as conn:
+                if _pragma_value(conn, "auto_vacuum") == _AUTO_VACUUM_INCREMENTAL:
+                    continue
+            converted[path] = convert_to_incremental(path)
+    print(json.dumps({"converted": converted, "maintenance": run_maintenance(paths)}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
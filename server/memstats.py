@@ -0,0 +1,143 @@
+"""Process memory accounting.
+
+Modules that keep state in process memory register it here (`register("name", getter)`),
+so /ops/memory reports an entry count and an approximate deep size for each structure
+next to the process RSS. /metrics only exports the entry counts: a deep size walks every
+object and is too costly for an unauthenticated scrape. `tracemalloc` top allocators are opt-in
+(KBBQ_TRACEMALLOC=1, started by the lifespan) because tracing slows allocation.
+"""
+
+import sys
+import threading
+import tracemalloc
+from collections import deque
+from typing import Callable, Optional
+
+from server.envutil import env_bool, env_int
+
+_registry: dict[str, Callable[[], object]] = {}
+_lock = threading.Lock()
+_CONTAINERS = (list, tuple, set, frozenset, deque)
+
+
+def register(name: str, getter: Callable[[], object]) -> None:
+    """`getter` returns the live structure (dict, list, deque, ...); called on every report."""
+    with _lock:
+        _registry[name] = getter
+
+
+def deep_sizeof(obj) -> int:
+    # Containers and their contents; objects reachable more than once are counted once.
+    seen: set[int] = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, _CONTAINERS):
+            stack.extend(item)
+    return total
+
+
+def _measure(getter: Callable[[], object]) -> dict:
+    # Other threads may resize the structure mid-walk; retry a few times.
+    for _ in range(3):
+        try:
+            obj = getter()
+            entries = len(obj) if hasattr(obj, "__len__") else None
+            return {"entries": entries, "bytes": deep_sizeof(obj)}
+        except RuntimeError:
+            continue
+    return {"entries": None, "bytes": None}
+
+
+def structure_entries() -> dict[str, Optional[int]]:
+    """len() of every registered structure; cheap enough for each /metrics scrape."""
+    with _lock:
+        registry = sorted(_registry.items())
+    counts = {}
+    for name, getter in registry:
+        try:
+            obj = getter()
+            counts[name] = len(obj) if hasattr(obj, "__len__") else None
+        except RuntimeError:
+            counts[name] = None
+    return counts
+
+
+def structure_sizes() -> dict[str, dict]:
+    with _lock:
+        registry = sorted(_registry.items())
+    return {name: _measure(getter) for name, getter in registry}
+
+
+def _proc_status_bytes(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status", encoding="ascii") as fh:
+            for line in fh:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return None
+
+
+def rss_bytes() -> Optional[int]:
+    return _proc_status_bytes("VmRSS")
+
+
+def peak_rss_bytes() -> Optional[int]:
+    peak = _proc_status_bytes("VmHWM")
+    if peak is not None:
+        return peak
+    try:
+        import resource
+
+        # ru_maxrss is KiB on Linux and bytes on macOS.
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(maxrss if sys.platform == "darwin" else maxrss * 1024)
+    except (ImportError, OSError):
+        return None
+
+
+def tracemalloc_requested() -> bool:
+    return env_bool("KBBQ_TRACEMALLOC")
+
+
+def start_tracemalloc() -> bool:
+    if not tracemalloc_requested():
+        return False
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(env_int("KBBQ_TRACEMALLOC_FRAMES", 1, minimum=1))
+    return True
+
+
+def top_allocations(limit: int = 20) -> dict:
+    if not tracemalloc.is_tracing():
+        return {"enabled": False, "top": []}
+    current, peak = tracemalloc.get_traced_memory()
+    stats = tracemalloc.take_snapshot().statistics("lineno")
+    return {
+        "enabled": True,
+        "traced_bytes": current,
+        "peak_traced_bytes": peak,
+        "top": [
+            {"where": str(stat.traceback[0]), "bytes": stat.size, "count": stat.count}
+            for stat in stats[: max(1, limit)]
+        ],
+    }
+
+
+def report(top: int = 20) -> dict:
+    return {
+        "rss_bytes": rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "structures": structure_sizes(),
+        "tracemalloc": top_allocations(top),
+    }
@@ -6,6 +6,8 @@ from pydantic import BaseModel, Field
 class AuthResponse(BaseModel):
     playerId: str
     token: str
+    # Unix seconds; 0 for legacy opaque tokens (no expiry).
+    expiresAt: int = 0
 
 
 class LeaderboardEntry(BaseModel):
@@ -19,6 +21,41 @@ class LeaderboardResponse(BaseModel):
     entries: list[LeaderboardEntry] = Field(default_factory=list)
 
 
+class ScoreBucket(BaseModel):
+    lower: float
+    upper: float
+    count: int
+
+
+class PercentileResponse(BaseModel):
+    region: str
+    totalPlayers: int = 0
+    # Caller's best score; rank/topPercent are estimates from the bucket counts.
+    score: float | None = None
+    rankEstimate: int | None = None
+    topPercent: float | None = None
+    buckets: list[ScoreBucket] = Field(default_factory=list)
+
+
+class SeasonInfo(BaseModel):
+    season: str
+    region: str
+    entries: int
+    createdAt: int
+
+
+class SeasonListResponse(BaseModel):
+    seasons: list[SeasonInfo] = Field(default_factory=list)
+
+
+class SeasonLeaderboardResponse(BaseModel):
+    season: str
+    region: str
+    totalEntries: int = 0
+    entries: list[LeaderboardEntry] = Field(default_factory=list)
+    me: LeaderboardEntry | None = None
+
+
 class FriendEntry(BaseModel):
     playerId: str
     displayName: str
@@ -28,6 +65,12 @@ class FriendListResponse(BaseModel):
     friends: list[FriendEntry] = Field(default_factory=list)
 
 
+class FriendLeaderboardResponse(BaseModel):
+    entries: list[LeaderboardEntry] = Field(default_factory=list)
+    friendCount: int = 0
+    nextCursor: str = ""
+
+
 class ScoreSubmitRequest(BaseModel):
     playerId: str
     score: float
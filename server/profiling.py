@@ -0,0 +1,72 @@
+"""On-demand sampling profiler for the live process.
+
+The calling thread walks `sys._current_frames()` every `interval` seconds for the
+capture window. Nothing is installed between captures, so the idle cost is zero; only one
+capture runs at a time.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+_capture_lock = threading.Lock()
+
+
+class CaptureInProgress(RuntimeError):
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float) -> tuple[Counter, int]:
+    """Return (collapsed stack -> sample count, number of sampling ticks)."""
+    if not _capture_lock.acquire(blocking=False):
+        raise CaptureInProgress("a profile capture is already running")
+    try:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        ticks = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            ticks += 1
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                root = names.get(thread_id, f"thread-{thread_id}")
+                stacks[";".join([root] + labels[::-1])] += 1
+            time.sleep(interval)
+        return stacks, ticks
+    finally:
+        _capture_lock.release()
+
+
+def render_collapsed(stacks: Counter) -> str:
+    # Brendan Gregg's collapsed format: feed to flamegraph.pl / speedscope as-is.
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def render_top(stacks: Counter, ticks: int, limit: int = 40) -> str:
+    # pstats-like summary: self samples (leaf frame) and cumulative samples per function.
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        self_counts[frames[-1]] += count
+        for label in set(frames):
+            total_counts[label] += count
+    lines = [f"{ticks} ticks, {sum(stacks.values())} samples", f"{'self':>8} {'total':>8}  function"]
+    for label, total in total_counts.most_common(limit):
+        lines.append(f"{self_counts.get(label, 0):>8} {total:>8}  {label}")
+    return "\n".join(lines) + "\n"
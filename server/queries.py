@@ -0,0 +1,94 @@
+"""Hot-path SQL shared by the request handlers.
+
+Every statement a request runs on the hot path lives here so that
+`server/tests/test_query_plans.py` checks the exact text the handlers execute: the
+plan of each one is pinned to an index lookup (no full table SCAN, no unexpected
+temp B-tree sort). Add new per-request statements here, not inline.
+"""
+
+# Bearer auth / replay protection (security.py, db.py).
+TOKEN_LOOKUP = "SELECT player_id FROM players WHERE token_sha256 = ?"
+TOKEN_EPOCH = "SELECT token_epoch FROM players WHERE player_id = ?"
+NONCE_INSERT = "INSERT INTO nonces(player_id, nonce, ts) VALUES(?,?,?)"
+NONCE_PURGE = "DELETE FROM nonces WHERE ts < ?"
+
+# Players.
+PLAYER_BY_DEVICE = "SELECT player_id, region, token_epoch FROM players WHERE device_id = ?"
+PLAYER_REGION = "SELECT region, created_at FROM players WHERE player_id = ?"
+PLAYER_DISPLAY_NAME = "SELECT display_name FROM players WHERE player_id = ?"
+
+# Leaderboard.
+LEADERBOARD_BEST = "SELECT score, season_epoch FROM leaderboard WHERE region = ? AND player_id = ?"
+LEADERBOARD_INSERT = "INSERT INTO leaderboard(region, player_id, score, updated_at, season_epoch) VALUES(?,?,?,?,?)"
+LEADERBOARD_UPDATE = (
+    "UPDATE leaderboard SET score = ?, updated_at = ?, season_epoch = ? WHERE region = ? AND player_id = ?"
+)
+LEADERBOARD_EPOCH = "SELECT epoch, started_at FROM leaderboard_epochs WHERE region = ?"
+# Write-behind flush (server/writebehind.py): coalesced maxima, never lowers a stored score
+# of the current season; a row from an older season is overwritten.
+LEADERBOARD_UPSERT_MAX = (
+    "INSERT INTO leaderboard(region, player_id, score, updated_at, season_epoch) VALUES(?,?,?,?,?) "
+    "ON CONFLICT(region, player_id) DO UPDATE SET "
+    "score = CASE WHEN season_epoch < excluded.season_epoch THEN excluded.score ELSE MAX(score, excluded.score) END, "
+    "updated_at = MAX(updated_at, excluded.updated_at), season_epoch = MAX(season_epoch, excluded.season_epoch)"
+)
+# Walks idx_leaderboard_region_score in order: no sort, reads `limit` rows.
+LEADERBOARD_TOP = (
+    "SELECT l.player_id, p.display_name, l.score FROM leaderboard l JOIN players p ON p.player_id = l.player_id "
+    "WHERE l.region = ? ORDER BY l.score DESC LIMIT ?"
+)
+# Score histogram (server/histogram.py): one row per non-empty bucket of a region.
+HISTOGRAM_ROWS = "SELECT bucket, count FROM leaderboard_histogram WHERE region = ? ORDER BY bucket"
+HISTOGRAM_ADD = (
+    "INSERT INTO leaderboard_histogram(region, bucket, count) VALUES(?,?,?) "
+    "ON CONFLICT(region, bucket) DO UPDATE SET count = count + excluded.count"
+)
+# Season list and lookup (/leaderboard/seasons, /leaderboard/season); the list walks
+# idx_leaderboard_seasons_region newest first.
+SEASON_LIST = (
+    "SELECT season, entries, created_at FROM leaderboard_seasons WHERE region = ? ORDER BY created_at DESC LIMIT 100"
+)
+SEASON_INFO = "SELECT entries FROM leaderboard_seasons WHERE season = ? AND region = ?"
+SEASON_PAGE = (
+    "SELECT rank, player_id, display_name, score FROM leaderboard_snapshots "
+    "WHERE season = ? AND region = ? AND rank > ? ORDER BY rank LIMIT ?"
+)
+# Without ANALYZE stats the planner prefers the PK prefix (season, region), i.e. the whole season.
+SEASON_ME = (
+    "SELECT rank, player_id, display_name, score FROM leaderboard_snapshots "
+    "INDEXED BY idx_leaderboard_snapshots_player WHERE season = ? AND region = ? AND player_id = ?"
+)
+
+# Friends.
+FRIEND_IDS = "SELECT friend_player_id FROM friends WHERE player_id = ?"
+FRIEND_CODE_LOOKUP = "SELECT player_id FROM friend_codes WHERE code = ?"
+FRIEND_CODE_BY_PLAYER = "SELECT code FROM friend_codes WHERE player_id = ?"
+FRIEND_INSERT = "INSERT OR IGNORE INTO friends(player_id, friend_player_id, created_at) VALUES(?,?,?)"
+# Sorts the caller's friend set only (bounded by the friend count), never the players table.
+FRIENDS_LIST = (
+    "SELECT f.friend_player_id, p.display_name FROM friends f JOIN players p ON p.player_id = f.friend_player_id "
+    "WHERE f.player_id = ? ORDER BY p.display_name ASC LIMIT 50"
+)
+# The caller's cached friend set is bound as a JSON array (json_each over the parameter);
+# CROSS JOIN pins the join order so each id is a point lookup into the leaderboard PK.
+# Left to itself the planner may walk every leaderboard row of the region instead.
+FRIENDS_LEADERBOARD = (
+    "SELECT l.player_id, p.display_name, l.score FROM json_each(?) f "
+    "CROSS JOIN leaderboard l ON l.region = ? AND l.player_id = f.value "
+    "JOIN players p ON p.player_id = l.player_id"
+)
+FRIENDS_LEADERBOARD_AFTER = " WHERE (l.score < ? OR (l.score = ? AND l.player_id > ?))"
+FRIENDS_LEADERBOARD_ORDER = " ORDER BY l.score DESC, l.player_id ASC LIMIT ?"
+# Friends ranked at or before a cursor position: the page's rank offset, derived server-side.
+FRIENDS_LEADERBOARD_RANK = (
+    "SELECT COUNT(*) AS c FROM json_each(?) f "
+    "CROSS JOIN leaderboard l ON l.region = ? AND l.player_id = f.value "
+    "WHERE l.score > ? OR (l.score = ? AND l.player_id <= ?)"
+)
+
+# Analytics (server/analytics.py); the interning pair only runs on a cache miss.
+EVENT_NAME_INSERT = "INSERT OR IGNORE INTO analytics_event_names(name) VALUES(?)"
+EVENT_NAME_ID = "SELECT id FROM analytics_event_names WHERE name = ?"
+ANALYTICS_PLAYER_INSERT = "INSERT OR IGNORE INTO analytics_players(player_id) VALUES(?)"
+ANALYTICS_PLAYER_KEY = "SELECT id FROM analytics_players WHERE player_id = ?"
+ANALYTICS_INSERT = "INSERT INTO analytics_events(player_key, name_id, kv, ts) VALUES(?,?,?,?)"
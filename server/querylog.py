@@ -0,0 +1,133 @@
+"""Opt-in SQLite slow-query log.
+
+With KBBQ_SLOW_QUERY_MS set, connections are created with `TracingConnection`, which
+times every `execute`/`executemany` (time to first row) and keeps statements over the
+threshold in a bounded ring buffer together with their normalized SQL, parameter
+shape and `EXPLAIN QUERY PLAN`. Unset, connections are plain `sqlite3.Connection`.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from server import memstats
+from server.envutil import env_float, env_int
+
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE_RE = re.compile(r"\s+")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+_lock = threading.Lock()
+_entries: deque = deque(maxlen=200)
+_plans: dict[str, list[str]] = {}
+_PLAN_CACHE_MAX = 256
+COUNTERS = {"statements": 0, "slow_statements": 0, "statement_seconds": 0.0}
+memstats.register("slow_query_log", lambda: _entries)
+memstats.register("slow_query_plans", lambda: _plans)
+
+
+def slow_query_threshold_ms() -> Optional[float]:
+    return env_float("KBBQ_SLOW_QUERY_MS", None, minimum=0.0)
+
+
+def connection_factory():
+    return TracingConnection if slow_query_threshold_ms() is not None else sqlite3.Connection
+
+
+def normalize_sql(sql: str) -> str:
+    sql = _STRING_LITERAL_RE.sub("?", sql)
+    sql = _NUMBER_LITERAL_RE.sub("?", sql)
+    return _WHITESPACE_RE.sub(" ", sql).strip()
+
+
+def params_shape(parameters) -> str:
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    return "(" + ", ".join(type(v).__name__ for v in parameters) + ")"
+
+
+def _log_size() -> int:
+    return env_int("KBBQ_SLOW_QUERY_LOG_SIZE", 200, minimum=1)
+
+
+def _resize(size: int) -> None:
+    global _entries
+    if _entries.maxlen != size:
+        _entries = deque(_entries, maxlen=size)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "threshold_ms": slow_query_threshold_ms(),
+            "counters": dict(COUNTERS),
+            "entries": list(reversed(_entries)),
+        }
+
+
+def reset() -> None:
+    with _lock:
+        _entries.clear()
+        _plans.clear()
+        COUNTERS.update({"statements": 0, "slow_statements": 0, "statement_seconds": 0.0})
+
+
+class TracingConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=(), /):
+        started = time.perf_counter()
+        cur = super().execute(sql, parameters)
+        self._trace(sql, parameters, time.perf_counter() - started, batch=None)
+        return cur
+
+    def executemany(self, sql, seq_of_parameters, /):
+        seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        cur = super().executemany(sql, seq_of_parameters)
+        first = seq_of_parameters[0] if seq_of_parameters else ()
+        self._trace(sql, first, time.perf_counter() - started, batch=len(seq_of_parameters))
+        return cur
+
+    def _trace(self, sql: str, parameters, elapsed: float, *, batch: Optional[int]) -> None:
+        threshold = slow_query_threshold_ms()
+        with _lock:
+            COUNTERS["statements"] += 1
+            COUNTERS["statement_seconds"] += elapsed
+            slow = threshold is not None and elapsed * 1000.0 >= threshold
+            if slow:
+                COUNTERS["slow_statements"] += 1
+        if not slow:
+            return
+
+        normalized = normalize_sql(sql)
+        entry = {
+            "ts": int(time.time()),
+            "ms": round(elapsed * 1000.0, 3),
+            "sql": normalized,
+            "params": params_shape(parameters),
+            "batch": batch,
+            "plan": self._plan(sql, normalized, parameters),
+        }
+        with _lock:
+            _resize(_log_size())
+            _entries.append(entry)
+
+    def _plan(self, sql: str, normalized: str, parameters) -> list[str]:
+        cached = _plans.get(normalized)
+        if cached is not None:
+            return cached
+        if not normalized.upper().startswith(_EXPLAINABLE):
+            return []
+        try:
+            rows = super().execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+            plan = [str(r[3]) for r in rows]
+        except sqlite3.Error:
+            plan = []
+        with _lock:
+            if len(_plans) >= _PLAN_CACHE_MAX:
+                _plans.pop(next(iter(_plans)), None)
+            _plans[normalized] = plan
+        return plan
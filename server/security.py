@@ -1,14 +1,19 @@
 import base64
 import hashlib
 import hmac
+import json
 import os
 import secrets
 import sqlite3
 import time
+from dataclasses import dataclass
 from typing import Optional
 
 from fastapi import HTTPException, Request
 
+from server import memstats, queries
+from server.envutil import env_bool, env_int
+
 
 def sha256_hex(data: str) -> str:
     return hashlib.sha256(data.encode("utf-8")).hexdigest()
@@ -24,30 +29,129 @@ def new_token() -> str:
     return secrets.token_urlsafe(32)
 
 
-def hmac_b64(secret: str, payload: str) -> str:
+def hmac_b64(secret: str, payload: str | bytes) -> str:
     key = secret.encode("utf-8")
-    msg = payload.encode("utf-8")
+    msg = payload.encode("utf-8") if isinstance(payload, str) else payload
     digest = hmac.new(key, msg, hashlib.sha256).digest()
     return base64.b64encode(digest).decode("utf-8")
 
 
-def _safe_int_env(name: str, default: int, *, minimum: Optional[int] = None, maximum: Optional[int] = None) -> int:
-    raw = str(os.getenv(name, "")).strip()
-    if not raw:
-        value = default
-    else:
-        try:
-            value = int(raw)
-        except ValueError:
-            value = default
-    if minimum is not None:
-        value = max(minimum, value)
-    if maximum is not None:
-        value = min(maximum, value)
-    return value
+SESSION_TOKEN_PREFIX = "s1."
 
+# player_id -> (revocation epoch, cached_at). Process-local; refreshed from players.token_epoch.
+SESSION_EPOCHS: dict[str, tuple[int, float]] = {}
+memstats.register("session_epochs", lambda: SESSION_EPOCHS)
 
-def require_bearer_player_id(request: Request, db) -> str:
+
+@dataclass(frozen=True)
+class BearerIdentity:
+    player_id: str
+    # Only known without a DB lookup for stateless session tokens.
+    region: Optional[str] = None
+
+
+def _session_keys() -> list[tuple[str, str]]:
+    # KBBQ_SESSION_KEYS="k2:new-secret,k1:old-secret": the first key signs, every listed key verifies.
+    keys = []
+    for part in str(os.getenv("KBBQ_SESSION_KEYS", "")).split(","):
+        kid, sep, secret = part.strip().partition(":")
+        kid = kid.strip()
+        if sep and kid and "." not in kid and secret.strip():
+            keys.append((kid, secret.strip()))
+    return keys
+
+
+def session_tokens_enabled() -> bool:
+    return env_bool("KBBQ_SESSION_TOKENS") and bool(_session_keys())
+
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _session_sig(secret: str, signed_part: str) -> str:
+    return _b64url(hmac.new(secret.encode("utf-8"), signed_part.encode("utf-8"), hashlib.sha256).digest())
+
+
+def issue_session_token(player_id: str, region: str, epoch: int, *, now: Optional[int] = None) -> tuple[str, int]:
+    kid, secret = _session_keys()[0]
+    issued_at = int(time.time()) if now is None else int(now)
+    expires_at = issued_at + env_int("KBBQ_SESSION_TTL_SECONDS", 7 * 86_400, minimum=60, maximum=90 * 86_400)
+    claims = json.dumps({"pid": player_id, "rgn": region, "exp": expires_at, "ep": int(epoch)}, separators=(",", ":"))
+    signed_part = f"{SESSION_TOKEN_PREFIX}{kid}.{_b64url(claims.encode('utf-8'))}"
+    return f"{signed_part}.{_session_sig(secret, signed_part)}", expires_at
+
+
+def _session_epoch_cache_max() -> int:
+    return env_int("KBBQ_SESSION_EPOCH_CACHE_MAX", 50_000, minimum=0)
+
+
+def remember_session_epoch(player_id: str, epoch: int) -> None:
+    cache_max = _session_epoch_cache_max()
+    # Re-inserted entries move to the end, so the front is the least recently refreshed.
+    SESSION_EPOCHS.pop(player_id, None)
+    if cache_max <= 0:
+        return
+    # Insertion-ordered dict: evict the oldest entry once full.
+    while len(SESSION_EPOCHS) >= cache_max:
+        SESSION_EPOCHS.pop(next(iter(SESSION_EPOCHS)), None)
+    SESSION_EPOCHS[player_id] = (int(epoch), time.monotonic())
+
+
+def _current_session_epoch(db, player_id: str, token_epoch: int) -> Optional[int]:
+    cached = SESSION_EPOCHS.get(player_id)
+    ttl = env_int("KBBQ_SESSION_EPOCH_CACHE_SECONDS", 60, minimum=0, maximum=3_600)
+    # A token newer than the cache means another worker bumped the epoch: refresh.
+    if cached is not None and time.monotonic() - cached[1] < ttl and token_epoch <= cached[0]:
+        return cached[0]
+
+    row = db.execute(
+        queries.TOKEN_EPOCH,
+        (player_id,),
+    ).fetchone()
+    if not row:
+        SESSION_EPOCHS.pop(player_id, None)
+        return None
+    epoch = int(row["token_epoch"])
+    remember_session_epoch(player_id, epoch)
+    return epoch
+
+
+def _verify_session_token(token: str, db) -> BearerIdentity:
+    keys = dict(_session_keys())
+    try:
+        signed_part, sig = token.rsplit(".", 1)
+        kid, claims_b64 = signed_part[len(SESSION_TOKEN_PREFIX):].split(".", 1)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="invalid token")
+
+    secret = keys.get(kid)
+    if not secret or not hmac.compare_digest(_session_sig(secret, signed_part), sig):
+        raise HTTPException(status_code=401, detail="invalid token")
+
+    try:
+        claims = json.loads(_b64url_decode(claims_b64))
+        player_id = str(claims["pid"])
+        region = str(claims["rgn"])
+        expires_at = int(claims["exp"])
+        token_epoch = int(claims["ep"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=401, detail="invalid token")
+
+    if expires_at < int(time.time()):
+        raise HTTPException(status_code=401, detail="token expired")
+
+    current_epoch = _current_session_epoch(db, player_id, token_epoch)
+    if current_epoch is None or token_epoch != current_epoch:
+        raise HTTPException(status_code=401, detail="token revoked")
+    return BearerIdentity(player_id=player_id, region=region)
+
+
+def require_bearer_identity(request: Request, db) -> BearerIdentity:
     auth = request.headers.get("authorization", "")
     if not auth.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="missing bearer token")
@@ -55,15 +159,23 @@ def require_bearer_player_id(request: Request, db) -> str:
     if not token:
         raise HTTPException(status_code=401, detail="empty bearer token")
 
+    # Stateless tokens are also stored hashed, so they keep resolving via the DB if the keys are removed.
+    if token.startswith(SESSION_TOKEN_PREFIX) and _session_keys():
+        return _verify_session_token(token, db)
+
     salt = os.getenv("KBBQ_TOKEN_SALT", "dev-only-salt")
     token_hash = token_sha256(token, salt)
     row = db.execute(
-        "SELECT player_id FROM players WHERE token_sha256 = ?",
+        queries.TOKEN_LOOKUP,
         (token_hash,),
     ).fetchone()
     if not row:
         raise HTTPException(status_code=401, detail="invalid token")
-    return str(row["player_id"])
+    return BearerIdentity(player_id=str(row["player_id"]))
+
+
+def require_bearer_player_id(request: Request, db) -> str:
+    return require_bearer_identity(request, db).player_id
 
 
 def verify_signed_headers(
@@ -71,7 +183,7 @@ def verify_signed_headers(
     *,
     db,
     player_id: str,
-    raw_body: str,
+    raw_body: str | bytes,
 ) -> None:
     secret = os.getenv("KBBQ_HMAC_SECRET", "CHANGE_ME")
     if not secret:
@@ -89,11 +201,13 @@ def verify_signed_headers(
         raise HTTPException(status_code=401, detail="invalid timestamp")
 
     now = int(time.time())
-    skew = _safe_int_env("KBBQ_MAX_CLOCK_SKEW_SECONDS", 300, minimum=30, maximum=86_400)
+    skew = env_int("KBBQ_MAX_CLOCK_SKEW_SECONDS", 300, minimum=30, maximum=86_400)
     if abs(now - ts) > skew:
         raise HTTPException(status_code=401, detail="timestamp out of range")
 
-    payload = f"{player_id}|{nonce}|{ts}|{raw_body or ''}"
+    # Signed over the raw body bytes (UTF-8 JSON or MessagePack); str bodies are UTF-8 encoded.
+    body = raw_body.encode("utf-8") if isinstance(raw_body, str) else (raw_body or b"")
+    payload = f"{player_id}|{nonce}|{ts}|".encode("utf-8") + body
     expected = hmac_b64(secret, payload)
     if not hmac.compare_digest(expected, sig):
         raise HTTPException(status_code=401, detail="bad signature")
@@ -102,7 +216,7 @@ def verify_signed_headers(
     # Insert only after successful signature verification to avoid blocking legit requests with the same nonce.
     try:
         db.execute(
-            "INSERT INTO nonces(player_id, nonce, ts) VALUES(?,?,?)",
+            queries.NONCE_INSERT,
             (player_id, nonce, ts),
         )
         db.commit()
@@ -112,7 +226,7 @@ def verify_signed_headers(
 
 def ensure_friend_code(db, player_id: str) -> str:
     row = db.execute(
-        "SELECT code FROM friend_codes WHERE player_id = ?",
+        queries.FRIEND_CODE_BY_PLAYER,
         (player_id,),
     ).fetchone()
     if row:
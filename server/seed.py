@@ -0,0 +1,284 @@
+"""Synthetic dataset generator for scale testing.
+
+Writes players, friend codes, friend edges, leaderboard scores and analytics events
+straight into SQLite with `executemany` in large transactions. Output is fully
+determined by `--seed`. Seeded players authenticate with bearer token
+`seed-token-<n>` (hashed with the current KBBQ_TOKEN_SALT).
+
+    python -m server.seed --db /tmp/scale.db --players 1000000 --events 10000000
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from server.analytics import encode_kv
+from server.histogram import rebuild_region
+from server.security import token_sha256
+
+_CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+_CODE_SPACE = len(_CODE_ALPHABET) ** 6
+# Odd multiplier => bijection on [0, 32^6): unique friend codes without a lookup set.
+_CODE_MULTIPLIER = 0x2545F491
+
+# (event name, relative weight) — roughly what the Unity AnalyticsService emits.
+_EVENTS = (
+    ("session_start", 30),
+    ("upgrade_purchase", 25),
+    ("menu_unlock", 8),
+    ("boost_used", 10),
+    ("offline_claim", 12),
+    ("tier_upgrade", 3),
+    ("prestige", 1),
+    ("daily_mission_complete", 9),
+    ("ad_reward", 2),
+)
+# (region, share of players, log-normal mu of the score distribution)
+_REGIONS = (("KR", 0.55, 9.0), ("US", 0.2, 8.4), ("JP", 0.15, 8.7), ("SEA", 0.1, 7.9))
+
+# Secondary indexes rebuilt once after the bulk load instead of per row.
+_BULK_DROP_INDEXES = (
+    "idx_players_token_sha256",
+    "idx_leaderboard_region_score",
+    "idx_analytics_events_player_ts",
+    "idx_analytics_events_name_ts",
+)
+
+
+@dataclass(frozen=True)
+class SeedConfig:
+    players: int = 10_000
+    friends_per_player: int = 8
+    leaderboard_share: float = 0.8
+    events: int = 100_000
+    seed: int = 42
+    batch_size: int = 50_000
+    days: int = 180
+
+
+def friend_code(index: int) -> str:
+    value = (index * _CODE_MULTIPLIER) % _CODE_SPACE
+    chars = []
+    for _ in range(6):
+        value, digit = divmod(value, len(_CODE_ALPHABET))
+        chars.append(_CODE_ALPHABET[digit])
+    return "".join(chars)
+
+
+def seed_token(index: int) -> str:
+    return f"seed-token-{index}"
+
+
+def _batched(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Generator:
+    def __init__(self, cfg: SeedConfig, now: int):
+        self.cfg = cfg
+        self.now = now
+        self.rng = random.Random(cfg.seed)
+        self.player_ids: list[str] = []
+        self.regions: list[str] = []
+        self.created_at: list[int] = []
+
+    def players(self, salt: str):
+        rng = self.rng
+        region_names = [r[0] for r in _REGIONS]
+        region_weights = [r[1] for r in _REGIONS]
+        span = self.cfg.days * 86_400
+        for i in range(self.cfg.players):
+            player_id = "p_%032x" % rng.getrandbits(128)
+            region = rng.choices(region_names, region_weights)[0]
+            created_at = self.now - rng.randrange(span)
+            self.player_ids.append(player_id)
+            self.regions.append(region)
+            self.created_at.append(created_at)
+            yield (
+                player_id,
+                f"seed-device-{i}",
+                "Guest-" + player_id[-4:].upper(),
+                token_sha256(seed_token(i), salt),
+                region,
+                created_at,
+            )
+
+    def friend_codes(self):
+        for i, player_id in enumerate(self.player_ids):
+            yield (player_id, friend_code(i))
+
+    def friend_edges(self):
+        rng = self.rng
+        n = len(self.player_ids)
+        if n < 2:
+            return
+        for i, player_id in enumerate(self.player_ids):
+            for _ in range(self.cfg.friends_per_player // 2):
+                j = rng.randrange(n - 1)
+                j = j + 1 if j >= i else j
+                ts = max(self.created_at[i], self.created_at[j])
+                yield (player_id, self.player_ids[j], ts)
+                yield (self.player_ids[j], player_id, ts)
+
+    def leaderboard(self):
+        rng = self.rng
+        mus = {r[0]: r[2] for r in _REGIONS}
+        for i, player_id in enumerate(self.player_ids):
+            if rng.random() >= self.cfg.leaderboard_share:
+                continue
+            region = self.regions[i]
+            # Heavy-tailed: most players are small, a few whales dominate the top.
+            score = round(math.exp(rng.gauss(mus[region], 1.6)), 2)
+            updated_at = self.created_at[i] + rng.randrange(max(1, self.now - self.created_at[i]))
+            yield (region, player_id, score, updated_at)
+
+    def analytics_events(self):
+        rng = self.rng
+        names = [e[0] for e in _EVENTS]
+        cum_weights = []
+        total = 0
+        for _, weight in _EVENTS:
+            total += weight
+            cum_weights.append(total)
+        # Hot loop: precomputed kv payloads and rng.random() instead of randrange().
+        # Keys are the dictionary ids written by `event_names()` / `analytics_players()`.
+        name_ids = {name: i for i, name in enumerate(names, start=1)}
+        kv_payloads = [encode_kv([f"level={level}"]) for level in range(1, 101)]
+        empty_kv = encode_kv([])
+        player_ids, created_at, now = self.player_ids, self.created_at, self.now
+        random_ = rng.random
+        n = len(player_ids)
+        remaining = self.cfg.events
+        while remaining > 0 and n:
+            chunk = min(remaining, self.cfg.batch_size)
+            remaining -= chunk
+            for name in rng.choices(names, cum_weights=cum_weights, k=chunk):
+                i = int(random_() * n)
+                born = created_at[i]
+                ts = born + int(random_() * (now - born))
+                kv = empty_kv if name == "session_start" else kv_payloads[int(random_() * 100)]
+                yield (i + 1, name_ids[name], kv, ts)
+
+    def event_names(self):
+        for i, (name, _) in enumerate(_EVENTS, start=1):
+            yield (i, name)
+
+    def analytics_players(self):
+        for i, player_id in enumerate(self.player_ids, start=1):
+            yield (i, player_id)
+
+
+def seed_database(conn: sqlite3.Connection, cfg: SeedConfig, *, salt: str, now: Optional[int] = None) -> dict:
+    """Bulk-load a schema-initialized connection. Returns row counts and timings."""
+    from server.db import _ensure_schema
+
+    gen = _Generator(cfg, int(time.time()) if now is None else int(now))
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")
+    for name in _BULK_DROP_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+
+    steps = (
+        (
+            "players",
+            "INSERT INTO players(player_id, device_id, display_name, token_sha256, region, created_at) VALUES(?,?,?,?,?,?)",
+            gen.players(salt),
+        ),
+        ("friend_codes", "INSERT INTO friend_codes(player_id, code) VALUES(?,?)", gen.friend_codes()),
+        (
+            "friends",
+            "INSERT OR IGNORE INTO friends(player_id, friend_player_id, created_at) VALUES(?,?,?)",
+            gen.friend_edges(),
+        ),
+        (
+            "leaderboard",
+            "INSERT INTO leaderboard(region, player_id, score, updated_at) VALUES(?,?,?,?)",
+            gen.leaderboard(),
+        ),
+        ("analytics_event_names", "INSERT INTO analytics_event_names(id, name) VALUES(?,?)", gen.event_names()),
+        ("analytics_players", "INSERT INTO analytics_players(id, player_id) VALUES(?,?)", gen.analytics_players()),
+        (
+            "analytics_events",
+            "INSERT INTO analytics_events(player_key, name_id, kv, ts) VALUES(?,?,?,?)",
+            gen.analytics_events(),
+        ),
+    )
+
+    report = {"seed": cfg.seed, "tables": {}}
+    started = time.perf_counter()
+    for table, sql, rows in steps:
+        step_started = time.perf_counter()
+        count = 0
+        for batch in _batched(rows, cfg.batch_size):
+            if table == "friends":
+                # Sorted by primary key: fewer random B-tree page touches per batch.
+                batch.sort()
+            # Rows actually written: INSERT OR IGNORE skips duplicate friend pairs.
+            before = conn.total_changes
+            conn.executemany(sql, batch)
+            conn.commit()
+            count += conn.total_changes - before
+        report["tables"][table] = {"rows": count, "seconds": round(time.perf_counter() - step_started, 3)}
+
+    index_started = time.perf_counter()
+    _ensure_schema(conn)
+    for region, _, _ in _REGIONS:
+        rebuild_region(conn, region)
+    conn.execute("PRAGMA synchronous = FULL")
+    report["index_rebuild_seconds"] = round(time.perf_counter() - index_started, 3)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main(argv=None) -> int:
+    defaults = SeedConfig()
+    parser = argparse.ArgumentParser(description="Generate a synthetic KBBQ Idle dataset.")
+    parser.add_argument("--db", required=True, help="Target SQLite path (created if missing).")
+    parser.add_argument("--players", type=int, default=defaults.players)
+    parser.add_argument("--friends-per-player", type=int, default=defaults.friends_per_player)
+    parser.add_argument("--leaderboard-share", type=float, default=defaults.leaderboard_share)
+    parser.add_argument("--events", type=int, default=defaults.events)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--batch-size", type=int, default=defaults.batch_size)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        print(json.dumps({"error": f"{args.db} already exists; seed into a fresh file"}))
+        return 2
+    os.environ["KBBQ_DB_PATH"] = args.db
+    from server.db import get_db
+
+    cfg = SeedConfig(
+        players=max(0, args.players),
+        friends_per_player=max(0, args.friends_per_player),
+        leaderboard_share=min(1.0, max(0.0, args.leaderboard_share)),
+        events=max(0, args.events),
+        seed=args.seed,
+        batch_size=max(1, args.batch_size),
+    )
+    conn = get_db()
+    try:
+        report = seed_database(conn, cfg, salt=os.getenv("KBBQ_TOKEN_SALT", "dev-only-salt"))
+    finally:
+        conn.close()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
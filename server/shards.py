@@ -0,0 +1,95 @@
+"""Split leaderboard-scoped tables of the core DB into per-region shard files.
+
+Configure the target layout with KBBQ_SHARD_MAP first, run the split while writes are
+paused, then start the app with the same map:
+
+    KBBQ_SHARD_MAP='{"KR": "shards/kr.db"}' python -m server.shards --db kbbq.db [--delete-source]
+"""
+
+import argparse
+import json
+import os
+import time
+
+# (table, columns, row key) copied per region; all have a region column.
+_REGION_TABLES = (
+    ("leaderboard", "region, player_id, score, updated_at, season_epoch", "rowid"),
+    ("leaderboard_epochs", "region, epoch, started_at", "region"),
+    ("leaderboard_seasons", "season, region, entries, created_at", "rowid"),
+    ("leaderboard_snapshots", "season, region, rank, player_id, display_name, score", "(season, region, rank)"),
+    ("leaderboard_flags", "region, player_id, score, max_plausible, ratio, audited_at", "rowid"),
+    ("leaderboard_histogram", "region, bucket, count", "(region, bucket)"),
+)
+
+
+def split_region(region: str, *, delete_source: bool = False, batch_size: int = 5_000) -> dict:
+    from server.db import get_db, get_leaderboard_db, shard_path
+    from server.etags import leaderboard_scope
+
+    if shard_path(region) is None:
+        raise ValueError(f"region {region} is not in KBBQ_SHARD_MAP")
+
+    copied = {}
+    lb = get_leaderboard_db(region)
+    try:
+        for table, columns, _ in _REGION_TABLES:
+            cur = lb.execute(
+                f"INSERT OR REPLACE INTO main.{table}({columns}) SELECT {columns} FROM core.{table} WHERE region = ?",
+                (region,),
+            )
+            copied[table] = max(0, cur.rowcount)
+        # Carry the version forward (+1) so clients holding pre-split ETags refetch once.
+        scope = leaderboard_scope(region)
+        lb.execute(
+            "INSERT OR REPLACE INTO main.data_versions(scope, version) "
+            "SELECT ?, COALESCE((SELECT version FROM core.data_versions WHERE scope = ?), 0) "
+            "+ COALESCE((SELECT version FROM main.data_versions WHERE scope = ?), 0) + 1",
+            (scope, scope, scope),
+        )
+        lb.commit()
+    finally:
+        lb.close()
+
+    deleted = 0
+    if delete_source:
+        db = get_db()
+        try:
+            for table, _, key in _REGION_TABLES:
+                select_key = key.strip("()")
+                while True:
+                    cur = db.execute(
+                        f"DELETE FROM {table} WHERE {key} IN (SELECT {select_key} FROM {table} WHERE region = ? LIMIT ?)",
+                        (region, batch_size),
+                    )
+                    db.commit()
+                    deleted += max(0, cur.rowcount)
+                    if cur.rowcount < batch_size:
+                        break
+        finally:
+            db.close()
+    return {"region": region, "copied": copied, "deleted_from_core": deleted}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Split leaderboard tables into region shards.")
+    parser.add_argument("--db", default=None, help="Core SQLite path (defaults to KBBQ_DB_PATH).")
+    parser.add_argument("--delete-source", action="store_true", help="Remove migrated rows from the core DB.")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        os.environ["KBBQ_DB_PATH"] = args.db
+    from server.db import shard_map
+
+    regions = sorted(shard_map())
+    if not regions:
+        print(json.dumps({"error": "KBBQ_SHARD_MAP is empty"}))
+        return 2
+
+    started = time.perf_counter()
+    reports = [split_region(region, delete_source=args.delete_source) for region in regions]
+    print(json.dumps({"regions": reports, "seconds": round(time.perf_counter() - started, 3)}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
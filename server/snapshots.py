@@ -0,0 +1,202 @@
+"""Immutable per-season leaderboard snapshots.
+
+A snapshot stores a region's leaderboard already ranked (WITHOUT ROWID table keyed by
+season/region/rank, display names denormalized), so historical pages are PK range
+reads with no sort and no join.
+
+    python -m server.snapshots --season 2026-W42 --region KR [--reset]
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import Optional
+
+from server import queries
+from server.etags import bump_version, leaderboard_scope
+from server.histogram import rebuild_region
+
+SEASON_RE = re.compile(r"^[A-Za-z0-9_.-]{1,32}$")
+
+
+def validate_season(season: str) -> str:
+    season = (season or "").strip()
+    if not SEASON_RE.match(season):
+        raise ValueError("invalid season id")
+    return season
+
+
+def current_epoch(db: sqlite3.Connection, region: str) -> tuple[int, int]:
+    """(season epoch, started_at) of `region`; (0, 0) until its first reset."""
+    row = db.execute(queries.LEADERBOARD_EPOCH, (region,)).fetchone()
+    return (int(row["epoch"]), int(row["started_at"])) if row else (0, 0)
+
+
+def _drop_staging(db: sqlite3.Connection) -> None:
+    db.execute("DROP TABLE IF EXISTS temp.snapshot_staging")
+    db.execute("DROP TABLE IF EXISTS temp.snapshot_ranked")
+
+
+def snapshot_region(
+    db: sqlite3.Connection,
+    region: str,
+    season: str,
+    *,
+    now: Optional[int] = None,
+    batch_size: int = 5_000,
+) -> int:
+    """Copy `region`'s leaderboard into a ranked season snapshot in short transactions.
+
+    Rows are copied by player_id range into a TEMP table (readers and score writers only
+    wait for one batch at a time), ranked there, then written out by rank range. The
+    `leaderboard_seasons` row goes in last, so a half-written snapshot is never served.
+    """
+    season = validate_season(season)
+    batch_size = max(1, int(batch_size))
+    exists = db.execute(queries.SEASON_INFO, (season, region)).fetchone()
+    if exists:
+        raise ValueError("season snapshot already exists")
+
+    _drop_staging(db)
+    try:
+        # Leftovers of an interrupted run (no seasons row was written for them).
+        db.execute("DELETE FROM leaderboard_snapshots WHERE season = ? AND region = ?", (season, region))
+        db.commit()
+        db.execute("CREATE TEMP TABLE snapshot_staging(player_id TEXT NOT NULL, display_name TEXT NOT NULL, score REAL NOT NULL)")
+        last = ""
+        while True:
+            cur = db.execute(
+                "INSERT INTO temp.snapshot_staging(player_id, display_name, score) "
+                "SELECT l.player_id, p.display_name, l.score FROM leaderboard l JOIN players p ON p.player_id = l.player_id "
+                "WHERE l.region = ? AND l.player_id > ? ORDER BY l.player_id LIMIT ?",
+                (region, last, batch_size),
+            )
+            db.commit()
+            if cur.rowcount <= 0:
+                break
+            last = db.execute("SELECT player_id FROM temp.snapshot_staging ORDER BY rowid DESC LIMIT 1").fetchone()[0]
+            if cur.rowcount < batch_size:
+                break
+
+        # The sort only touches the TEMP database.
+        db.execute(
+            "CREATE TEMP TABLE snapshot_ranked(rank INTEGER PRIMARY KEY, player_id TEXT NOT NULL, "
+            "display_name TEXT NOT NULL, score REAL NOT NULL)"
+        )
+        db.execute(
+            "INSERT INTO temp.snapshot_ranked(rank, player_id, display_name, score) "
+            "SELECT ROW_NUMBER() OVER (ORDER BY score DESC, player_id ASC), player_id, display_name, score "
+            "FROM temp.snapshot_staging"
+        )
+        db.commit()
+        entries = int(db.execute("SELECT COUNT(*) FROM temp.snapshot_ranked").fetchone()[0])
+        for low in range(0, entries, batch_size):
+            db.execute(
+                "INSERT INTO leaderboard_snapshots(season, region, rank, player_id, display_name, score) "
+                "SELECT ?, ?, rank, player_id, display_name, score FROM temp.snapshot_ranked WHERE rank > ? AND rank <= ?",
+                (season, region, low, low + batch_size),
+            )
+            db.commit()
+        db.execute(
+            "INSERT INTO leaderboard_seasons(season, region, entries, created_at) VALUES(?,?,?,?)",
+            (season, region, entries, int(time.time()) if now is None else int(now)),
+        )
+        db.commit()
+    finally:
+        db.rollback()
+        _drop_staging(db)
+    return entries
+
+
+def start_epoch(db: sqlite3.Connection, region: str, *, now: Optional[int] = None) -> int:
+    """Open a new season for `region`; scores from earlier epochs stop counting."""
+    started_at = int(time.time()) if now is None else int(now)
+    db.execute(
+        "INSERT INTO leaderboard_epochs(region, epoch, started_at) VALUES(?, 1, ?) "
+        "ON CONFLICT(region) DO UPDATE SET epoch = epoch + 1, started_at = excluded.started_at",
+        (region, started_at),
+    )
+    epoch, _ = current_epoch(db, region)
+    bump_version(db, leaderboard_scope(region))
+    db.commit()
+    return epoch
+
+
+def reset_region(db: sqlite3.Connection, region: str, *, epoch: int, batch_size: int = 5_000) -> int:
+    # Small committed batches so score submits can grab the write lock between them.
+    # Only rows from before `epoch` go; a player who already scored this season keeps
+    # the new row (submits overwrite older-epoch rows instead of taking the max).
+    deleted = 0
+    batch_size = max(1, int(batch_size))
+    while True:
+        cur = db.execute(
+            "DELETE FROM leaderboard WHERE rowid IN "
+            "(SELECT rowid FROM leaderboard WHERE region = ? AND season_epoch < ? LIMIT ?)",
+            (region, int(epoch), batch_size),
+        )
+        if cur.rowcount > 0:
+            bump_version(db, leaderboard_scope(region))
+        db.commit()
+        deleted += max(0, cur.rowcount)
+        if cur.rowcount < batch_size:
+            return deleted
+
+
+def close_season(db: sqlite3.Connection, region: str, season: str, *, reset: bool = False, batch_size: int = 5_000) -> dict:
+    now = int(time.time())
+    started = time.perf_counter()
+    entries = snapshot_region(db, region, season, now=now, batch_size=batch_size)
+    deleted = 0
+    if reset:
+        # The new season starts now, not when the copy began: submits made during the copy
+        # (direct or buffered) belong to the closing season.
+        epoch = start_epoch(db, region)
+        deleted = reset_region(db, region, epoch=epoch, batch_size=batch_size)
+        # The reset bypasses per-row histogram moves; recount what is left.
+        rebuild_region(db, region)
+    return {
+        "season": season,
+        "region": region,
+        "entries": entries,
+        "reset_deleted": deleted,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Snapshot a region's leaderboard at a season boundary.")
+    parser.add_argument("--season", required=True)
+    parser.add_argument("--region", default="KR")
+    parser.add_argument("--reset", action="store_true", help="Clear the live leaderboard after snapshotting.")
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument("--db", default=None, help="SQLite path (defaults to KBBQ_DB_PATH).")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        os.environ["KBBQ_DB_PATH"] = args.db
+    from server.db import get_leaderboard_db
+
+    region = args.region.strip().upper()
+    conn = get_leaderboard_db(region)
+    try:
+        report = close_season(
+            conn,
+            region,
+            args.season,
+            reset=args.reset,
+            batch_size=args.batch_size,
+        )
+    except ValueError as exc:
+        print(json.dumps({"error": str(exc)}))
+        return 2
+    finally:
+        conn.close()
+    print(json.dumps(report))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
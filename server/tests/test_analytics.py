@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+
+from server.analytics import (
+    KEY_CACHES,
+    copy_legacy_events,
+    decode_kv,
+    encode_kv,
+    migrate_legacy_events,
+    record_event,
+    storage_bytes_per_event,
+)
+
+
+class TestAnalyticsStorage(unittest.TestCase):
+    def test_kv_encoding_round_trips(self):
+        for items in ([], ["level=3"], ["a" * 300, "", "soju=소주"], [f"k{i}=v" for i in range(50)]):
+            self.assertEqual(decode_kv(encode_kv(items)), items)
+        self.assertEqual(encode_kv(["ab"]), b"\x01\x02ab")
+        with self.assertRaises(ValueError):
+            decode_kv(encode_kv(["abcdef"])[:-2])
+
+    def test_legacy_events_migrate_to_interned_layout(self):
+        with tempfile.TemporaryDirectory(prefix="kbbq_analytics_test_") as tmp:
+            path = os.path.join(tmp, "legacy.db")
+            legacy = sqlite3.connect(path)
+            legacy.execute(
+                "CREATE TABLE analytics_events (id INTEGER PRIMARY KEY AUTOINCREMENT, player_id TEXT NOT NULL, "
+                "event_name TEXT NOT NULL, kv_json TEXT NOT NULL, ts INTEGER NOT NULL)"
+            )
+            legacy.execute("CREATE INDEX idx_analytics_events_name_ts ON analytics_events(event_name, ts)")
+            legacy.executemany(
+                "INSERT INTO analytics_events(player_id, event_name, kv_json, ts) VALUES(?,?,?,?)",
+                [
+                    ("p_a", "session_start", "[]", 10),
+                    ("p_b", "upgrade_purchase", '["level=2"]', 11),
+                    ("p_a", "upgrade_purchase", '["level=3", "x=y"]', 12),
+                ],
+            )
+            legacy.commit()
+            self.assertEqual(migrate_legacy_events(legacy, batch_size=2), 3)
+            self.assertEqual(migrate_legacy_events(legacy), 0)
+            self.assertIsNotNone(storage_bytes_per_event(legacy))
+            legacy.close()
+
+            # Opening through get_db() is a no-op on an already migrated file.
+            with patch.dict(os.environ, {"KBBQ_DB_PATH": path}):
+                from server.db import get_db
+
+                conn = get_db()
+            try:
+                rows = conn.execute(
+                    "SELECT k.player_id, n.name, e.kv, e.ts FROM analytics_events e "
+                    "JOIN analytics_players k ON k.id = e.player_key "
+                    "JOIN analytics_event_names n ON n.id = e.name_id ORDER BY e.id"
+                ).fetchall()
+                record_event(conn, path, "p_b", "session_start", ["a=b"], 13)
+                record_event(conn, path, "p_c", "prestige", [], 14)
+                names = conn.execute("SELECT COUNT(*) FROM analytics_event_names").fetchone()[0]
+                players = conn.execute("SELECT COUNT(*) FROM analytics_players").fetchone()[0]
+            finally:
+                conn.close()
+
+        self.assertEqual(
+            [(r["player_id"], r["name"], decode_kv(r["kv"]), r["ts"]) for r in rows],
+            [
+                ("p_a", "session_start", [], 10),
+                ("p_b", "upgrade_purchase", ["level=2"], 11),
+                ("p_a", "upgrade_purchase", ["level=3", "x=y"], 12),
+            ],
+        )
+        self.assertEqual((names, players), (3, 3))
+        self.assertEqual(KEY_CACHES[path]["name"]["session_start"], 1)
+        self.assertIn("p_c", KEY_CACHES[path]["player"])
+
+    def test_open_only_swaps_the_legacy_table_and_copy_resumes(self):
+        with tempfile.TemporaryDirectory(prefix="kbbq_analytics_test_") as tmp:
+            path = os.path.join(tmp, "legacy.db")
+            legacy = sqlite3.connect(path)
+            legacy.execute(
+                "CREATE TABLE analytics_events (id INTEGER PRIMARY KEY AUTOINCREMENT, player_id TEXT NOT NULL, "
+                "event_name TEXT NOT NULL, kv_json TEXT NOT NULL, ts INTEGER NOT NULL)"
+            )
+            legacy.execute("CREATE INDEX idx_analytics_events_player_ts ON analytics_events(player_id, ts)")
+            legacy.executemany(
+                "INSERT INTO analytics_events(id, player_id, event_name, kv_json, ts) VALUES(?,?,?,?,?)",
+                [(1, "p_a", "session_start", "[]", 10), (5, "p_b", "prestige", '["x=1"]', 11), (9, "p_a", "prestige", "[]", 12)],
+            )
+            legacy.commit()
+            legacy.close()
+
+            with patch.dict(os.environ, {"KBBQ_DB_PATH": path}):
+                from server.db import get_db
+
+                conn = get_db()
+            try:
+                # Opening copied nothing; ingest already writes the new layout, above the legacy ids.
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM analytics_events").fetchone()[0], 0)
+                record_event(conn, path, "p_c", "session_start", [], 20)
+                self.assertEqual(conn.execute("SELECT MAX(id) FROM analytics_events").fetchone()[0], 10)
+
+                stop = threading.Event()
+                stop.set()
+                self.assertEqual(copy_legacy_events(conn, batch_size=2, stop=stop), 0)
+                self.assertEqual(copy_legacy_events(conn, batch_size=2), 3)
+                self.assertEqual(copy_legacy_events(conn), 0)
+                rows = conn.execute(
+                    "SELECT e.id, k.player_id, n.name, e.kv FROM analytics_events e "
+                    "JOIN analytics_players k ON k.id = e.player_key "
+                    "JOIN analytics_event_names n ON n.id = e.name_id ORDER BY e.id"
+                ).fetchall()
+                tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+            finally:
+                conn.close()
+
+        self.assertEqual(
+            [(r["id"], r["player_id"], r["name"], decode_kv(r["kv"])) for r in rows],
+            [
+                (1, "p_a", "session_start", []),
+                (5, "p_b", "prestige", ["x=1"]),
+                (9, "p_a", "prestige", []),
+                (10, "p_c", "session_start", []),
+            ],
+        )
+        self.assertNotIn("analytics_events_legacy", tables)
+
+    def test_key_cache_is_dropped_when_the_file_is_replaced(self):
+        with tempfile.TemporaryDirectory(prefix="kbbq_analytics_test_") as tmp:
+            path = os.path.join(tmp, "events.db")
+            with patch.dict(os.environ, {"KBBQ_DB_PATH": path}):
+                from server.db import get_db
+
+                conn = get_db()
+                record_event(conn, path, "p_a", "session_start", [], 1)
+                conn.close()
+                self.assertIn("session_start", KEY_CACHES[path]["name"])
+
+                # Restored from a backup, say: same path, different ids.
+                other = os.path.join(tmp, "other.db")
+                with sqlite3.connect(other) as fresh:
+                    fresh.execute("CREATE TABLE placeholder(x)")
+                os.replace(other, path)
+                conn = get_db()
+                try:
+                    self.assertNotIn(path, KEY_CACHES)
+                    record_event(conn, path, "p_b", "prestige", [], 2)
+                    self.assertEqual(KEY_CACHES[path]["name"], {"prestige": 1})
+                finally:
+                    conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
+import base64
 import json
 import os
+import sqlite3
 import tempfile
 import time
 import asyncio
@@ -77,6 +79,81 @@ class TestApi(unittest.TestCase):
         self.assertEqual(r2.status_code, 401)
         self.assertIn("replay", r2.text.lower())
 
+    def test_ops_profile_captures_and_guards_concurrency(self):
+        ops = {"X-Ops-Token": os.environ["KBBQ_OPS_TOKEN"]}
+        self.assertEqual(self._request("GET", "/ops/profile?seconds=0.1").status_code, 401)
+
+        r = self._request("GET", "/ops/profile?seconds=0.2&interval_ms=2", headers=ops)
+        self.assertEqual(r.status_code, 200)
+        self.assertGreater(int(r.headers["x-profile-ticks"]), 0)
+        first = r.text.splitlines()[0]
+        stack, count = first.rsplit(" ", 1)
+        self.assertIn(";", stack)
+        self.assertGreater(int(count), 0)
+
+        top = self._request("GET", "/ops/profile?seconds=0.1&format=top", headers=ops)
+        self.assertEqual(top.status_code, 200)
+        self.assertIn("ticks", top.text.splitlines()[0])
+
+        from server.profiling import _capture_lock
+
+        with _capture_lock:
+            busy = self._request("GET", "/ops/profile?seconds=0.1", headers=ops)
+        self.assertEqual(busy.status_code, 409)
+
+    def test_ops_memory_reports_structures_and_allocators(self):
+        import tracemalloc
+
+        from server import memstats
+
+        ops = {"X-Ops-Token": os.environ["KBBQ_OPS_TOKEN"]}
+        self.assertEqual(self._request("GET", "/ops/memory").status_code, 401)
+        self._guest("device-memory-001")
+
+        with patch.dict(os.environ, {"KBBQ_TRACEMALLOC": "1"}):
+            self.assertTrue(memstats.start_tracemalloc())
+        try:
+            r = self._request("GET", "/ops/memory?top=5", headers=ops)
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(r.status_code, 200)
+        data = r.json()
+        for name in ("rate_buckets", "friend_sets", "session_epochs", "slow_query_log", "write_behind_pending"):
+            self.assertIn(name, data["structures"])
+        self.assertGreater(data["structures"]["rate_buckets"]["bytes"], 0)
+        self.assertTrue(data["tracemalloc"]["enabled"])
+        self.assertLessEqual(len(data["tracemalloc"]["top"]), 5)
+        if data["rss_bytes"] is not None:
+            self.assertGreater(data["rss_bytes"], 0)
+
+        # Scrapes only take len() of each structure; deep sizes stay in /ops/memory.
+        with patch.object(memstats, "deep_sizeof", side_effect=AssertionError("deep walk on /metrics")):
+            metrics = self._request("GET", "/metrics").text
+        self.assertIn('kbbq_inprocess_entries{structure="rate_buckets"}', metrics)
+        self.assertNotIn("kbbq_inprocess_bytes", metrics)
+
+    def test_slow_query_log_records_plans(self):
+        ops = {"X-Ops-Token": os.environ["KBBQ_OPS_TOKEN"]}
+        with patch.dict(os.environ, {"KBBQ_SLOW_QUERY_MS": "0"}):
+            self._request("GET", "/ops/slow-queries?reset=1", headers=ops)
+            auth = self._guest("device-slow-query")
+            r = self._signed_get(auth, "/leaderboard/top?region=KR&limit=3", nonce="slow-query-top-1")
+            self.assertEqual(r.status_code, 200)
+
+            log = self._request("GET", "/ops/slow-queries", headers=ops)
+            self.assertEqual(log.status_code, 200)
+            payload = log.json()
+            self.assertTrue(payload["enabled"])
+            self.assertGreater(payload["counters"]["slow_statements"], 0)
+            top = next(e for e in payload["entries"] if "FROM leaderboard l JOIN players" in e["sql"])
+            self.assertEqual(top["params"], "(str, int)")
+            self.assertTrue(top["plan"])
+
+            m = self._request("GET", "/metrics")
+            self.assertIn("kbbq_sql_slow_statements_total", m.text)
+
+        self.assertEqual(self._request("GET", "/ops/slow-queries").status_code, 401)
+
     def test_readiness_and_metrics_endpoints(self):
         r = self._request("GET", "/readiness")
         self.assertEqual(r.status_code, 200)
@@ -85,11 +162,35 @@ class TestApi(unittest.TestCase):
         self.assertIn("checks", payload)
         self.assertTrue(any(c.get("name") == "db" for c in payload.get("checks", [])))
 
+        # No lifespan ever ran (embedded app, TestClient without `with`): startup runs on demand.
+        from server.app import STARTUP_STATE
+
+        with patch.dict(STARTUP_STATE, {"ready": False, "startup_seconds": None, "lifespan": "never"}):
+            r = self._request("GET", "/readiness")
+            startup = next(c for c in r.json()["checks"] if c["name"] == "startup")
+            self.assertTrue(startup["ok"])
+            self.assertEqual(startup["lifespan"], "never")
+            self.assertIsNotNone(startup["startup_seconds"])
+
         m = self._request("GET", "/metrics")
         self.assertEqual(m.status_code, 200)
         self.assertIn("kbbq_players_total", m.text)
         self.assertIn("kbbq_uptime_seconds", m.text)
 
+    def test_lifespan_startup_gates_readiness(self):
+        async def _run():
+            async with self.app.router.lifespan_context(self.app):
+                return await self._request_async("GET", "/readiness")
+
+        r = asyncio.run(_run())
+        self.assertEqual(r.status_code, 200)
+        startup = next(c for c in r.json()["checks"] if c["name"] == "startup")
+        self.assertTrue(startup["ok"])
+        self.assertTrue(r.json()["ready"])
+
+        after = self._request("GET", "/readiness")
+        self.assertFalse(after.json()["ready"])
+
     def test_ops_alerts_requires_token(self):
         denied = self._request("GET", "/ops/alerts")
         self.assertEqual(denied.status_code, 401)
@@ -249,7 +350,7 @@ class TestApi(unittest.TestCase):
         prev_endpoint = os.environ.get("KBBQ_FORMSPREE_ENDPOINT")
         os.environ["KBBQ_FORMSPREE_ENDPOINT"] = "https://formspree.io/f/mock"
         try:
-            with patch("server.app.httpx.post", return_value=_Resp()) as mocked_post:
+            with patch("httpx.post", return_value=_Resp()) as mocked_post:
                 res = self._request("POST", "/community/feedback", headers=headers, content=raw_body)
             self.assertEqual(res.status_code, 200)
             self.assertTrue(res.json().get("ok"))
@@ -260,6 +361,531 @@ class TestApi(unittest.TestCase):
             else:
                 os.environ["KBBQ_FORMSPREE_ENDPOINT"] = prev_endpoint
 
+    def test_friends_leaderboard_paginates_by_score(self):
+        me = self._guest("device-friends-lb-me")
+        friends = [self._guest(f"device-friends-lb-{i}") for i in range(3)]
+        outsider = self._guest("device-friends-lb-outsider")
+
+        for idx, friend in enumerate(friends):
+            self._invite(me, self._friend_code(friend["playerId"]), nonce=f"friends-lb-invite-{idx}")
+        for idx, (player, score) in enumerate(zip(friends + [outsider], [300.0, 100.0, 200.0, 999.0])):
+            r = self._submit_score(player, score, nonce=f"friends-lb-submit-{idx}")
+            self.assertEqual(r.status_code, 200)
+
+        first = self._signed_get(me, "/friends/leaderboard?region=KR&limit=2", nonce="friends-lb-page-1")
+        self.assertEqual(first.status_code, 200)
+        page = first.json()
+        self.assertEqual(page["friendCount"], 3)
+        self.assertEqual([e["score"] for e in page["entries"]], [300.0, 200.0])
+        self.assertEqual([e["rank"] for e in page["entries"]], [1, 2])
+        self.assertTrue(page["nextCursor"])
+
+        second = self._signed_get(
+            me,
+            f"/friends/leaderboard?region=KR&limit=2&cursor={page['nextCursor']}",
+            nonce="friends-lb-page-2",
+        )
+        self.assertEqual(second.status_code, 200)
+        page2 = second.json()
+        self.assertEqual([(e["score"], e["rank"]) for e in page2["entries"]], [(100.0, 3)])
+        self.assertEqual(page2["nextCursor"], "")
+
+        # Ranks come from the server, not the cursor: a forged (legacy, rank-carrying) cursor
+        # at the same position still yields rank 3.
+        forged = base64.urlsafe_b64encode(b"1000|200.0|" + page["entries"][1]["playerId"].encode()).decode()
+        third = self._signed_get(
+            me, f"/friends/leaderboard?region=KR&limit=2&cursor={forged.rstrip('=')}", nonce="friends-lb-page-3"
+        )
+        self.assertEqual([(e["score"], e["rank"]) for e in third.json()["entries"]], [(100.0, 3)])
+
+        bad = self._signed_get(me, "/friends/leaderboard?cursor=%%%", nonce="friends-lb-bad-cursor")
+        self.assertEqual(bad.status_code, 400)
+
+    def test_stateless_session_tokens_rotate_and_revoke(self):
+        legacy = self._guest("device-session-legacy")
+        env = {"KBBQ_SESSION_TOKENS": "1", "KBBQ_SESSION_KEYS": "k1:first-session-key"}
+        with patch.dict(os.environ, env):
+            auth = self._guest("device-session-001")
+            self.assertTrue(auth["token"].startswith("s1.k1."))
+            self.assertGreater(auth["expiresAt"], int(time.time()))
+
+            r = self._signed_get(auth, "/leaderboard/top?region=KR&limit=5", nonce="session-top-1")
+            self.assertEqual(r.status_code, 200)
+            r = self._submit_score(auth, 42.0, nonce="session-submit-1")
+            self.assertEqual(r.status_code, 200)
+
+            # Opaque tokens issued before the migration keep working.
+            r = self._signed_get(legacy, "/leaderboard/top?region=KR&limit=5", nonce="session-legacy-1")
+            self.assertEqual(r.status_code, 200)
+
+            # Rotation: a new signing key is added in front, the old one still verifies.
+            os.environ["KBBQ_SESSION_KEYS"] = "k2:second-session-key,k1:first-session-key"
+            r = self._signed_get(auth, "/leaderboard/top?region=KR&limit=5", nonce="session-top-2")
+            self.assertEqual(r.status_code, 200)
+
+            tampered = dict(auth, token=auth["token"][:-2] + ("AA" if not auth["token"].endswith("AA") else "BB"))
+            r = self._signed_get(tampered, "/leaderboard/top?region=KR&limit=5", nonce="session-top-3")
+            self.assertEqual(r.status_code, 401)
+
+            # Re-auth bumps the player's revocation epoch.
+            reauth = self._guest("device-session-001")
+            self.assertTrue(reauth["token"].startswith("s1.k2."))
+            r = self._signed_get(auth, "/leaderboard/top?region=KR&limit=5", nonce="session-top-4")
+            self.assertEqual(r.status_code, 401)
+            self.assertIn("revoked", r.text.lower())
+            r = self._signed_get(reauth, "/leaderboard/top?region=KR&limit=5", nonce="session-top-5")
+            self.assertEqual(r.status_code, 200)
+
+            os.environ["KBBQ_SESSION_KEYS"] = "k3:third-session-key"
+            r = self._signed_get(reauth, "/leaderboard/top?region=KR&limit=5", nonce="session-top-6")
+            self.assertEqual(r.status_code, 401)
+
+    def test_session_epoch_cache_evicts_oldest_first(self):
+        from server.security import SESSION_EPOCHS, remember_session_epoch
+
+        with patch.dict(SESSION_EPOCHS, clear=True), patch.dict(os.environ, {"KBBQ_SESSION_EPOCH_CACHE_MAX": "3"}):
+            for i in range(4):
+                remember_session_epoch(f"p-{i}", 1)
+            self.assertEqual(list(SESSION_EPOCHS), ["p-1", "p-2", "p-3"])
+            # A refresh makes the entry the newest again.
+            remember_session_epoch("p-1", 2)
+            remember_session_epoch("p-4", 1)
+            self.assertEqual(list(SESSION_EPOCHS), ["p-3", "p-1", "p-4"])
+            self.assertEqual(SESSION_EPOCHS["p-1"][0], 2)
+
+            os.environ["KBBQ_SESSION_EPOCH_CACHE_MAX"] = "0"
+            remember_session_epoch("p-3", 5)
+            self.assertNotIn("p-3", SESSION_EPOCHS)
+
+    def test_inline_audit_rejects_implausible_score(self):
+        auth = self._guest("device-audit-inline")
+        with patch.dict(os.environ, {"KBBQ_AUDIT_INLINE": "1"}):
+            r = self._submit_score(auth, 10.0, nonce="audit-inline-ok")
+            self.assertEqual(r.status_code, 200)
+            r = self._submit_score(auth, 1e15, nonce="audit-inline-bad")
+            self.assertEqual(r.status_code, 400)
+            self.assertIn("implausible", r.text.lower())
+
+    def test_season_snapshot_serves_pre_ranked_pages(self):
+        players = [self._guest(f"device-season-{i}") for i in range(3)]
+        for idx, (player, score) in enumerate(zip(players, [5.0, 15.0, 10.0])):
+            r = self._submit_score(player, score, nonce=f"season-submit-{idx}")
+            self.assertEqual(r.status_code, 200)
+
+        ops = {"X-Ops-Token": os.environ["KBBQ_OPS_TOKEN"]}
+        r = self._request("POST", "/ops/leaderboard/snapshot?season=S-TEST&region=KR", headers=ops)
+        self.assertEqual(r.status_code, 200)
+        total = r.json()["entries"]
+        self.assertGreaterEqual(total, 3)
+        r = self._request("POST", "/ops/leaderboard/snapshot?season=S-TEST&region=KR", headers=ops)
+        self.assertEqual(r.status_code, 409)
+
+        # Later submits don't change the frozen season.
+        r = self._submit_score(players[0], 10_000.0, nonce="season-submit-late")
+        self.assertEqual(r.status_code, 200)
+
+        r = self._signed_get(players[0], "/leaderboard/seasons?region=KR", nonce="season-list-1")
+        self.assertEqual(r.status_code, 200)
+        self.assertIn("S-TEST", [s["season"] for s in r.json()["seasons"]])
+
+        r = self._signed_get(players[0], "/leaderboard/season?season=S-TEST&region=KR&limit=2", nonce="season-page-1")
+        self.assertEqual(r.status_code, 200)
+        page = r.json()
+        self.assertEqual(page["totalEntries"], total)
+        self.assertEqual([e["rank"] for e in page["entries"]], [1, 2])
+        scores = [e["score"] for e in page["entries"]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(page["me"]["score"], 5.0)
+
+        r = self._signed_get(
+            players[0],
+            f"/leaderboard/season?season=S-TEST&region=KR&afterRank={total - 1}&limit=5",
+            nonce="season-page-last",
+        )
+        self.assertEqual([e["rank"] for e in r.json()["entries"]], [total])
+
+        r = self._signed_get(players[0], "/leaderboard/season?season=NOPE&region=KR", nonce="season-missing")
+        self.assertEqual(r.status_code, 404)
+
+    def test_submit_overwrites_a_best_from_a_closed_season(self):
+        me = self._guest("device-season-epoch")
+        # Own region, so the epoch bump below leaves KR alone.
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("UPDATE players SET region = 'SZ' WHERE player_id = ?", (me["playerId"],))
+        self.assertEqual(self._submit_score(me, 900.0, nonce="epoch-submit-1").status_code, 200)
+
+        from server.db import get_db
+        from server.snapshots import start_epoch
+
+        conn = get_db()
+        try:
+            self.assertEqual(start_epoch(conn, "SZ"), 1)
+        finally:
+            conn.close()
+        # Last season's row is still there (reset not run yet): the new score replaces it.
+        self.assertEqual(self._submit_score(me, 100.0, nonce="epoch-submit-2").status_code, 200)
+        self.assertEqual(self._submit_score(me, 50.0, nonce="epoch-submit-3").status_code, 200)
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT score, season_epoch FROM leaderboard WHERE region = 'SZ' AND player_id = ?", (me["playerId"],)
+            ).fetchone()
+        self.assertEqual(row, (100.0, 1))
+
+    def test_conditional_get_returns_304_until_data_changes(self):
+        me = self._guest("device-etag-me")
+        other = self._guest("device-etag-other")
+        self.assertEqual(self._submit_score(me, 50.0, nonce="etag-submit-1").status_code, 200)
+
+        first = self._signed_get(me, "/leaderboard/top?region=KR&limit=7", nonce="etag-top-1")
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers["etag"]
+
+        cached = self._signed_get(
+            me, "/leaderboard/top?region=KR&limit=7", nonce="etag-top-2", extra_headers={"If-None-Match": etag}
+        )
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        self.assertEqual(cached.headers["etag"], etag)
+        self.assertEqual(cached.headers["vary"], "Accept")
+
+        # Signed-header checks still run before the 304 short-circuit.
+        replay = self._signed_get(
+            me, "/leaderboard/top?region=KR&limit=7", nonce="etag-top-2", extra_headers={"If-None-Match": etag}
+        )
+        self.assertEqual(replay.status_code, 401)
+
+        # A non-improving submit keeps the version; an improving one bumps it.
+        self.assertEqual(self._submit_score(me, 10.0, nonce="etag-submit-2").status_code, 200)
+        still = self._signed_get(
+            me, "/leaderboard/top?region=KR&limit=7", nonce="etag-top-3", extra_headers={"If-None-Match": etag}
+        )
+        self.assertEqual(still.status_code, 304)
+        self.assertEqual(self._submit_score(me, 75.0, nonce="etag-submit-3").status_code, 200)
+        changed = self._signed_get(
+            me, "/leaderboard/top?region=KR&limit=7", nonce="etag-top-4", extra_headers={"If-None-Match": etag}
+        )
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["etag"], etag)
+
+        friends = self._signed_get(me, "/friends/list", nonce="etag-friends-1")
+        self.assertEqual(friends.status_code, 200)
+        friends_etag = friends.headers["etag"]
+        self._invite(me, self._friend_code(other["playerId"]), nonce="etag-invite-1")
+        for auth, nonce in ((me, "etag-friends-2"), (other, "etag-friends-3")):
+            r = self._signed_get(auth, "/friends/list", nonce=nonce, extra_headers={"If-None-Match": friends_etag})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(len(r.json()["friends"]), 1)
+
+    def test_region_shard_routes_leaderboard_writes(self):
+        me = self._guest("device-shard-me")
+        friend = self._guest("device-shard-friend")
+        self._invite(me, self._friend_code(friend["playerId"]), nonce="shard-invite-1")
+        self.assertEqual(self._submit_score(friend, 64.0, nonce="shard-submit-0").status_code, 200)
+
+        shard_file = os.path.join(self._tmp.name, "shards", "kr.db")
+        with patch.dict(os.environ, {"KBBQ_SHARD_MAP": json.dumps({"KR": "shards/kr.db"})}):
+            from server.shards import split_region
+
+            report = split_region("KR")
+            self.assertGreaterEqual(report["copied"]["leaderboard"], 1)
+
+            self.assertEqual(self._submit_score(me, 4242.0, nonce="shard-submit-1").status_code, 200)
+            top = self._signed_get(me, "/leaderboard/top?region=KR&limit=100", nonce="shard-top-1")
+            self.assertEqual(top.status_code, 200)
+            by_player = {e["playerId"]: e for e in top.json()["entries"]}
+            self.assertEqual(by_player[me["playerId"]]["score"], 4242.0)
+            self.assertTrue(by_player[me["playerId"]]["displayName"].startswith("Guest-"))
+
+            friends = self._signed_get(me, "/friends/leaderboard?region=KR", nonce="shard-friends-1")
+            self.assertEqual([e["score"] for e in friends.json()["entries"]], [64.0])
+
+            # The split kept the source rows (no --delete-source); KR is counted from the shard only.
+            with sqlite3.connect(shard_file) as shard, sqlite3.connect(self.db_path) as core:
+                expected = shard.execute("SELECT COUNT(*) FROM leaderboard WHERE region = 'KR'").fetchone()[0]
+                expected += core.execute("SELECT COUNT(*) FROM leaderboard WHERE region != 'KR'").fetchone()[0]
+            metrics = self._request("GET", "/metrics").text
+            self.assertIn(f"kbbq_leaderboard_entries_total {expected}\n", metrics)
+
+        with sqlite3.connect(shard_file) as shard, sqlite3.connect(self.db_path) as core:
+            query = "SELECT COUNT(*) FROM leaderboard WHERE player_id = ?"
+            self.assertEqual(shard.execute(query, (me["playerId"],)).fetchone()[0], 1)
+            self.assertEqual(core.execute(query, (me["playerId"],)).fetchone()[0], 0)
+
+    def test_analytics_event_is_stored_interned(self):
+        from server.analytics import decode_kv
+
+        auth = self._guest("device-analytics-001")
+        for i in range(2):
+            body = {
+                "playerId": auth["playerId"],
+                "eventName": "upgrade_purchase",
+                "kv": [f"level={i}"],
+                "timestamp": int(time.time()),
+                "nonce": f"nonce-analytics-{i}",
+            }
+            r = self._signed_post(auth, "/analytics/event", body, nonce=f"nonce-analytics-{i}")
+            self.assertEqual(r.status_code, 200)
+
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT n.name, e.kv FROM analytics_events e JOIN analytics_players k ON k.id = e.player_key "
+                "JOIN analytics_event_names n ON n.id = e.name_id WHERE k.player_id = ? ORDER BY e.id",
+                (auth["playerId"],),
+            ).fetchall()
+        self.assertEqual(
+            [(name, decode_kv(kv)) for name, kv in rows],
+            [("upgrade_purchase", ["level=0"]), ("upgrade_purchase", ["level=1"])],
+        )
+
+    def test_write_behind_coalesces_submits_and_serves_pending(self):
+        from server.writebehind import SCORE_BUFFER, flush_scores
+
+        me = self._guest("device-write-behind-me")
+        before = SCORE_BUFFER.snapshot()
+        with patch.dict(os.environ, {"KBBQ_WRITE_BEHIND": "1", "KBBQ_WRITE_BEHIND_MAX_PENDING": "1000"}):
+            try:
+                for i, score in enumerate((5e6, 7e6, 6e6)):
+                    self.assertEqual(self._submit_score(me, score, nonce=f"wb-submit-{i}").status_code, 200)
+                with sqlite3.connect(self.db_path) as conn:
+                    query = "SELECT score FROM leaderboard WHERE player_id = ?"
+                    self.assertIsNone(conn.execute(query, (me["playerId"],)).fetchone())
+
+                top = self._signed_get(me, "/leaderboard/top?region=KR&limit=3", nonce="wb-top-1")
+                first = top.json()["entries"][0]
+                self.assertEqual((first["playerId"], first["score"]), (me["playerId"], 7e6))
+                self.assertTrue(first["displayName"].startswith("Guest-"))
+
+                self.assertEqual(self._submit_score(me, 8e6, nonce="wb-submit-3").status_code, 200)
+                changed = self._signed_get(
+                    me,
+                    "/leaderboard/top?region=KR&limit=3",
+                    nonce="wb-top-2",
+                    extra_headers={"If-None-Match": top.headers["etag"]},
+                )
+                self.assertEqual(changed.status_code, 200)
+                self.assertEqual(changed.json()["entries"][0]["score"], 8e6)
+
+                self.assertEqual([k for k, _ in SCORE_BUFFER.buffered_entries()], [("KR", me["playerId"])])
+                self.assertEqual(flush_scores(), 1)
+                with sqlite3.connect(self.db_path) as conn:
+                    self.assertEqual(conn.execute(query, (me["playerId"],)).fetchone()[0], 8e6)
+
+                # At KBBQ_WRITE_BEHIND_MAX_PENDING the submit itself flushes (off the event loop).
+                with patch.dict(os.environ, {"KBBQ_WRITE_BEHIND_MAX_PENDING": "1"}):
+                    self.assertEqual(self._submit_score(me, 9e6, nonce="wb-submit-4").status_code, 200)
+                with sqlite3.connect(self.db_path) as conn:
+                    self.assertEqual(conn.execute(query, (me["playerId"],)).fetchone()[0], 9e6)
+            finally:
+                flush_scores()
+
+        after = SCORE_BUFFER.snapshot()
+        self.assertEqual(after["submits"] - before["submits"], 5)
+        self.assertEqual(after["rows_flushed"] - before["rows_flushed"], 2)
+        self.assertEqual(after["pending"], 0)
+        self.assertIn("kbbq_write_behind_coalescing_ratio", self._request("GET", "/metrics").text)
+
+    def test_percentile_reads_the_region_histogram(self):
+        unranked = self._guest("device-percentile-none")
+        empty = self._signed_get(unranked, "/leaderboard/percentile?region=KR", nonce="pct-none-1").json()
+        self.assertIsNone(empty["score"])
+        self.assertIsNone(empty["topPercent"])
+
+        whale = self._guest("device-percentile-whale")
+        self.assertEqual(self._submit_score(whale, 10.0, nonce="pct-submit-0").status_code, 200)
+        self.assertEqual(self._submit_score(whale, 2.2e6, nonce="pct-submit-1").status_code, 200)
+        first = self._signed_get(whale, "/leaderboard/percentile?region=KR", nonce="pct-whale-1")
+        self.assertEqual(first.status_code, 200)
+        body = first.json()
+        with sqlite3.connect(self.db_path) as conn:
+            total = conn.execute("SELECT COUNT(*) FROM leaderboard WHERE region = 'KR'").fetchone()[0]
+            above = conn.execute("SELECT COUNT(*) FROM leaderboard WHERE region = 'KR' AND score > 2.2e6").fetchone()[0]
+        # Incremental moves keep the counts exact: the 10.0 bucket was vacated again.
+        self.assertEqual(body["totalPlayers"], total)
+        self.assertEqual(sum(b["count"] for b in body["buckets"]), total)
+        # Alone in its bucket, so the estimate is the exact rank.
+        self.assertEqual((body["score"], body["rankEstimate"]), (2.2e6, above + 1))
+        self.assertEqual(body["topPercent"], round(100.0 * (above + 1) / total, 2))
+        mine = [b for b in body["buckets"] if b["lower"] <= 2.2e6 < b["upper"]]
+        self.assertEqual([b["count"] for b in mine], [1])
+
+        cached = self._signed_get(
+            whale,
+            "/leaderboard/percentile?region=KR",
+            nonce="pct-whale-2",
+            extra_headers={"If-None-Match": first.headers["etag"]},
+        )
+        self.assertEqual(cached.status_code, 304)
+
+        from server.histogram import rebuild_all
+
+        rebuilt = rebuild_all(["KR"])
+        self.assertEqual(rebuilt["KR"], len(body["buckets"]))
+        self.assertIn("kbbq_score_histogram_rebuilds_total", self._request("GET", "/metrics").text)
+        # A rebuild that changes nothing keeps the cached distribution valid.
+        settled = self._signed_get(whale, "/leaderboard/percentile?region=KR", nonce="pct-whale-3").headers["etag"]
+        rebuild_all(["KR"])
+        unchanged = self._signed_get(
+            whale,
+            "/leaderboard/percentile?region=KR",
+            nonce="pct-whale-5",
+            extra_headers={"If-None-Match": settled},
+        )
+        self.assertEqual(unchanged.status_code, 304)
+
+        # Drift (a count written outside record_moves) is corrected by the rebuild: new ETag.
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("UPDATE leaderboard_histogram SET count = count + 5 WHERE region = 'KR' AND bucket = 0")
+            conn.execute("INSERT OR IGNORE INTO leaderboard_histogram(region, bucket, count) VALUES('KR', 0, 5)")
+        rebuild_all(["KR"])
+        corrected = self._signed_get(
+            whale,
+            "/leaderboard/percentile?region=KR",
+            nonce="pct-whale-4",
+            extra_headers={"If-None-Match": settled},
+        )
+        self.assertEqual(corrected.status_code, 200)
+        self.assertNotEqual(corrected.headers["etag"], settled)
+        self.assertEqual(corrected.json()["buckets"], body["buckets"])
+
+    def test_msgpack_negotiation_for_client_endpoints(self):
+        import msgpack
+
+        me = self._guest("device-msgpack-me")
+        ts = int(time.time())
+        submit = {
+            "playerId": me["playerId"],
+            "score": 321.0,
+            "timestamp": ts,
+            "nonce": "mp-submit-body",
+            "signature": hmac_b64(os.environ["KBBQ_HMAC_SECRET"], f"{me['playerId']}|321|{ts}"),
+        }
+        r = self._signed_msgpack(me, "POST", "/leaderboard/submit", submit, nonce="mp-submit-1")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers["content-type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(r.content), {"ok": True})
+
+        # The signature covers the exact bytes: a re-encoded body must not verify.
+        raw = msgpack.packb(submit)
+        headers = {
+            "Authorization": f"Bearer {me['token']}",
+            "Content-Type": "application/msgpack",
+            **_sign_headers(
+                secret=os.environ["KBBQ_HMAC_SECRET"],
+                player_id=me["playerId"],
+                nonce="mp-submit-2",
+                ts=ts,
+                raw_body=json.dumps(submit),
+            ),
+        }
+        self.assertEqual(self._request("POST", "/leaderboard/submit", headers=headers, content=raw).status_code, 401)
+
+        top = self._signed_msgpack(me, "GET", "/leaderboard/top?region=KR&limit=100", None, nonce="mp-top-1")
+        self.assertEqual(top.status_code, 200)
+        self.assertEqual(top.headers["vary"], "Accept")
+        entries = msgpack.unpackb(top.content)["entries"]
+        self.assertIn((me["playerId"], 321.0), [(e["playerId"], e["score"]) for e in entries])
+        as_json = self._signed_get(me, "/leaderboard/top?region=KR&limit=100", nonce="mp-top-2")
+        self.assertEqual(as_json.json()["entries"], entries)
+        self.assertNotEqual(as_json.headers["etag"], top.headers["etag"])
+
+        friends = self._signed_msgpack(me, "GET", "/friends/list", None, nonce="mp-friends-1")
+        self.assertEqual(msgpack.unpackb(friends.content), {"friends": []})
+
+        event = {
+            "playerId": me["playerId"],
+            "eventName": "session_start",
+            "kv": ["a=b"],
+            "timestamp": ts,
+            "nonce": "mp-event-body",
+        }
+        r = self._signed_msgpack(me, "POST", "/analytics/event", event, nonce="mp-event-1")
+        self.assertEqual(msgpack.unpackb(r.content), {"ok": True})
+        bad = self._signed_msgpack(me, "POST", "/analytics/event", None, nonce="mp-event-2", raw=b"\xc1")
+        self.assertEqual(bad.status_code, 400)
+
+    def _signed_msgpack(self, auth: dict, method: str, url: str, body, *, nonce: str, raw: bytes = None):
+        import msgpack
+
+        if raw is None:
+            raw = msgpack.packb(body) if body is not None else b""
+        headers = {
+            "Authorization": f"Bearer {auth['token']}",
+            "Accept": "application/msgpack",
+            "X-Nonce": nonce,
+            "X-Timestamp": str(int(time.time())),
+        }
+        if raw:
+            headers["Content-Type"] = "application/msgpack"
+        message = f"{auth['playerId']}|{nonce}|{headers['X-Timestamp']}|".encode("utf-8") + raw
+        headers["X-Signature"] = hmac_b64(os.environ["KBBQ_HMAC_SECRET"], message)
+        return self._request(method, url, headers=headers, content=raw)
+
+    def _guest(self, device_id: str) -> dict:
+        r = self._request("POST", "/auth/guest", json={"deviceId": device_id})
+        self.assertEqual(r.status_code, 200)
+        return r.json()
+
+    def _friend_code(self, player_id: str) -> str:
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT code FROM friend_codes WHERE player_id = ?", (player_id,)).fetchone()
+        return str(row[0])
+
+    def _signed_get(self, auth: dict, url: str, *, nonce: str, extra_headers: dict = None) -> httpx.Response:
+        headers = {
+            "Authorization": f"Bearer {auth['token']}",
+            **_sign_headers(
+                secret=os.environ["KBBQ_HMAC_SECRET"],
+                player_id=auth["playerId"],
+                nonce=nonce,
+                ts=int(time.time()),
+                raw_body="",
+            ),
+            **(extra_headers or {}),
+        }
+        return self._request("GET", url, headers=headers)
+
+    def _signed_post(self, auth: dict, url: str, body: dict, *, nonce: str) -> httpx.Response:
+        raw_body = json.dumps(body, separators=(",", ":"))
+        headers = {
+            "Authorization": f"Bearer {auth['token']}",
+            "Content-Type": "application/json",
+            **_sign_headers(
+                secret=os.environ["KBBQ_HMAC_SECRET"],
+                player_id=auth["playerId"],
+                nonce=nonce,
+                ts=int(time.time()),
+                raw_body=raw_body,
+            ),
+        }
+        return self._request("POST", url, headers=headers, content=raw_body)
+
+    def _submit_score(self, auth: dict, score: float, *, nonce: str) -> httpx.Response:
+        player_id = auth["playerId"]
+        ts = int(time.time())
+        score_int = int(round(float(score)))
+        body = {
+            "playerId": player_id,
+            "score": score,
+            "timestamp": ts,
+            "nonce": nonce + "-body",
+            "signature": hmac_b64(os.environ["KBBQ_HMAC_SECRET"], f"{player_id}|{score_int}|{ts}"),
+        }
+        return self._signed_post(auth, "/leaderboard/submit", body, nonce=nonce)
+
+    def _invite(self, auth: dict, code: str, *, nonce: str) -> httpx.Response:
+        player_id = auth["playerId"]
+        ts = int(time.time())
+        body = {
+            "playerId": player_id,
+            "code": code,
+            "timestamp": ts,
+            "nonce": nonce + "-body",
+            "signature": hmac_b64(os.environ["KBBQ_HMAC_SECRET"], f"{player_id}|{code}|{ts}"),
+        }
+        r = self._signed_post(auth, "/friends/invite", body, nonce=nonce)
+        self.assertEqual(r.status_code, 200)
+        return r
+
     async def _request_async(self, method: str, url: str, **kwargs) -> httpx.Response:
         transport = httpx.ASGITransport(app=self.app)
         async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import time
+import unittest
+
+from server.audit import EconomyCaps, audit_leaderboard, is_plausible, max_plausible_score, max_plausible_scores
+
+
+class TestAudit(unittest.TestCase):
+    def test_envelope_is_monotonic_and_matches_vectorized(self):
+        caps = EconomyCaps()
+        ages = [0, 1, 60, 3_600, 86_400, 30 * 86_400, 365 * 86_400]
+        scalar = [max_plausible_score(a, caps) for a in ages]
+        self.assertEqual(scalar, sorted(scalar))
+        self.assertEqual(scalar[0], 0.0)
+        # Level 1 pays base income * multiplier cap until the first requirement.
+        self.assertAlmostEqual(max_plausible_score(0.1, caps), 0.1 * caps.base_income_per_sec * caps.max_multiplier)
+
+        vectorized = max_plausible_scores(ages, caps)
+        for a, b in zip(scalar, vectorized):
+            self.assertAlmostEqual(a, float(b), delta=abs(a) * 1e-9)
+
+    def test_is_plausible_uses_tolerance_and_grace(self):
+        caps = EconomyCaps(tolerance=2.0, grace_score=10.0)
+        limit = 2.0 * max_plausible_score(3_600, caps) + 10.0
+        self.assertTrue(is_plausible(limit, 3_600, caps))
+        self.assertFalse(is_plausible(limit * 1.01, 3_600, caps))
+
+    def test_batch_audit_flags_outliers(self):
+        with tempfile.TemporaryDirectory(prefix="kbbq_audit_test_") as tmp:
+            prev = os.environ.get("KBBQ_DB_PATH")
+            os.environ["KBBQ_DB_PATH"] = os.path.join(tmp, "audit.db")
+            try:
+                from server.db import get_db
+
+                conn = get_db()
+                now = int(time.time())
+                caps = EconomyCaps()
+                day_limit = max_plausible_score(86_400, caps)
+                rows = [
+                    ("p_fair", day_limit * 0.5),
+                    ("p_cheat", day_limit * 100),
+                ]
+                for player_id, score in rows:
+                    conn.execute(
+                        "INSERT INTO players(player_id, device_id, display_name, token_sha256, region, created_at) "
+                        "VALUES(?,?,?,?,?,?)",
+                        (player_id, "dev-" + player_id, player_id, "hash-" + player_id, "KR", now - 86_400),
+                    )
+                    conn.execute(
+                        "INSERT INTO leaderboard(region, player_id, score, updated_at) VALUES(?,?,?,?)",
+                        ("KR", player_id, score, now),
+                    )
+                conn.commit()
+
+                report = audit_leaderboard(conn, caps, chunk_size=1)
+                self.assertEqual(report["rows_scanned"], 2)
+                self.assertEqual(report["flagged"], 1)
+                flagged = conn.execute("SELECT player_id, ratio FROM leaderboard_flags").fetchall()
+                self.assertEqual([r["player_id"] for r in flagged], ["p_cheat"])
+                self.assertGreater(flagged[0]["ratio"], 1.0)
+                conn.close()
+            finally:
+                if prev is None:
+                    os.environ.pop("KBBQ_DB_PATH", None)
+                else:
+                    os.environ["KBBQ_DB_PATH"] = prev
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from server.envutil import env_bool, env_float, env_int
+
+
+class TestEnvFlags(unittest.TestCase):
+    def test_invalid_values_fall_back_to_the_default(self):
+        with patch.dict(os.environ, {"KBBQ_T_INT": "lots", "KBBQ_T_FLOAT": "fast", "KBBQ_T_EMPTY": " "}):
+            self.assertEqual(env_int("KBBQ_T_INT", 7, minimum=10), 10)
+            self.assertEqual(env_float("KBBQ_T_FLOAT", 2.5), 2.5)
+            self.assertEqual(env_int("KBBQ_T_EMPTY", 3), 3)
+            self.assertIsNone(env_float("KBBQ_T_FLOAT", None, minimum=0.0))
+            self.assertIsNone(env_float("KBBQ_T_UNSET", None))
+
+    def test_numbers_are_clamped(self):
+        with patch.dict(os.environ, {"KBBQ_T_INT": "-5", "KBBQ_T_FLOAT": "1e9"}):
+            self.assertEqual(env_int("KBBQ_T_INT", 1, minimum=0), 0)
+            self.assertEqual(env_float("KBBQ_T_FLOAT", 1.0, maximum=100.0), 100.0)
+
+    def test_bool_flags(self):
+        for raw, expected in (("1", True), (" Yes ", True), ("on", True), ("0", False), ("off", False), ("x", False)):
+            with self.subTest(raw=raw), patch.dict(os.environ, {"KBBQ_T_FLAG": raw}):
+                self.assertIs(env_bool("KBBQ_T_FLAG"), expected)
+        self.assertIs(env_bool("KBBQ_T_UNSET"), False)
+        self.assertIs(env_bool("KBBQ_T_UNSET", True), True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import random
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from server.histogram import (
+    BUCKETS_PER_DECADE,
+    MAX_BUCKET,
+    bucket_lower,
+    bucket_upper,
+    estimate,
+    read_buckets,
+    rebuild_region,
+    record_moves,
+    score_bucket,
+)
+
+
+class TestScoreHistogram(unittest.TestCase):
+    def test_buckets_are_log_scaled_and_contain_their_scores(self):
+        self.assertEqual(score_bucket(0), 0)
+        self.assertEqual(score_bucket(-5), 0)
+        self.assertEqual(score_bucket(0.99), 0)
+        self.assertEqual(score_bucket(1), 1)
+        self.assertEqual(score_bucket(10), BUCKETS_PER_DECADE + 1)
+        self.assertEqual(score_bucket(float("inf")), MAX_BUCKET)
+        rng = random.Random(7)
+        for _ in range(2000):
+            score = 10 ** rng.uniform(0, 30)
+            bucket = score_bucket(score)
+            self.assertLessEqual(bucket_lower(bucket), score)
+            self.assertLess(score, bucket_upper(bucket))
+
+    def test_estimate_interpolates_inside_the_bucket(self):
+        buckets = [(score_bucket(5), 90), (score_bucket(5000), 10)]
+        # Callers already counted in the histogram at their stored best.
+        self.assertEqual(estimate(buckets, None), {"total": 100, "rank": None, "top_percent": None})
+        low = bucket_lower(score_bucket(5))
+        self.assertEqual(estimate(buckets, low, low)["rank"], 100)
+        mid = bucket_lower(score_bucket(5000))
+        self.assertEqual(estimate(buckets, mid, mid)["rank"], 10)
+        self.assertEqual(estimate(buckets, 5000, 5000)["rank"], 1)
+        # Not counted yet (buffered or first submit): every counted player is somebody else.
+        top = estimate(buckets, 1e9)
+        self.assertEqual((top["total"], top["rank"], top["top_percent"]), (101, 1, 0.99))
+        self.assertEqual(estimate(buckets, low), {"total": 101, "rank": 101, "top_percent": 100.0})
+        self.assertEqual(estimate(buckets, 5000, low)["rank"], 1)
+        self.assertEqual(estimate(buckets, 5000, low)["total"], 100)
+        self.assertEqual(estimate([], 42.0), {"total": 1, "rank": 1, "top_percent": 100.0})
+
+    def test_incremental_moves_match_rebuild(self):
+        with tempfile.TemporaryDirectory(prefix="kbbq_histogram_test_") as tmp:
+            with patch.dict(os.environ, {"KBBQ_DB_PATH": os.path.join(tmp, "hist.db")}):
+                from server.db import get_db
+
+                conn = get_db()
+                try:
+                    rng = random.Random(3)
+                    best: dict[str, float] = {}
+                    for _ in range(3000):
+                        player_id = f"p_{rng.randrange(400)}"
+                        score = round(10 ** rng.uniform(-1, 9), 2)
+                        old = best.get(player_id)
+                        if old is not None and score <= old:
+                            continue
+                        conn.execute(
+                            "INSERT INTO leaderboard(region, player_id, score, updated_at) VALUES('KR', ?, ?, 0) "
+                            "ON CONFLICT(region, player_id) DO UPDATE SET score = excluded.score",
+                            (player_id, score),
+                        )
+                        record_moves(conn, "KR", [(old, score)])
+                        best[player_id] = score
+                    conn.commit()
+                    incremental = read_buckets(conn, "KR")
+                    self.assertEqual(sum(count for _, count in incremental), len(best))
+
+                    rebuild_region(conn, "KR")
+                    self.assertEqual(read_buckets(conn, "KR"), incremental)
+
+                    # Drift (e.g. rows deleted behind the histogram's back) is corrected by a rebuild.
+                    conn.execute("DELETE FROM leaderboard WHERE region = 'KR' AND score < 100")
+                    conn.commit()
+                    rebuild_region(conn, "KR")
+                    remaining = sum(1 for score in best.values() if score >= 100)
+                    self.assertEqual(sum(count for _, count in read_buckets(conn, "KR")), remaining)
+                finally:
+                    conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import asyncio
+import time
+import unittest
+
+from server.looplag import BlockingWatchdog, LagHistogram, monitor_loop_lag
+
+
+def _block_the_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+class TestLoopLag(unittest.TestCase):
+    def test_histogram_is_cumulative(self):
+        hist = LagHistogram(buckets=(0.01, 0.1))
+        for lag in (0.0, 0.05, 0.05, 3.0):
+            hist.observe(lag)
+        snap = hist.snapshot()
+        self.assertEqual([count for _, count in snap["buckets"]], [1, 3, 4])
+        self.assertEqual(snap["count"], 4)
+        lines = hist.prometheus_lines("lag_seconds", "test")
+        self.assertIn('lag_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn("lag_seconds_count 4", lines)
+
+    def test_blocking_call_is_measured_and_logged_with_stack(self):
+        hist = LagHistogram()
+        interval = 0.01
+
+        async def scenario():
+            monitor = asyncio.create_task(monitor_loop_lag(interval, hist))
+            await asyncio.sleep(0.05)
+            _block_the_loop(0.3)
+            await asyncio.sleep(0.05)
+            monitor.cancel()
+
+        watchdog = BlockingWatchdog(interval, 0.1, hist)
+        watchdog.start()
+        try:
+            with self.assertLogs("kbbq.looplag", level="WARNING") as logs:
+                asyncio.run(scenario())
+        finally:
+            watchdog.stop()
+
+        snap = hist.snapshot()
+        self.assertGreaterEqual(snap["max"], 0.25)
+        self.assertEqual(snap["blocked_reports"], 1)
+        self.assertIn("_block_the_loop", "\n".join(logs.output))
+
+
+if __name__ == "__main__":
+    unittest.main()
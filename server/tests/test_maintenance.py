@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import closing
+from unittest.mock import patch
+
+from server import maintenance
+
+
+class TestMaintenance(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix="kbbq_maintenance_test_")
+        self.path = os.path.join(self._tmp.name, "maint.db")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _churned_db(self) -> None:
+        with patch.dict(os.environ, {"KBBQ_DB_PATH": self.path}):
+            from server.db import get_db
+
+            with closing(get_db()) as conn:
+                conn.executemany(
+                    "INSERT INTO nonces(player_id, nonce, ts) VALUES(?,?,?)",
+                    [("p_churn", f"nonce-{i:06d}-" + "x" * 64, i) for i in range(20_000)],
+                )
+                conn.commit()
+                conn.execute("DELETE FROM nonces WHERE ts < 19000")
+                conn.commit()
+
+    def test_round_analyzes_and_reclaims_free_pages(self):
+        self._churned_db()
+        with closing(sqlite3.connect(self.path)) as conn:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+            freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        self.assertGreater(freelist, 100)
+
+        before = maintenance.snapshot()
+        with patch.dict(os.environ, {"KBBQ_MAINTENANCE_STEP_MS": "5000"}):
+            report = maintenance.run_maintenance([self.path])[self.path]
+        # ANALYZE runs first and may reuse a few free pages for sqlite_stat1.
+        reclaimed = report["vacuum"]["reclaimed_pages"]
+        self.assertGreater(reclaimed, freelist - 10)
+        self.assertEqual(report["checkpoint"]["skipped"], "not in WAL mode")
+        with closing(sqlite3.connect(self.path)) as conn:
+            self.assertEqual(conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+            self.assertLessEqual(conn.execute("PRAGMA page_count").fetchone()[0], pages - reclaimed)
+            self.assertGreater(conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0], 0)
+
+        after = maintenance.snapshot()
+        self.assertEqual(after["reclaimed_pages"] - before["reclaimed_pages"], reclaimed)
+        self.assertEqual(after["steps"]["vacuum"]["runs"] - before["steps"]["vacuum"]["runs"], 1)
+        self.assertIn('kbbq_maintenance_step_seconds_total{step="analyze"}', "\n".join(maintenance.prometheus_lines()))
+
+    def test_checkpoint_only_in_wal_mode_and_locks_are_not_waited_for(self):
+        self._churned_db()
+        with closing(sqlite3.connect(self.path, isolation_level=None)) as writer:
+            writer.execute("PRAGMA journal_mode = WAL")
+            writer.execute("INSERT INTO nonces(player_id, nonce, ts) VALUES('p_wal', 'n', 1)")
+            with closing(maintenance._connect(self.path)) as conn:
+                self.assertGreater(maintenance.checkpoint(conn)["checkpointed_pages"], 0)
+
+            # A writer holding the lock makes the vacuum step fail fast instead of queueing.
+            writer.execute("BEGIN IMMEDIATE")
+            errors = maintenance.snapshot()["steps"]["vacuum"]["errors"]
+            report = maintenance.run_maintenance([self.path])[self.path]
+            writer.execute("ROLLBACK")
+        self.assertIn("locked", report["vacuum"]["error"])
+        self.assertLess(report["vacuum"]["seconds"], 2.0)
+        self.assertEqual(maintenance.snapshot()["steps"]["vacuum"]["errors"], errors + 1)
+
+    def test_wal_opt_in_gets_checkpointed_by_the_round(self):
+        with patch.dict(os.environ, {"KBBQ_DB_PATH": self.path, "KBBQ_SQLITE_WAL": "1"}):
+            from server.db import get_db
+
+            with closing(get_db()) as conn:
+                self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+                conn.executemany(
+                    "INSERT INTO nonces(player_id, nonce, ts) VALUES(?,?,?)",
+                    [("p_wal", f"nonce-{i}", i) for i in range(500)],
+                )
+                conn.commit()
+                before = maintenance.snapshot()["checkpointed_pages"]
+                report = maintenance.run_maintenance([self.path])[self.path]
+        self.assertNotIn("skipped", report["checkpoint"])
+        self.assertFalse(report["checkpoint"]["busy"])
+        self.assertGreater(report["checkpoint"]["checkpointed_pages"], 0)
+        self.assertEqual(report["checkpoint"]["checkpointed_pages"], report["checkpoint"]["wal_pages"])
+        self.assertEqual(
+            maintenance.snapshot()["checkpointed_pages"] - before, report["checkpoint"]["checkpointed_pages"]
+        )
+
+    def test_busy_ticks_are_deferred_a_bounded_number_of_times(self):
+        env = {"KBBQ_MAINTENANCE_IDLE_RPS": "1", "KBBQ_MAINTENANCE_MAX_DEFERRALS": "2"}
+        with patch.dict(os.environ, env), patch.dict(maintenance._last_tick, {"activity": 0, "at": 0.0, "deferrals": 0}):
+            with patch.object(maintenance, "_activity", 0):
+                self.assertTrue(maintenance.should_run(now=10.0))
+            decisions = []
+            for tick in range(4):
+                with patch.object(maintenance, "_activity", 1000 * (tick + 1)):
+                    decisions.append(maintenance.should_run(now=20.0 + 10 * tick))
+        self.assertEqual(decisions, [False, False, True, False])
+
+    def test_convert_switches_legacy_files_to_incremental(self):
+        with closing(sqlite3.connect(self.path)) as conn:
+            conn.execute("CREATE TABLE t (v TEXT)")
+            conn.executemany("INSERT INTO t VALUES(?)", [("x" * 200,) for _ in range(5000)])
+            conn.commit()
+            conn.execute("DELETE FROM t")
+            conn.commit()
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 0)
+        report = maintenance.convert_to_incremental(self.path)
+        self.assertEqual(report["auto_vacuum"], 2)
+        self.assertLess(report["pages_after"], report["pages_before"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from server import queries
+from server.seed import SeedConfig, friend_code, seed_database, seed_token
+from server.security import token_sha256
+from server.snapshots import snapshot_region
+
+_SALT = "plan-test-salt"
+# Fixed dataset size for the timing budgets below.
+_CFG = SeedConfig(players=20_000, friends_per_player=8, events=40_000, seed=11)
+# Per-execution budget (fetch included). Index lookups here take tens of microseconds;
+# a full scan of the seeded tables takes milliseconds.
+_BUDGET_MS = 2.0
+_RUNS = 200
+
+# Sorts that are bounded by the caller's friend set, not by table size.
+_TEMP_BTREE_OK = {"FRIENDS_LIST", "FRIENDS_LEADERBOARD", "FRIENDS_LEADERBOARD_PAGE"}
+# Bound parameter lists (json_each over the caller's friend ids); bounded by the friend count.
+_BOUND_LIST_SCAN = "VIRTUAL TABLE"
+# Statement fragments that are only ever executed appended to another statement.
+_FRAGMENTS = {"FRIENDS_LEADERBOARD_AFTER", "FRIENDS_LEADERBOARD_ORDER"}
+
+
+class TestQueryPlans(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = tempfile.TemporaryDirectory(prefix="kbbq_plan_test_")
+        path = os.path.join(cls._tmp.name, "plans.db")
+        with patch.dict(os.environ, {"KBBQ_DB_PATH": path}):
+            from server.db import get_db
+
+            cls.conn = get_db()
+        seed_database(cls.conn, _CFG, salt=_SALT, now=1_700_000_000)
+        snapshot_region(cls.conn, "KR", "2026-S1", now=1_700_000_000)
+
+        row = cls.conn.execute(
+            "SELECT p.player_id, p.region, f.friend_player_id FROM players p "
+            "JOIN friends f ON f.player_id = p.player_id WHERE p.device_id = 'seed-device-0'"
+        ).fetchone()
+        pid, region = str(row["player_id"]), str(row["region"])
+        top = cls.conn.execute(queries.LEADERBOARD_TOP, (region, 1)).fetchone()
+        friend_ids = json.dumps([str(r[0]) for r in cls.conn.execute(queries.FRIEND_IDS, (pid,)).fetchall()])
+        cls.cases = {
+            "TOKEN_LOOKUP": (queries.TOKEN_LOOKUP, (token_sha256(seed_token(0), _SALT),), "idx_players_token_sha256"),
+            "TOKEN_EPOCH": (queries.TOKEN_EPOCH, (pid,), "sqlite_autoindex_players_1"),
+            "NONCE_INSERT": (queries.NONCE_INSERT, (pid, "nonce", 1_700_000_000), None),
+            "NONCE_PURGE": (queries.NONCE_PURGE, (1_600_000_000,), "idx_nonces_ts"),
+            "PLAYER_BY_DEVICE": (queries.PLAYER_BY_DEVICE, ("seed-device-0",), "sqlite_autoindex_players_2"),
+            "PLAYER_REGION": (queries.PLAYER_REGION, (pid,), "sqlite_autoindex_players_1"),
+            "LEADERBOARD_BEST": (queries.LEADERBOARD_BEST, (region, pid), "sqlite_autoindex_leaderboard_1"),
+            "LEADERBOARD_INSERT": (queries.LEADERBOARD_INSERT, (region, "p_new", 1.0, 1, 0), None),
+            "LEADERBOARD_UPDATE": (queries.LEADERBOARD_UPDATE, (2.0, 1, 0, region, pid), "sqlite_autoindex_leaderboard_1"),
+            "LEADERBOARD_EPOCH": (queries.LEADERBOARD_EPOCH, (region,), "PRIMARY KEY"),
+            "LEADERBOARD_UPSERT_MAX": (queries.LEADERBOARD_UPSERT_MAX, (region, pid, 3.0, 1, 0), None),
+            "PLAYER_DISPLAY_NAME": (queries.PLAYER_DISPLAY_NAME, (pid,), "sqlite_autoindex_players_1"),
+            "LEADERBOARD_TOP": (queries.LEADERBOARD_TOP, (region, 100), "idx_leaderboard_region_score"),
+            "HISTOGRAM_ROWS": (queries.HISTOGRAM_ROWS, (region,), "PRIMARY KEY"),
+            "HISTOGRAM_ADD": (queries.HISTOGRAM_ADD, (region, 40, 1), None),
+            "SEASON_LIST": (queries.SEASON_LIST, ("KR",), "idx_leaderboard_seasons_region"),
+            "SEASON_INFO": (queries.SEASON_INFO, ("2026-S1", "KR"), "sqlite_autoindex_leaderboard_seasons_1"),
+            "SEASON_PAGE": (queries.SEASON_PAGE, ("2026-S1", "KR", 50, 100), "PRIMARY KEY"),
+            "SEASON_ME": (queries.SEASON_ME, ("2026-S1", "KR", pid), "idx_leaderboard_snapshots_player"),
+            "FRIEND_IDS": (queries.FRIEND_IDS, (pid,), "sqlite_autoindex_friends_1"),
+            "FRIEND_CODE_LOOKUP": (queries.FRIEND_CODE_LOOKUP, (friend_code(1),), "sqlite_autoindex_friend_codes_2"),
+            "FRIEND_CODE_BY_PLAYER": (queries.FRIEND_CODE_BY_PLAYER, (pid,), "sqlite_autoindex_friend_codes_1"),
+            "FRIEND_INSERT": (queries.FRIEND_INSERT, (pid, "p_new", 1), None),
+            "FRIENDS_LIST": (queries.FRIENDS_LIST, (pid,), "sqlite_autoindex_friends_1"),
+            "FRIENDS_LEADERBOARD": (
+                queries.FRIENDS_LEADERBOARD + queries.FRIENDS_LEADERBOARD_ORDER,
+                (friend_ids, region, 51),
+                _BOUND_LIST_SCAN,
+            ),
+            "FRIENDS_LEADERBOARD_PAGE": (
+                queries.FRIENDS_LEADERBOARD + queries.FRIENDS_LEADERBOARD_AFTER + queries.FRIENDS_LEADERBOARD_ORDER,
+                (friend_ids, region, float(top["score"]), float(top["score"]), "", 51),
+                _BOUND_LIST_SCAN,
+            ),
+            "FRIENDS_LEADERBOARD_RANK": (
+                queries.FRIENDS_LEADERBOARD_RANK,
+                (friend_ids, region, float(top["score"]), float(top["score"]), ""),
+                _BOUND_LIST_SCAN,
+            ),
+            "EVENT_NAME_INSERT": (queries.EVENT_NAME_INSERT, ("session_start",), None),
+            "EVENT_NAME_ID": (queries.EVENT_NAME_ID, ("session_start",), "sqlite_autoindex_analytics_event_names_1"),
+            "ANALYTICS_PLAYER_INSERT": (queries.ANALYTICS_PLAYER_INSERT, (pid,), None),
+            "ANALYTICS_PLAYER_KEY": (queries.ANALYTICS_PLAYER_KEY, (pid,), "sqlite_autoindex_analytics_players_1"),
+            "ANALYTICS_INSERT": (queries.ANALYTICS_INSERT, (1, 1, b"\x00", 1), None),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        cls._tmp.cleanup()
+
+    def test_every_hot_statement_is_covered(self):
+        declared = {name for name in vars(queries) if name.isupper()} - _FRAGMENTS
+        self.assertEqual(declared - set(self.cases), set())
+
+    def test_plans_use_indexes(self):
+        for name, (sql, params, index) in self.cases.items():
+            with self.subTest(statement=name):
+                plan = [str(r["detail"]) for r in self.conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+                for step in plan:
+                    if step.startswith("SCAN ") and _BOUND_LIST_SCAN in step:
+                        continue
+                    self.assertFalse(step.startswith("SCAN "), f"{name}: {plan}")
+                    if name not in _TEMP_BTREE_OK:
+                        self.assertNotIn("TEMP B-TREE", step, f"{name}: {plan}")
+                if index is not None:
+                    self.assertIn(index, plan[0], f"{name}: {plan}")
+
+    def test_hot_statements_fit_timing_budget(self):
+        for name, (sql, params, _) in self.cases.items():
+            with self.subTest(statement=name):
+                started = time.perf_counter()
+                for _ in range(_RUNS):
+                    try:
+                        self.conn.execute(sql, params).fetchall()
+                    except sqlite3.IntegrityError:
+                        pass
+                    self.conn.rollback()
+                per_call_ms = (time.perf_counter() - started) * 1000.0 / _RUNS
+                self.assertLess(per_call_ms, _BUDGET_MS, name)
+
+
+class TestQueryPlansAfterAnalyze(TestQueryPlans):
+    """Same checks once the maintenance scheduler has written planner statistics."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from server.maintenance import analyze
+
+        analyze(cls.conn)
+        cls.conn.commit()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from server.seed import SeedConfig, friend_code, seed_database
+from server.security import token_sha256
+
+
+class TestSeed(unittest.TestCase):
+    def _seed(self, path: str, cfg: SeedConfig) -> tuple[dict, list]:
+        with patch.dict(os.environ, {"KBBQ_DB_PATH": path}):
+            from server.db import get_db
+
+            conn = get_db()
+            try:
+                report = seed_database(conn, cfg, salt="seed-test-salt", now=1_700_000_000)
+                top = conn.execute(
+                    "SELECT region, player_id, score FROM leaderboard ORDER BY score DESC LIMIT 5"
+                ).fetchall()
+                indexes = {
+                    r["name"] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+                }
+                friends = conn.execute("SELECT COUNT(*) FROM friends").fetchone()[0]
+                token_row = conn.execute(
+                    "SELECT COUNT(*) AS c FROM players WHERE token_sha256 = ?",
+                    (token_sha256("seed-token-3", "seed-test-salt"),),
+                ).fetchone()
+            finally:
+                conn.close()
+        report["indexes"] = indexes
+        report["friends_stored"] = int(friends)
+        report["token_matches"] = int(token_row["c"])
+        return report, [tuple(r) for r in top]
+
+    def test_seed_is_reproducible_and_rebuilds_indexes(self):
+        cfg = SeedConfig(players=300, friends_per_player=4, events=2_000, seed=7, batch_size=128)
+        with tempfile.TemporaryDirectory(prefix="kbbq_seed_test_") as tmp:
+            first, top_a = self._seed(os.path.join(tmp, "a.db"), cfg)
+            _, top_b = self._seed(os.path.join(tmp, "b.db"), cfg)
+            _, top_c = self._seed(os.path.join(tmp, "c.db"), SeedConfig(players=300, events=10, seed=8))
+
+        self.assertEqual(top_a, top_b)
+        self.assertNotEqual(top_a, top_c)
+        self.assertEqual(first["tables"]["players"]["rows"], 300)
+        self.assertEqual(first["tables"]["friend_codes"]["rows"], 300)
+        self.assertEqual(first["tables"]["analytics_events"]["rows"], 2_000)
+        self.assertGreater(first["tables"]["friends"]["rows"], 0)
+        self.assertEqual(first["tables"]["friends"]["rows"], first["friends_stored"])
+        self.assertIn("idx_analytics_events_name_ts", first["indexes"])
+        self.assertEqual(first["token_matches"], 1)
+
+    def test_friend_codes_are_unique(self):
+        codes = {friend_code(i) for i in range(50_000)}
+        self.assertEqual(len(codes), 50_000)
+        self.assertTrue(all(len(c) == 6 for c in codes))
+
+
+if __name__ == "__main__":
+    unittest.main()
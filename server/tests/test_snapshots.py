@@ -0,0 +1,138 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from server import snapshots
+from server.histogram import read_buckets, rebuild_region
+from server.snapshots import close_season, current_epoch, reset_region, snapshot_region, start_epoch
+from server.writebehind import ScoreBuffer, write_score
+
+
+class _Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return time.perf_counter()
+
+
+class TestSeasonSnapshots(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix="kbbq_snapshot_test_")
+        self._env = patch.dict(os.environ, {"KBBQ_DB_PATH": os.path.join(self._tmp.name, "season.db")})
+        self._env.start()
+        from server.db import get_db
+
+        self.conn = get_db()
+        # Ties on score are ranked by player_id; p_07 has no player row and is skipped.
+        for i in range(23):
+            player_id = f"p_{i:02d}"
+            if i != 7:
+                self.conn.execute(
+                    "INSERT INTO players(player_id, device_id, display_name, token_sha256, region, created_at) "
+                    "VALUES(?,?,?,?,?,0)",
+                    (player_id, f"device-{i}", f"Player {i}", f"sha-{i}", "KR"),
+                )
+            self.conn.execute(
+                "INSERT INTO leaderboard(region, player_id, score, updated_at) VALUES('KR', ?, ?, 100)",
+                (player_id, float(1000 + (i % 5) * 100)),
+            )
+        self.conn.commit()
+        rebuild_region(self.conn, "KR")
+
+    def tearDown(self):
+        self.conn.close()
+        self._env.stop()
+        self._tmp.cleanup()
+
+    def test_chunked_snapshot_ranks_like_one_sort(self):
+        # Leftover of an interrupted run: no seasons row, so it is cleared and rewritten.
+        self.conn.execute(
+            "INSERT INTO leaderboard_snapshots(season, region, rank, player_id, display_name, score) "
+            "VALUES('S1', 'KR', 99, 'ghost', 'Ghost', 1.0)"
+        )
+        self.conn.commit()
+
+        entries = snapshot_region(self.conn, "KR", "S1", now=200, batch_size=4)
+        self.assertEqual(entries, 22)
+        rows = self.conn.execute(
+            "SELECT rank, player_id, score FROM leaderboard_snapshots WHERE season = 'S1' AND region = 'KR' ORDER BY rank"
+        ).fetchall()
+        expected = self.conn.execute(
+            "SELECT l.player_id, l.score FROM leaderboard l JOIN players p ON p.player_id = l.player_id "
+            "WHERE l.region = 'KR' ORDER BY l.score DESC, l.player_id"
+        ).fetchall()
+        self.assertEqual([int(r["rank"]) for r in rows], list(range(1, 23)))
+        self.assertEqual([(r["player_id"], r["score"]) for r in rows], [(r["player_id"], r["score"]) for r in expected])
+        season = self.conn.execute("SELECT entries, created_at FROM leaderboard_seasons WHERE season = 'S1'").fetchone()
+        self.assertEqual((season["entries"], season["created_at"]), (22, 200))
+        with self.assertRaises(ValueError):
+            snapshot_region(self.conn, "KR", "S1")
+
+    def test_reset_keeps_scores_from_the_new_season(self):
+        snapshot_region(self.conn, "KR", "S1", now=200, batch_size=4)
+        self.assertEqual(current_epoch(self.conn, "KR"), (0, 0))
+        self.assertEqual(start_epoch(self.conn, "KR", now=300), 1)
+
+        # Submits land between the epoch bump and the batched delete: a lower score than
+        # last season's best replaces it, a score buffered before the boundary is dropped.
+        buffer = ScoreBuffer()
+        buffer.add("KR", "p_04", 5.0, now=301)
+        buffer.add("KR", "p_03", 50_000.0, now=299)
+        buffer.add("KR", "p_new", 7.0, now=302)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.snapshot()["dropped_stale"], 1)
+        self.assertEqual(buffer.pending_count(), 0)
+
+        deleted = reset_region(self.conn, "KR", epoch=1, batch_size=5)
+        self.assertEqual(deleted, 22)
+        rows = self.conn.execute("SELECT player_id, score, season_epoch FROM leaderboard ORDER BY player_id").fetchall()
+        self.assertEqual([tuple(r) for r in rows], [("p_04", 5.0, 1), ("p_new", 7.0, 1)])
+        rebuild_region(self.conn, "KR")
+        self.assertEqual(sum(count for _, count in read_buckets(self.conn, "KR")), 2)
+        # The frozen season is untouched by the reset.
+        self.assertEqual(
+            self.conn.execute("SELECT COUNT(*) FROM leaderboard_snapshots WHERE season = 'S1'").fetchone()[0], 22
+        )
+
+    def test_submits_during_the_copy_belong_to_the_closing_season(self):
+        clock = _Clock(1_000)
+        buffer = ScoreBuffer()
+        copy = snapshot_region
+
+        def slow_copy(db, region, season, **kwargs):
+            entries = copy(db, region, season, **kwargs)
+            # The copy took 2 s; both submits land after it, before the epoch switch.
+            clock.now = 1_002
+            write_score(self.conn, "KR", "p_direct", 77.0, now=1_002)
+            buffer.add("KR", "p_buffered", 88.0, now=1_002)
+            clock.now = 1_003
+            return entries
+
+        with patch.object(snapshots, "time", clock), patch.object(snapshots, "snapshot_region", slow_copy):
+            report = close_season(self.conn, "KR", "S1", reset=True)
+
+        self.assertEqual(current_epoch(self.conn, "KR"), (1, 1_003))
+        created = self.conn.execute("SELECT created_at FROM leaderboard_seasons WHERE season = 'S1'").fetchone()[0]
+        self.assertEqual(created, 1_000)
+        # Direct: written in the old epoch, removed by the reset. Buffered: dropped at flush.
+        self.assertEqual(report["reset_deleted"], 24)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.snapshot()["dropped_stale"], 1)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM leaderboard").fetchone()[0], 0)
+
+        # Submits after the switch start the new season.
+        write_score(self.conn, "KR", "p_direct", 5.0, now=1_004)
+        buffer.add("KR", "p_buffered", 6.0, now=1_004)
+        self.assertEqual(buffer.flush(), 1)
+        rows = self.conn.execute("SELECT player_id, score, season_epoch FROM leaderboard ORDER BY player_id").fetchall()
+        self.assertEqual([tuple(r) for r in rows], [("p_buffered", 6.0, 1), ("p_direct", 5.0, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+"""Optional write-behind buffer for leaderboard score submits.
+
+With KBBQ_WRITE_BEHIND=1, /leaderboard/submit only records the best pending score per
+(region, player) in memory. `flush_scores()` writes the coalesced maxima in one
+transaction per region (upsert keeping MAX(score)); it runs when the buffer reaches
+KBBQ_WRITE_BEHIND_MAX_PENDING, every KBBQ_WRITE_BEHIND_INTERVAL_MS from the lifespan
+task, and once more on shutdown.
+
+The buffer is process-local: /leaderboard/top on the same worker merges pending scores,
+other workers see them after the flush.
+"""
+
+import threading
+import time
+import uuid
+from contextlib import closing
+from typing import Optional
+
+from server import histogram, memstats, queries
+from server.db import get_leaderboard_db
+from server.envutil import env_bool, env_int
+from server.etags import bump_version, leaderboard_scope
+from server.snapshots import current_epoch
+
+
+def write_behind_enabled() -> bool:
+    return env_bool("KBBQ_WRITE_BEHIND")
+
+
+def flush_interval_seconds() -> float:
+    return env_int("KBBQ_WRITE_BEHIND_INTERVAL_MS", 1000, minimum=10) / 1000.0
+
+
+def max_pending() -> int:
+    return env_int("KBBQ_WRITE_BEHIND_MAX_PENDING", 5000, minimum=1)
+
+
+class ScoreBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (region, player_id) -> (best score, updated_at)
+        self._pending: dict[tuple[str, str], tuple[float, int]] = {}
+        # Drained but not yet committed; still visible to reads.
+        self._inflight: dict[tuple[str, str], tuple[float, int]] = {}
+        self._generations: dict[str, int] = {}
+        # Distinguishes ETags across restarts and workers (generations restart at 0).
+        self.epoch = uuid.uuid4().hex[:8]
+        self.counters = {
+            "submits": 0,
+            "improvements": 0,
+            "rows_flushed": 0,
+            "flushes": 0,
+            "flush_seconds": 0.0,
+            "dropped_stale": 0,
+        }
+
+    def add(self, region: str, player_id: str, score: float, now: Optional[int] = None) -> int:
+        """Record a submit; returns the number of pending rows."""
+        key = (region, player_id)
+        now = int(time.time()) if now is None else int(now)
+        with self._lock:
+            self.counters["submits"] += 1
+            best = self._pending.get(key) or self._inflight.get(key)
+            if best is None or score > best[0]:
+                self._pending[key] = (score, now)
+                self._generations[region] = self._generations.get(region, 0) + 1
+                self.counters["improvements"] += 1
+            return len(self._pending)
+
+    def generation(self, region: str) -> str:
+        with self._lock:
+            return f"{self.epoch}.{self._generations.get(region, 0)}"
+
+    def pending_top(self, region: str, limit: int) -> list[tuple[str, float]]:
+        with self._lock:
+            best: dict[str, float] = {}
+            for source in (self._inflight, self._pending):
+                for (r, player_id), (score, _) in source.items():
+                    if r == region and score > best.get(player_id, float("-inf")):
+                        best[player_id] = score
+        return sorted(best.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def pending_score(self, region: str, player_id: str) -> Optional[float]:
+        with self._lock:
+            best = [v[0] for v in (self._pending.get((region, player_id)), self._inflight.get((region, player_id))) if v]
+        return max(best) if best else None
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending) + len(self._inflight)
+
+    def buffered_entries(self) -> list[tuple]:
+        """Copy of every buffered ((region, player_id), (score, updated_at)): pending and in flight."""
+        with self._lock:
+            return [*self._pending.items(), *self._inflight.items()]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            counters["pending"] = len(self._pending) + len(self._inflight)
+        # Submits per written row: 1.0 means no coalescing happened.
+        counters["coalescing_ratio"] = round(counters["submits"] / counters["rows_flushed"], 3) if counters["rows_flushed"] else 0.0
+        return counters
+
+    def flush(self, region: Optional[str] = None) -> int:
+        """Write pending maxima (one region, or all) to SQLite. Returns rows written."""
+        with self._flush_lock:
+            with self._lock:
+                if region is None:
+                    self._inflight, self._pending = self._pending, {}
+                else:
+                    self._inflight = {k: v for k, v in self._pending.items() if k[0] == region}
+                    for key in self._inflight:
+                        del self._pending[key]
+                batch = dict(self._inflight)
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            by_region: dict[str, list[tuple]] = {}
+            for (r, player_id), (score, updated_at) in batch.items():
+                by_region.setdefault(r, []).append((r, player_id, score, updated_at))
+            written = 0
+            try:
+                for r, rows in sorted(by_region.items()):
+                    with closing(get_leaderboard_db(r)) as lb:
+                        # Old bests feed the histogram moves: read them under the write
+                        # lock so no other writer moves the same player in between.
+                        lb.execute("BEGIN IMMEDIATE")
+                        epoch, started_at = current_epoch(lb, r)
+                        # Submits buffered before a season reset belong to the closed season.
+                        stale = [row for row in rows if row[3] < started_at]
+                        rows = [(*row, epoch) for row in rows if row[3] >= started_at]
+                        moves = []
+                        for _, player_id, score, _, _ in rows:
+                            old = lb.execute(queries.LEADERBOARD_BEST, (r, player_id)).fetchone()
+                            if old is None:
+                                moves.append((None, score))
+                            elif int(old["season_epoch"]) < epoch or score > float(old["score"]):
+                                moves.append((float(old["score"]), score))
+                        lb.executemany(queries.LEADERBOARD_UPSERT_MAX, rows)
+                        histogram.record_moves(lb, r, moves)
+                        bump_version(lb, leaderboard_scope(r))
+                        lb.commit()
+                    written += len(rows)
+                    with self._lock:
+                        self.counters["dropped_stale"] += len(stale)
+                        for row in rows + stale:
+                            self._inflight.pop((row[0], row[1]), None)
+            except Exception:
+                # Put unwritten rows back; a newer pending score for the same key wins.
+                with self._lock:
+                    for key, value in self._inflight.items():
+                        current = self._pending.get(key)
+                        if current is None or value[0] > current[0]:
+                            self._pending[key] = value
+                    self._inflight = {}
+                raise
+            finally:
+                with self._lock:
+                    self.counters["rows_flushed"] += written
+                    self.counters["flushes"] += 1
+                    self.counters["flush_seconds"] += time.perf_counter() - started
+            return written
+
+
+def write_score(lb, region: str, player_id: str, score: float, now: Optional[int] = None) -> None:
+    """Synchronous submit (write-behind off): keep the player's best of the current season; commits."""
+    now = int(time.time()) if now is None else int(now)
+    # Take the write lock before reading the old best: a concurrent submit or flush
+    # must not move the same player between histogram buckets twice.
+    lb.execute("BEGIN IMMEDIATE")
+    epoch, _ = current_epoch(lb, region)
+    existing = lb.execute(queries.LEADERBOARD_BEST, (region, player_id)).fetchone()
+    if existing is None:
+        lb.execute(queries.LEADERBOARD_INSERT, (region, player_id, score, now, epoch))
+        histogram.record_moves(lb, region, [(None, score)])
+        bump_version(lb, leaderboard_scope(region))
+    else:
+        old = float(existing["score"])
+        # A best from a closed season (reset still in progress) does not carry over.
+        best = score if int(existing["season_epoch"]) < epoch else max(old, score)
+        lb.execute(queries.LEADERBOARD_UPDATE, (best, now, epoch, region, player_id))
+        if best != old:
+            histogram.record_moves(lb, region, [(old, best)])
+            bump_version(lb, leaderboard_scope(region))
+    lb.commit()
+
+
+SCORE_BUFFER = ScoreBuffer()
+memstats.register("write_behind_pending", SCORE_BUFFER.buffered_entries)
+
+
+def flush_scores(region: Optional[str] = None) -> int:
+    return SCORE_BUFFER.flush(region)
@@ -30,10 +30,25 @@ for i in {1..30}; do
   sleep 2
 done
 
+echo "[DEPLOY] waiting for /readiness (startup warmup) ..."
+ready=0
+for i in {1..30}; do
+  if curl -sS --max-time 3 "$BASE_URL/readiness" | python3 -c 'import sys,json; sys.exit(0 if json.load(sys.stdin).get("ready") else 1)' 2>/dev/null; then
+    ready=1
+    break
+  fi
+  sleep 2
+done
+
 echo "[DEPLOY] health:"
 curl -sS --max-time 5 "$BASE_URL/health" | python3 -m json.tool
 
 echo "[DEPLOY] readiness:"
-curl -sS --max-time 5 "$BASE_URL/readiness" | python3 -m json.tool
+curl -sS --max-time 5 "$BASE_URL/readiness" | python3 -m json.tool || true
+
+if [ "$ready" -ne 1 ]; then
+  echo "[DEPLOY] service did not become ready; failing the deploy"
+  exit 1
+fi
 
 echo "[DEPLOY] deployment completed"